@@ -4,51 +4,28 @@ from __future__ import print_function
 
 import sys
 import argparse
-import csv
+import logging
+from collections import Counter
 
 import fastavro
-from collections import defaultdict
+import pyarrow as pa
 
 import roskinlib
 from roskinlib.utils import open_compressed
-
-def best_vdj_score(parse):
-    best_v_score = None
-    best_d_score = None
-    best_j_score = None
-
-    if parse is not None:
-        for a in parse['alignments']:
-            if a['type'] == 'V':
-                if best_v_score is None:
-                    best_v_score = a['score']
-            elif a['type'] == 'D':
-                if best_d_score is None:
-                    best_d_score = a['score']
-            elif a['type'] == 'J':
-                if best_j_score is None:
-                    best_j_score = a['score']
-
-    return best_v_score, best_d_score, best_j_score
-
-def get_parse_query(parse):
-    if parse is None:
-        return None
-    else:
-        alignment = parse['alignments'][0]
-        assert alignment['type'] == 'Q'
-        return alignment['alignment']
-
-def make_slice(range_):
-    return slice(range_['start'], range_['stop'])
-
-def calc_type(record):
-    type_ = record['sequence']['annotations']['target1']
-    vh, framework = record['sequence']['annotations']['target2'].split('_')
-    if type_ == 'IGHJ':
-        return 'DNA-' + framework
-    else:
-        return type_
+from roskinlib.seq_rec import get_parse_query, make_slice
+from roskinlib.stats import RecordView
+from roskinlib.record_batches import RecordBatchWriter, ungapped_lengths, write_histogram
+
+def output_schema(lineage):
+    fields = [pa.field('subject', pa.string()),
+              pa.field('source',  pa.string()),
+              pa.field('type',    pa.string())]
+    if lineage:
+        fields.append(pa.field('lineage', pa.string()))
+    fields += [pa.field('v_j_in_frame',   pa.bool_()),
+               pa.field('has_stop_codon', pa.bool_()),
+               pa.field('cdr3_length',    pa.int32())]
+    return pa.schema(fields)
 
 def main():
     parser = argparse.ArgumentParser(description='get the CDR3 length from an Avro file',
@@ -56,50 +33,66 @@ def main():
     parser.add_argument('parse_label', metavar='label', help='the parse label to use for the parse')
     parser.add_argument('filenames', metavar='file', nargs='+', help='the Avro file to read')
     parser.add_argument('--lineage',     '-l', metavar='L', help='the lineage label to use')
-    parser.add_argument('--min-v-score', '-v', metavar='S', default=70, help='minimum V-segment score')
-    parser.add_argument('--min-j-score', '-j', metavar='S', default=26, help='minimum J-segment score')
+    parser.add_argument('--min-v-score', '-v', metavar='S', type=float, default=70, help='minimum V-segment score')
+    parser.add_argument('--min-j-score', '-j', metavar='S', type=float, default=26, help='minimum J-segment score')
+    # output
+    parser.add_argument('--output', '-o', metavar='F', default='-', help='the file for the per-record table, - for stdout')
+    parser.add_argument('--format', choices=['parquet', 'csv'], help='the format of the per-record table, by default parquet for a .parquet output file and csv otherwise')
+    parser.add_argument('--histogram', metavar='F', help='the CSV file for the per-subject CDR3 length histogram, defaults to the output file with .histogram.csv added')
+    parser.add_argument('--batch-size', '-b', metavar='B', type=int, default=100000, help='the number of records in each batch')
     args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
 
-    writer = None
-
-    for filename in args.filenames:
-        with open_compressed(filename, 'rb') as read_handle:
-            reader = fastavro.reader(read_handle)
+    if args.format is None:
+        args.format = 'parquet' if args.output.endswith('.parquet') else 'csv'
 
-            for record in reader:
-                parse = record['parses'][args.parse_label]
-                v_score, _, j_score = best_vdj_score(parse)
+    schema = output_schema(args.lineage)
+    histogram = Counter()
 
-                if v_score is not None and j_score is not None and \
-                        v_score >= args.min_v_score and j_score >= args.min_j_score:
+    # the columns of the batch, the CDR3 lengths are worked out from the alignments when it is written
+    columns = None
+    cdr3_alignments = None
 
-                    if 'CDR3' in parse['ranges']:
-                        subject = record['subject']
-                        type_ = record['sequence']['annotations']['target1']
+    def write_batch():
+        cdr3_lengths = ungapped_lengths(cdr3_alignments)
+        histogram.update(zip(columns[0], cdr3_lengths.tolist()))
+        writer.write_columns(columns + [cdr3_lengths])
 
-                        v_j_in_frame = parse['v_j_in_frame']
-                        has_stop_codon = parse['has_stop_codon']
+    with RecordBatchWriter(args.output, schema, args.format) as writer:
+        for filename in args.filenames:
+            logging.info('processing file %s', filename)
+            with open_compressed(filename, 'rb') as read_handle:
+                reader = fastavro.reader(read_handle)
 
-                        cdr3_slice = make_slice(parse['ranges']['CDR3'])
-                        query_sequence = get_parse_query(parse)
-                        cdr3_sequence = query_sequence[cdr3_slice]
-                        cdr3_length = len(cdr3_sequence.replace('-', ''))
+                for record in reader:
+                    view = RecordView(record, args.parse_label, args.lineage, args.min_v_score, args.min_j_score)
+                    if view.good_parse and 'CDR3' in view.parse['ranges']:
+                        parse = view.parse
 
-                        if writer is None:
-                            if args.lineage:
-                                writer = csv.DictWriter(sys.stdout, fieldnames=['subject', 'source', 'type', 'lineage', 'v_j_in_frame', 'has_stop_codon', 'cdr3_length'])
-                            else:
-                                writer = csv.DictWriter(sys.stdout, fieldnames=['subject', 'source', 'type',            'v_j_in_frame', 'has_stop_codon', 'cdr3_length'])
-                            writer.writeheader()
+                        if columns is None:
+                            columns = [[] for _ in range(len(schema) - 1)]
+                            cdr3_alignments = []
 
-                        row = {'subject': record['subject'], 'source': record['source'],
-                               'type': type_, 'v_j_in_frame': v_j_in_frame, 'has_stop_codon': has_stop_codon,
-                               'cdr3_length': cdr3_length}
+                        row = [view.subject, view.source, view.type]
                         if args.lineage:
-                            if args.lineage in record['lineages']:
-                                row['lineage'] = record['lineages'][args.lineage]
-
-                        writer.writerow(row)
+                            row.append(view.lineage)
+                        row += [view.v_j_in_frame, view.has_stop_codon]
+                        for column, value in zip(columns, row):
+                            column.append(value)
+                        cdr3_alignments.append(get_parse_query(parse)[make_slice(parse['ranges']['CDR3'])])
+
+                        if len(cdr3_alignments) >= args.batch_size:
+                            write_batch()
+                            columns = None
+
+        if columns is not None:
+            write_batch()
+        logging.info('wrote %d records', writer.row_count)
+
+    if args.histogram is None and args.output != '-':
+        args.histogram = args.output + '.histogram.csv'
+    if args.histogram:
+        write_histogram(args.histogram, ['subject', 'cdr3_length'], histogram)
 
 if __name__ == '__main__':
     sys.exit(main())
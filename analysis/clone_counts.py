@@ -6,39 +6,54 @@ import sys
 import argparse
 import csv
 
-import fastavro
-from collections import defaultdict
-
 import roskinlib
-from roskinlib.utils import open_compressed
+from roskinlib.stats import StatsEngine, write_partial_table, read_partial_table
+
+def count(args):
+    engine = StatsEngine(['clone_counts'], lineage_label=args.lineage_label)
+    for filename in args.filenames:
+        engine.add_file(filename)
+    return engine
 
+def merge(args):
+    engine = read_partial_table(args.partial_filenames[0])
+    assert engine.names == ['clone_counts'], 'the partial results are not clone counts'
+    for filename in args.partial_filenames[1:]:
+        engine.merge(read_partial_table(filename))
+    return engine
 
 def main():
     parser = argparse.ArgumentParser(description='get the clone counts in the given Avro files',
+            epilog='partial counts written with --partial are added up with: %(prog)s merge partial.parquet ...',
             formatter_class=argparse.ArgumentDefaultsHelpFormatter)
     parser.add_argument('lineage_label', metavar='label', help='the clone label to use')
     parser.add_argument('filenames', metavar='file', nargs='+', help='the Avro files to read')
-    args = parser.parse_args()
+    parser.set_defaults(function=count)
 
-    clones_counts = defaultdict(int)
+    # merging is its own mode, given by a first argument of merge, so the counting arguments stay as they were
+    merge_parser = argparse.ArgumentParser(prog=parser.prog + ' merge',
+            description='add up partial clone counts', formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    merge_parser.add_argument('partial_filenames', metavar='partial.parquet', nargs='+', help='the partial counts to add up')
+    merge_parser.set_defaults(function=merge)
 
-    for filename in args.filenames:
-        with open_compressed(filename, 'rb') as read_handle:
-            reader = fastavro.reader(read_handle)
+    for mode_parser in [parser, merge_parser]:
+        mode_parser.add_argument('--partial', metavar='F', help='write the counts as a Parquet partial result for a later merge instead of CSV')
+
+    if len(sys.argv) > 1 and sys.argv[1] == 'merge':
+        args = merge_parser.parse_args(sys.argv[2:])
+    else:
+        args = parser.parse_args()
 
-            for record in reader:
-                if args.lineage_label in record['lineages']:
-                    subject = record['subject']
-                    source = record['source']
-                    type_ = record['sequence']['annotations']['target1']
-                    lineage = record['lineages'][args.lineage_label]
+    engine = args.function(args)
 
-                    clones_counts[(subject, source, type_, lineage)] += 1
+    if args.partial:
+        write_partial_table(args.partial, engine)
+        return
 
     writer = csv.DictWriter(sys.stdout, fieldnames=['subject', 'source', 'type', 'lineage', 'read_count'])
     writer.writeheader()
 
-    for (subject, source, type_, lineage), read_count in clones_counts.items():
+    for subject, source, type_, lineage, read_count in engine.statistics['clone_counts'].rows():
         row = {'subject': subject,
                'source': source,
                'type': type_,
@@ -10,11 +10,12 @@ import tempfile
 from multiprocessing import Pool
 import logging
 import time
+import itertools
 
 from Bio import SeqIO
 
 from roskinlib import seqclust
-from roskinlib.warehouse import DirectoryWarehouse
+from roskinlib.warehouse import DirectoryWarehouse, PackedWarehouse
 
 
 def concatinate_files(filenames, output_handle):
@@ -24,16 +25,20 @@ def concatinate_files(filenames, output_handle):
                 output_handle.write(line)
 
 class ClusterProcessor:
-    def __init__(self, min_subjects, positive_subjects, negative_subjects):
+    def __init__(self, min_subjects, positive_subjects, negative_subjects, clusterer='cd-hit'):
         self.min_subjects = min_subjects
         self.positive_subjects = positive_subjects
         self.negative_subjects = negative_subjects
+        self.clusterer = clusterer
     def __call__(self, args):
         v_segment, j_segment, cdr3_length, files = args
 
-        all_subjects = set(self.positive_subjects) | set(self.negative_subjects)
-
-        results = []
+        # cluster in-process, the sequences in a group all have the same length
+        if self.clusterer == 'greedy':
+            sequence_dict = SeqIO.to_dict(itertools.chain.from_iterable(SeqIO.parse(f, 'fasta') for f in files))
+            clusters = seqclust.GreedyClustIterator(((i, str(r.seq)) for i, r in sequence_dict.items()),
+                                                    0.90, throw_away_length=4)
+            return self.filter_clusters(v_segment, j_segment, cdr3_length, clusters, lambda: sequence_dict)
 
         # create a temp dir to hold the clustering files
         with tempfile.TemporaryDirectory() as temp_dir_name:
@@ -66,38 +71,49 @@ class ClusterProcessor:
 
             # iterate over each cluster
             with open(cluster_structure_filename, 'rt') as clust_struct_handle:
-                for cluster in seqclust.CDHITClustIterator(clust_struct_handle):
-                    cluster_subjects = set()
-                    cluster_lineages = set()
-                    cluster_reads = set()
-                    cluster_number = int(cluster.name.split(' ')[1])
-                    # ... and each member
-                    for member in cluster:
-                        cluster_reads.add(member.name)  # add the sequence name so we can look it up later
-                        # split the read members to get the parts
-                        for read_label in member.name.split(','):
-                            subject_id, lineage_id, read_id = read_label.split(';')
-                            cluster_subjects.add(subject_id)
-                            cluster_lineages.add(lineage_id)
-
-                    # make sure extra subject didn't get into the dataset
-                    #if not cluster_subjects.issubset(all_subjects):
-                    #    for p in cluster_subjects - all_subjects:
-                    #        print(p, file=sys.stderr)
-                    #    assert cluster_subjects.issubset(all_subjects)
-
-                    if len(cluster_lineages) >= self.min_subjects:
-                        sequence_dict = SeqIO.to_dict(SeqIO.parse(sequence_filename, 'fasta'))
-
-                        reads = [(read, str(sequence_dict[read].seq)) for read in cluster_reads]
-                        probe_definition = v_segment, j_segment, cdr3_length, cluster_number, reads
-                        results.append(probe_definition)
+                clusters = seqclust.CDHITClustIterator(clust_struct_handle)
+                return self.filter_clusters(v_segment, j_segment, cdr3_length, clusters,
+                                            lambda: SeqIO.to_dict(SeqIO.parse(sequence_filename, 'fasta')))
 
-        return results
+    def filter_clusters(self, v_segment, j_segment, cdr3_length, clusters, load_sequences):
+        all_subjects = set(self.positive_subjects) | set(self.negative_subjects)
 
-def filter_groups(root_dir, min_part_count, min_cdr3_len, subjects):
-    warehouse = DirectoryWarehouse(root_dir, 'v_segment', 'j_segment', 'cdr3_len', 'subject')
+        results = []
+
+        # the sequences are only loaded, once, if a cluster passes the filter
+        sequence_dict = None
+
+        for cluster in clusters:
+            cluster_subjects = set()
+            cluster_lineages = set()
+            cluster_reads = set()
+            cluster_number = int(cluster.name.split(' ')[1])
+            # ... and each member
+            for member in cluster:
+                cluster_reads.add(member.name)  # add the sequence name so we can look it up later
+                # split the read members to get the parts
+                for read_label in member.name.split(','):
+                    subject_id, lineage_id, read_id = read_label.split(';')
+                    cluster_subjects.add(subject_id)
+                    cluster_lineages.add(lineage_id)
+
+            # make sure extra subject didn't get into the dataset
+            #if not cluster_subjects.issubset(all_subjects):
+            #    for p in cluster_subjects - all_subjects:
+            #        print(p, file=sys.stderr)
+            #    assert cluster_subjects.issubset(all_subjects)
+
+            if len(cluster_lineages) >= self.min_subjects:
+                if sequence_dict is None:
+                    sequence_dict = load_sequences()
+
+                reads = [(read, str(sequence_dict[read].seq)) for read in cluster_reads]
+                probe_definition = v_segment, j_segment, cdr3_length, cluster_number, reads
+                results.append(probe_definition)
 
+        return results
+
+def filter_groups(warehouse, min_part_count, min_cdr3_len, subjects):
     for signature in warehouse.partitions('.fasta', subject=None):
         v_segment, j_segment, cdr3_len = signature
         cdr3_len = int(cdr3_len)
@@ -121,6 +137,13 @@ def main(arguments):
     parser.add_argument('--min-len',      metavar='L', type=int, default=5, help='the minimum number of amino acids in a probe')
     parser.add_argument('--positive', nargs='+', metavar='P', default=[], help='list of + participants')
     parser.add_argument('--negative', nargs='+', metavar='N', default=[], help='list of - participants')
+    # clustering
+    parser.add_argument('--clusterer', choices=['cd-hit', 'greedy'], default='cd-hit',
+            help='cluster with the cd-hit program or the built-in greedy clusterer')
+    parser.add_argument('--packed', action='store_true', help='the input warehouse is packed into a single file')
+    # parallel processing
+    parser.add_argument('--workers',    '-w', metavar='W', type=int, default=16, help='the number of worker processes')
+    parser.add_argument('--chunk-size', '-c', metavar='C', type=int, default=4, help='the number of groups to send to a worker at a time')
 
     args = parser.parse_args(arguments)
     logging.basicConfig(level=logging.INFO)
@@ -131,24 +154,42 @@ def main(arguments):
 
     subjects = set(args.positive) | set(args.negative)
 
-    filtered_groups = filter_groups(args.input_warehouse_root_dir, args.min_subjects, args.min_len, subjects)
+    input_warehouse_class = PackedWarehouse if args.packed else DirectoryWarehouse
+    input_warehouse = input_warehouse_class(args.input_warehouse_root_dir,
+            'v_segment', 'j_segment', 'cdr3_len', 'subject')
+
+    filtered_groups = filter_groups(input_warehouse, args.min_subjects, args.min_len, subjects)
 
     output_warehouse = DirectoryWarehouse(args.output_warehouse_root_dir,
             'v_segment', 'j_segment', 'cdr3_len', 'cluster')
 
-    processor = ClusterProcessor(args.min_subjects, args.positive, args.negative)
-    task_pool = Pool(processes=16)
-
-    results = task_pool.map(processor, filtered_groups)
-    for r in results:
-        for probe_definition in r:
-            v_segment, j_segment, cdr3_length, cluster_number, reads = probe_definition
-    
-            with output_warehouse.open('.fasta', 'wt', v_segment=v_segment,
-                    j_segment=j_segment, cdr3_len=cdr3_length,
-                    cluster=cluster_number) as probe_handle:
-                for ident, sequence in reads:
-                    probe_handle.write('>%s\n%s\n' % (ident, sequence))
+    processor = ClusterProcessor(args.min_subjects, args.positive, args.negative, clusterer=args.clusterer)
+    start_time = time.time()
+    group_count = 0
+    probe_count = 0
+
+    # write the probes as each group finishes
+    with Pool(processes=args.workers) as task_pool, output_warehouse.writer('wt') as probe_writer:
+        for r in task_pool.imap_unordered(processor, filtered_groups, chunksize=args.chunk_size):
+            group_count += 1
+            for probe_definition in r:
+                v_segment, j_segment, cdr3_length, cluster_number, reads = probe_definition
+
+                probe_writer.write('.fasta', ''.join('>%s\n%s\n' % (ident, sequence) for ident, sequence in reads),
+                        v_segment=v_segment, j_segment=j_segment, cdr3_len=cdr3_length, cluster=cluster_number)
+                probe_count += 1
+
+            if group_count % 1000 == 0:
+                elapsed_time = time.time() - start_time
+                logging.info('processed %d groups, found %d probes, %0.1f groups/second',
+                        group_count, probe_count, group_count / elapsed_time)
+
+    input_warehouse.close()
+
+    logging.info('processed %d groups, found %d probes', group_count, probe_count)
+    logging.info('made %d output directories', output_warehouse.counters['directories_made'])
+    elapsed_time = time.time() - start_time
+    logging.info('elapsed time %s', time.strftime('%H hours, %M minutes, %S seconds', time.gmtime(elapsed_time)))
 
     return 0
 
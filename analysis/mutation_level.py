@@ -4,114 +4,113 @@ from __future__ import print_function
 
 import sys
 import argparse
-import csv
+import logging
+import math
+from collections import Counter
 
 import fastavro
-from collections import defaultdict
+import numpy as np
+import pyarrow as pa
 
 import roskinlib
 from roskinlib.utils import open_compressed
-
-def best_vdj_score(parse):
-    best_v       = None
-    best_v_score = None
-    best_d       = None
-    best_d_score = None
-    best_j       = None
-    best_j_score = None
-
-    if parse is not None:
-        for a in parse['alignments']:
-            if a['type'] == 'V':
-                if best_v_score is None:
-                    best_v = a
-                    best_v_score = a['score']
-            elif a['type'] == 'D':
-                if best_d_score is None:
-                    best_d = a
-                    best_d_score = a['score']
-            elif a['type'] == 'J':
-                if best_j_score is None:
-                    best_j = a
-                    best_j_score = a['score']
-
-    return best_v, best_v_score, best_d, best_d_score, best_j, best_j_score
-
-def get_parse_query(parse):
-    if parse is None:
-        return None
-    else:
-        alignment = parse['alignments'][0]
-        assert alignment['type'] == 'Q'
-        return alignment
-
-__mutation_level_bases = set(['A', 'C', 'G', 'T', 'N'])
-def mutation_level(q_align, v_align):
-    diff_count = 0
-    same_count = 0
-
-    for q, v in zip(q_align, v_align):
-        if q != '-': # skip if gap
-            if v == '.':
-                same_count += 1
-            elif v in __mutation_level_bases:
-                diff_count += 1
-
-    mut_level = diff_count / (diff_count + same_count)
-    return mut_level
+from roskinlib.seq_rec import best_alignment, get_parse_query
+from roskinlib.record_batches import RecordBatchWriter, mismatch_counts, write_histogram
+from roskinlib.stats import RecordView, bin_lower_edge
+
+def output_schema(lineage):
+    fields = [pa.field('subject', pa.string()),
+              pa.field('source',  pa.string()),
+              pa.field('type',    pa.string())]
+    if lineage:
+        fields.append(pa.field('lineage', pa.string()))
+    fields += [pa.field('v_j_in_frame',   pa.bool_()),
+               pa.field('has_stop_codon', pa.bool_()),
+               pa.field('v_mismatches',   pa.int32()),
+               pa.field('v_matches',      pa.int32()),
+               pa.field('mutation_level', pa.float64())]
+    return pa.schema(fields)
 
 def main():
-    parser = argparse.ArgumentParser(description='get the CDR3 length from an Avro file',
+    parser = argparse.ArgumentParser(description='get the V-segment mutation level from an Avro file',
             formatter_class=argparse.ArgumentDefaultsHelpFormatter)
     parser.add_argument('parse_label', metavar='label', help='the parse label to use for the parse')
     parser.add_argument('filenames', metavar='file', nargs='+', help='the Avro file to read')
     parser.add_argument('--lineage',     '-l', metavar='L', help='the lineage label to use')
-    parser.add_argument('--min-v-score', '-v', metavar='S', default=70, help='minimum V-segment score')
-    parser.add_argument('--min-j-score', '-j', metavar='S', default=26, help='minimum J-segment score')
+    parser.add_argument('--min-v-score', '-v', metavar='S', type=float, default=70, help='minimum V-segment score')
+    parser.add_argument('--min-j-score', '-j', metavar='S', type=float, default=26, help='minimum J-segment score')
+    # output
+    parser.add_argument('--output', '-o', metavar='F', default='-', help='the file for the per-record table, - for stdout')
+    parser.add_argument('--format', choices=['parquet', 'csv'], help='the format of the per-record table, by default parquet for a .parquet output file and csv otherwise')
+    parser.add_argument('--histogram', metavar='F', help='the CSV file for the per-subject mutation level histogram, defaults to the output file with .histogram.csv added')
+    parser.add_argument('--bin-width', metavar='W', type=float, default=0.01, help='the width of the mutation level histogram bins')
+    parser.add_argument('--batch-size', '-b', metavar='B', type=int, default=100000, help='the number of records in each batch')
     args = parser.parse_args()
-
-    writer = None
-
-    for filename in args.filenames:
-        with open_compressed(filename, 'rb') as read_handle:
-            reader = fastavro.reader(read_handle)
-
-            for record in reader:
-                parse = record['parses'][args.parse_label]
-                best_v, v_score, _, _, _, j_score = best_vdj_score(parse)
-
-                if v_score is not None and j_score is not None and \
-                        v_score >= args.min_v_score and j_score >= args.min_j_score:
-
-                    subject = record['subject']
-                    type_ = record['sequence']['annotations']['target1']
-
-                    v_j_in_frame = parse['v_j_in_frame']
-                    has_stop_codon = parse['has_stop_codon']
-
-                    best_q = get_parse_query(parse)
-                    assert best_q['padding']['start'] == 0
-
-                    q_align = best_q['alignment']
-                    v_align = best_v['alignment']
-
-                    mut_level = mutation_level(q_align, v_align)
-
-                    if writer is None:
+    logging.basicConfig(level=logging.INFO)
+
+    if args.format is None:
+        args.format = 'parquet' if args.output.endswith('.parquet') else 'csv'
+
+    schema = output_schema(args.lineage)
+    histogram = Counter()
+
+    # the columns of the batch, the mutation levels are worked out from the alignments when it is written
+    columns = None
+    query_alignments = None
+    v_alignments = None
+
+    def write_batch():
+        diff_counts, same_counts = mismatch_counts(query_alignments, v_alignments)
+        totals = diff_counts + same_counts
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mutation_levels = np.where(totals > 0, diff_counts / totals, np.nan)
+        # the histogram bin of a level is its lower edge
+        bins = [None if math.isnan(m) else bin_lower_edge(m, args.bin_width) for m in mutation_levels.tolist()]
+        histogram.update((s, b) for s, b in zip(columns[0], bins) if b is not None)
+        writer.write_columns(columns + [diff_counts, same_counts,
+                                        pa.array(mutation_levels, mask=totals == 0, type=pa.float64())])
+
+    with RecordBatchWriter(args.output, schema, args.format) as writer:
+        for filename in args.filenames:
+            logging.info('processing file %s', filename)
+            with open_compressed(filename, 'rb') as read_handle:
+                reader = fastavro.reader(read_handle)
+
+                for record in reader:
+                    view = RecordView(record, args.parse_label, args.lineage, args.min_v_score, args.min_j_score)
+                    if view.good_parse:
+                        parse = view.parse
+
+                        if columns is None:
+                            columns = [[] for _ in range(len(schema) - 3)]
+                            query_alignments = []
+                            v_alignments = []
+
+                        row = [view.subject, view.source, view.type]
                         if args.lineage:
-                            writer = csv.DictWriter(sys.stdout, fieldnames=['subject', 'source', 'type', 'lineage', 'v_j_in_frame', 'has_stop_codon', 'mutation_level'])
-                        else:
-                            writer = csv.DictWriter(sys.stdout, fieldnames=['subject', 'source', 'type',            'v_j_in_frame', 'has_stop_codon', 'mutation_level'])
-                        writer.writeheader()
-
-                    row = {'subject': record['subject'], 'source': record['source'],
-                            'type': type_, 'v_j_in_frame': v_j_in_frame, 'has_stop_codon': has_stop_codon,
-                            'mutation_level': mut_level}
-                    if args.lineage:
-                        if args.lineage in record['lineages']:
-                            row['lineage'] = record['lineages'][args.lineage]
-
-                    writer.writerow(row)
+                            row.append(view.lineage)
+                        row += [view.v_j_in_frame, view.has_stop_codon]
+                        for column, value in zip(columns, row):
+                            column.append(value)
+
+                        # line the V-segment up with the query using its padding
+                        best_v = best_alignment(parse, 'V')
+                        v_start = best_v['padding']['start']
+                        v_alignments.append(best_v['alignment'])
+                        query_alignments.append(get_parse_query(parse)[v_start:v_start + len(best_v['alignment'])])
+
+                        if len(v_alignments) >= args.batch_size:
+                            write_batch()
+                            columns = None
+
+        if columns is not None:
+            write_batch()
+        logging.info('wrote %d records', writer.row_count)
+
+    if args.histogram is None and args.output != '-':
+        args.histogram = args.output + '.histogram.csv'
+    if args.histogram:
+        write_histogram(args.histogram, ['subject', 'mutation_level'], histogram)
 
 if __name__ == '__main__':
     sys.exit(main())
@@ -4,36 +4,52 @@ from __future__ import print_function
 
 import sys
 import argparse
-import json
-
-import fastavro
-from collections import defaultdict
 
 import roskinlib
-from roskinlib.utils import open_compressed
+from roskinlib.stats import StatsEngine, write_partial_table, read_partial_table
+
+def count(args):
+    engine = StatsEngine(['read_counts'])
+    for filename in args.filenames:
+        engine.add_file(filename)
+    return engine
 
+def merge(args):
+    engine = read_partial_table(args.partial_filenames[0])
+    assert engine.names == ['read_counts'], 'the partial results are not read counts'
+    for filename in args.partial_filenames[1:]:
+        engine.merge(read_partial_table(filename))
+    return engine
 
 def main():
-    parser = argparse.ArgumentParser(description='get the CDR3 length from an Avro file',
+    parser = argparse.ArgumentParser(description='get the read counts of each subject and type from Avro files',
+            epilog='partial counts written with --partial are added up with: %(prog)s merge partial.parquet ...',
             formatter_class=argparse.ArgumentDefaultsHelpFormatter)
-    parser.add_argument('filename', metavar='file', help='the Avro file to read')
-    args = parser.parse_args()
+    parser.add_argument('filenames', metavar='file', nargs='+', help='the Avro files to read')
+    parser.set_defaults(function=count)
+
+    # merging is its own mode, given by a first argument of merge, so the counting arguments stay as they were
+    merge_parser = argparse.ArgumentParser(prog=parser.prog + ' merge',
+            description='add up partial read counts', formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    merge_parser.add_argument('partial_filenames', metavar='partial.parquet', nargs='+', help='the partial counts to add up')
+    merge_parser.set_defaults(function=merge)
+
+    for mode_parser in [parser, merge_parser]:
+        mode_parser.add_argument('--partial', metavar='F', help='write the counts as a Parquet partial result for a later merge instead of text')
 
-    reader = fastavro.reader(open_compressed(args.filename, 'rb'))
+    if len(sys.argv) > 1 and sys.argv[1] == 'merge':
+        args = merge_parser.parse_args(sys.argv[2:])
+    else:
+        args = parser.parse_args()
 
-    subject = None
-    read_counts_type = defaultdict(int)
+    engine = args.function(args)
 
-    for record in reader:
-        if subject is None:
-            subject = record['subject']
-        else:
-            assert subject == record['subject']
-        type_ = record['sequence']['annotations']['target1']
-        read_counts_type[type_] += 1
+    if args.partial:
+        write_partial_table(args.partial, engine)
+        return
 
-    for type_, count in read_counts_type.items():
-        print(subject, type_, count, sep='\t')
+    for subject, type_, read_count in engine.statistics['read_counts'].rows():
+        print(subject, type_, read_count, sep='\t')
 
 if __name__ == '__main__':
     sys.exit(main())
@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+
+import sys
+import argparse
+import logging
+import time
+import csv
+import json
+from multiprocessing import Pool
+
+import fastavro
+
+from roskinlib.utils import open_compressed
+from roskinlib.stats import StatsEngine, STATISTICS
+
+def file_stats(task):
+    filename, names, options = task
+    engine = StatsEngine(names, **options)
+    engine.add_file(filename)
+    return filename, engine.state()
+
+def write_results(engine, args):
+    if args.partial:
+        logging.info('writing partial results to %s', args.partial)
+        with open_compressed(args.partial, 'wt') as partial_handle:
+            json.dump(engine.state(), partial_handle)
+        return
+
+    if args.sample_output:
+        if engine.sample is None:
+            logging.warning('no sample was kept, use --sample to keep one')
+        else:
+            logging.info('writing a sample of %d records to %s', len(engine.sample.items), args.sample_output)
+            with open_compressed(args.sample_output, 'wb') as sample_handle:
+                fastavro.writer(sample_handle, engine.writer_schema, engine.sample.sample(), codec='bzip2')
+
+    for name, statistic in engine.statistics.items():
+        filename = args.output_prefix + name + '.csv'
+        logging.info('writing %s to %s', name, filename)
+        with open(filename, 'wt', newline='') as output_handle:
+            writer = csv.writer(output_handle)
+            writer.writerow(statistic.columns)
+            writer.writerows(statistic.rows())
+
+def compute(args):
+    options = {'parse_label': args.parse_label, 'lineage_label': args.lineage,
+               'min_v_score': args.min_v_score, 'min_j_score': args.min_j_score,
+               'mutation_bin_width': args.mutation_bin_width, 'sample_size': args.sample}
+    engine = StatsEngine(args.statistics, **options)
+
+    tasks = [(filename, args.statistics, options) for filename in args.filenames]
+    with Pool(args.workers) as pool:
+        for filename, state in pool.imap_unordered(file_stats, tasks):
+            logging.info('processed %s', filename)
+            engine.merge(StatsEngine.from_state(state))
+
+    logging.info('computed %d statistics over %d records', len(engine.statistics), engine.record_count)
+    write_results(engine, args)
+
+def merge(args):
+    engine = None
+    for filename in args.partial_filenames:
+        logging.info('merging %s', filename)
+        with open_compressed(filename, 'rt') as partial_handle:
+            partial_engine = StatsEngine.from_state(json.load(partial_handle))
+        if engine is None:
+            engine = partial_engine
+        else:
+            engine.merge(partial_engine)
+
+    logging.info('merged %d statistics over %d records', len(engine.statistics), engine.record_count)
+    write_results(engine, args)
+
+def main():
+    parser = argparse.ArgumentParser(description='compute repertoire statistics of sequence records in one pass over the files',
+            formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    compute_parser = subparsers.add_parser('compute', help='compute the statistics of Avro files',
+            formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    compute_parser.add_argument('filenames', metavar='file', nargs='+', help='the Avro files to read')
+    compute_parser.add_argument('--statistics', '-s', metavar='S', nargs='+', choices=STATISTICS, default=STATISTICS,
+            help='the statistics to compute')
+    compute_parser.add_argument('--parse-label', '-p', metavar='L', help='the parse label to use for the parse')
+    compute_parser.add_argument('--lineage',     '-l', metavar='L', help='the lineage label to use')
+    compute_parser.add_argument('--min-v-score', '-v', metavar='S', type=float, default=70, help='minimum V-segment score')
+    compute_parser.add_argument('--min-j-score', '-j', metavar='S', type=float, default=26, help='minimum J-segment score')
+    compute_parser.add_argument('--mutation-bin-width', metavar='W', type=float, default=0.01, help='the width of the mutation level bins')
+    compute_parser.add_argument('--sample', metavar='N', type=int, default=0, help='keep a uniform random sample of N records')
+    compute_parser.add_argument('--workers', '-w', metavar='W', type=int, default=4, help='the number of files to process at once')
+    compute_parser.set_defaults(function=compute)
+
+    merge_parser = subparsers.add_parser('merge', help='combine the partial results of earlier runs',
+            formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    merge_parser.add_argument('partial_filenames', metavar='partial.json', nargs='+', help='the partial results to merge')
+    merge_parser.set_defaults(function=merge)
+
+    for subparser in [compute_parser, merge_parser]:
+        subparser.add_argument('--partial', metavar='F', help='write the partial results to this file instead of the tables, for a later merge')
+        subparser.add_argument('--output-prefix', '-o', metavar='P', default='', help='the prefix of the <statistic>.csv tables')
+        subparser.add_argument('--sample-output', metavar='F', help='the Avro file to write the sample of records to')
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    start_time = time.time()
+
+    args.function(args)
+
+    elapsed_time = time.time() - start_time
+    logging.info('elapsed time %s', time.strftime('%H hours, %M minutes, %S seconds', time.gmtime(elapsed_time)))
+
+if __name__ == '__main__':
+    sys.exit(main())
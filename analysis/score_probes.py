@@ -10,11 +10,14 @@ import tempfile
 from multiprocessing import Pool
 import logging
 import time
+import itertools
 
+import pyarrow as pa
 from Bio import SeqIO
 
 from roskinlib import seqclust
-from roskinlib.warehouse import DirectoryWarehouse
+from roskinlib.warehouse import DirectoryWarehouse, PackedWarehouse
+from roskinlib.record_batches import RecordBatchWriter
 
 
 def concatinate_files(filenames, output_handle):
@@ -24,16 +27,20 @@ def concatinate_files(filenames, output_handle):
                 output_handle.write(line)
 
 class ClusterProcessor:
-    def __init__(self, min_subjects, positive_subjects, negative_subjects):
+    def __init__(self, min_subjects, positive_subjects, negative_subjects, clusterer='cd-hit'):
         self.min_subjects = min_subjects
         self.positive_subjects = positive_subjects
         self.negative_subjects = negative_subjects
+        self.clusterer = clusterer
     def __call__(self, args):
         v_segment, j_segment, cdr3_length, files = args
 
-        all_subjects = set(self.positive_subjects) | set(self.negative_subjects)
-
-        results = []
+        # cluster in-process, the sequences in a group all have the same length
+        if self.clusterer == 'greedy':
+            sequence_dict = SeqIO.to_dict(itertools.chain.from_iterable(SeqIO.parse(f, 'fasta') for f in files))
+            clusters = seqclust.GreedyClustIterator(((i, str(r.seq)) for i, r in sequence_dict.items()),
+                                                    0.90, throw_away_length=4)
+            return self.filter_clusters(v_segment, j_segment, cdr3_length, clusters, lambda: sequence_dict)
 
         # create a temp dir to hold the clustering files
         with tempfile.TemporaryDirectory() as temp_dir_name:
@@ -66,49 +73,62 @@ class ClusterProcessor:
 
             # iterate over each cluster
             with open(cluster_structure_filename, 'rt') as clust_struct_handle:
-                for cluster in seqclust.CDHITClustIterator(clust_struct_handle):
-                    cluster_subjects = set()
-                    cluster_lineages = set()
-                    cluster_reads = set()
-                    cluster_number = int(cluster.name.split(' ')[1])
-                    # ... and each member
-                    for member in cluster:
-                        cluster_reads.add(member.name)  # add the sequence name so we can look it up later
-                        # split the read members to get the parts
-                        for read_label in member.name.split(','):
-                            subject_id, lineage_id, read_id = read_label.split(';')
-                            cluster_subjects.add(subject_id)
-                            cluster_lineages.add(lineage_id)
-
-                    # make sure extra subject didn't get into the dataset
-                    #if not cluster_subjects.issubset(all_subjects):
-                    #    for p in cluster_subjects - all_subjects:
-                    #        print(p, file=sys.stderr)
-                    #    assert cluster_subjects.issubset(all_subjects)
-
-                    if len(cluster_lineages) >= self.min_subjects:
-                        sequence_dict = SeqIO.to_dict(SeqIO.parse(sequence_filename, 'fasta'))
-
-                        reads = [(read, str(sequence_dict[read].seq)) for read in cluster_reads]
-                        probe_definition = v_segment, j_segment, cdr3_length, cluster_number, reads
-                        results.append(probe_definition)
+                clusters = seqclust.CDHITClustIterator(clust_struct_handle)
+                return self.filter_clusters(v_segment, j_segment, cdr3_length, clusters,
+                                            lambda: SeqIO.to_dict(SeqIO.parse(sequence_filename, 'fasta')))
+
+    def filter_clusters(self, v_segment, j_segment, cdr3_length, clusters, load_sequences):
+        all_subjects = set(self.positive_subjects) | set(self.negative_subjects)
+
+        results = []
+
+        # the sequences are only loaded, once, if a cluster passes the filter
+        sequence_dict = None
+
+        for cluster in clusters:
+            cluster_subjects = set()
+            cluster_lineages = set()
+            cluster_reads = set()
+            cluster_number = int(cluster.name.split(' ')[1])
+            # ... and each member
+            for member in cluster:
+                cluster_reads.add(member.name)  # add the sequence name so we can look it up later
+                # split the read members to get the parts
+                for read_label in member.name.split(','):
+                    subject_id, lineage_id, read_id = read_label.split(';')
+                    cluster_subjects.add(subject_id)
+                    cluster_lineages.add(lineage_id)
+
+            # make sure extra subject didn't get into the dataset
+            #if not cluster_subjects.issubset(all_subjects):
+            #    for p in cluster_subjects - all_subjects:
+            #        print(p, file=sys.stderr)
+            #    assert cluster_subjects.issubset(all_subjects)
+
+            if len(cluster_lineages) >= self.min_subjects:
+                if sequence_dict is None:
+                    sequence_dict = load_sequences()
+
+                reads = [(read, str(sequence_dict[read].seq)) for read in cluster_reads]
+                probe_definition = v_segment, j_segment, cdr3_length, cluster_number, reads
+                results.append(probe_definition)
 
         return results
 
 
-def probe_converge_warehouses(probe_warehouse, input_warehouse, subject):
-    for probe_signature in probe_warehouse.partitions('.probe'):
-        v_segment, j_segment, cdr3_len, cluster = probe_signature
-        probe_filename = probe_warehouse.filename('.probe', *probe_signature)
-        
-        input_filename = [input_warehouse.filename('.fasta', *s) for s in \
+def probe_converge_warehouses(probe_warehouse, input_warehouse, subjects):
+    # one task per (V, J, CDR3 length) group, so the subjects' sequences are only clustered once
+    for group in probe_warehouse.partitions('.probe', cluster=None):
+        v_segment, j_segment, cdr3_len = group
+        probe_filenames = [probe_warehouse.filename('.probe', *s) for s in probe_warehouse.partitions('.probe', *group)]
+
+        # all the subjects' sequences are clustered with the group's probes at once
+        input_filenames = [input_warehouse.filename('.fasta', *s) for s in \
                 input_warehouse.partitions('.fasta', v_segment=v_segment,
-                j_segment=j_segment, cdr3_len=cdr3_len, subject=subject)]
+                j_segment=j_segment, cdr3_len=cdr3_len) if s[-1] in subjects]
 
-        if len(input_filename) > 0:
-            assert len(input_filename) == 1
-            input_filename = input_filename[0]
-            yield v_segment, j_segment, cdr3_len, [probe_filename, input_filename]       
+        if len(input_filenames) > 0:
+            yield v_segment, j_segment, cdr3_len, probe_filenames + input_filenames
 
 
 def main(arguments):
@@ -119,7 +139,17 @@ def main(arguments):
     parser.add_argument('probe_warehouse_root_dir', metavar='probe-dir', help='the warehouse with the probe sequences')
     parser.add_argument('input_warehouse_root_dir', metavar='input-dir', help='the warehouse with the input signatures')
     #
-    parser.add_argument('subject', metavar='subject', help='the subject to score')
+    parser.add_argument('subjects', metavar='subject', nargs='+', help='the subjects to score, or all for every subject')
+    # clustering
+    parser.add_argument('--clusterer', choices=['cd-hit', 'greedy'], default='cd-hit',
+            help='cluster with the cd-hit program or the built-in greedy clusterer')
+    parser.add_argument('--packed', action='store_true', help='the input warehouse is packed into a single file')
+    # output
+    parser.add_argument('--output', '-o', metavar='F', default='-', help='the file for the probe by subject hit matrix, - for stdout')
+    parser.add_argument('--format', choices=['csv', 'parquet'], default='csv', help='the format of the hit matrix')
+    # parallel processing
+    parser.add_argument('--workers',    '-w', metavar='W', type=int, default=16, help='the number of worker processes')
+    parser.add_argument('--chunk-size', '-c', metavar='C', type=int, default=4, help='the number of groups to send to a worker at a time')
 
     args = parser.parse_args(arguments)
     logging.basicConfig(level=logging.INFO)
@@ -127,22 +157,65 @@ def main(arguments):
     probe_warehouse = DirectoryWarehouse(args.probe_warehouse_root_dir,
             'v_segment', 'j_segment', 'cdr3_len', 'cluster')
 
-    input_warehouse = DirectoryWarehouse(args.input_warehouse_root_dir,
+    input_warehouse_class = PackedWarehouse if args.packed else DirectoryWarehouse
+    input_warehouse = input_warehouse_class(args.input_warehouse_root_dir,
             'v_segment', 'j_segment', 'cdr3_len', 'subject')
 
-    cluster_processor = ClusterProcessor(min_subjects=2, positive_subjects=set(), negative_subjects=set())
-    task_pool = Pool(processes=16)
-
-    results = task_pool.map(cluster_processor, probe_converge_warehouses(probe_warehouse, input_warehouse, args.subject))
-    print('probe', args.subject, sep=',')
-    for r in results:
-        for probe_definition in r:
-            v_segment, j_segment, cdr3_length, cluster_number, reads = probe_definition
-            for read_definition in reads:
-                read_label, sequence = read_definition
-                if read_label.startswith('probe;'):
-                    _, probe_label, _ = read_label.split(';')
-                    print(probe_label, 1, sep=',')
+    cluster_processor = ClusterProcessor(min_subjects=2, positive_subjects=set(), negative_subjects=set(),
+            clusterer=args.clusterer)
+    # the subjects to score
+    if args.subjects == ['all']:
+        subjects = sorted(set(s[-1] for s in input_warehouse.partitions('.fasta')))
+    else:
+        subjects = args.subjects
+    logging.info('scoring %d subjects', len(subjects))
+
+    start_time = time.time()
+    group_count = 0
+
+    # the probe by subject hits, probe label -> set of subjects
+    probe_hits = {}
+
+    with Pool(processes=args.workers) as task_pool:
+        for r in task_pool.imap_unordered(cluster_processor,
+                probe_converge_warehouses(probe_warehouse, input_warehouse, set(subjects)),
+                chunksize=args.chunk_size):
+            group_count += 1
+            for probe_definition in r:
+                v_segment, j_segment, cdr3_length, cluster_number, reads = probe_definition
+
+                # split the cluster into the probes and the subjects
+                cluster_probes = set()
+                cluster_subjects = set()
+                for read_definition in reads:
+                    read_label, sequence = read_definition
+                    if read_label.startswith('probe;'):
+                        _, probe_label, _ = read_label.split(';')
+                        cluster_probes.add(probe_label)
+                    else:
+                        for label in read_label.split(','):
+                            cluster_subjects.add(label.split(';')[0])
+
+                for probe_label in cluster_probes:
+                    probe_hits.setdefault(probe_label, set()).update(cluster_subjects)
+
+            if group_count % 1000 == 0:
+                elapsed_time = time.time() - start_time
+                logging.info('processed %d groups, %0.1f groups/second', group_count, group_count / elapsed_time)
+
+    input_warehouse.close()
+
+    logging.info('processed %d groups', group_count)
+
+    # output the probe by subject hit matrix
+    schema = pa.schema([('probe', pa.string())] + [(s, pa.int8()) for s in subjects])
+    hit_probes = [(probe_label, hit_subjects) for probe_label, hit_subjects in sorted(probe_hits.items()) if hit_subjects]
+    with RecordBatchWriter(args.output, schema, args.format) as writer:
+        writer.write_columns([[probe_label for probe_label, _ in hit_probes]] +
+                             [[int(s in hit_subjects) for _, hit_subjects in hit_probes] for s in subjects])
+
+    elapsed_time = time.time() - start_time
+    logging.info('elapsed time %s', time.strftime('%H hours, %M minutes, %S seconds', time.gmtime(elapsed_time)))
 
     return 0
 
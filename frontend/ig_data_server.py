@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+
+import sys
+import argparse
+import logging
+import json
+import os
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qsl
+
+from roskinlib.datatables import ParquetDataTable
+
+# the paths the table data is served from, index.html asks for the first
+DATA_PATHS = ['/read_ig_data.php', '/read_ig_data']
+# the page served at the root
+INDEX_FILENAME = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'index.html')
+
+def default_columns(parse_label):
+    # the dataset columns for the columns of index.html, the ones without a counterpart are left empty
+    prefix = 'parse_' + parse_label + '_'
+    return ['name',                         # Accession
+            'annotation_description',       # Description
+            'annotation_organism',          # Source Features
+            'annotation_other_features',    # Other Features
+            prefix + 'v_j_in_frame',        # Productive
+            prefix + 'v_name',              # V-segment
+            prefix + 'cdr3_aa',             # CDR3
+            prefix + 'j_name',              # J-segment
+            'annotation_pmid',              # PMID
+            'annotation_paper_title']       # Paper
+
+def make_handler(table):
+    class DataTablesHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlsplit(self.path)
+            if url.path in DATA_PATHS:
+                try:
+                    result = table.query(dict(parse_qsl(url.query)))
+                except ValueError as e:
+                    self.send_error(400, str(e))
+                    return
+                self._send(json.dumps(result).encode('utf-8'), 'application/json')
+            elif url.path in ('/', '/index.html'):
+                with open(INDEX_FILENAME, 'rb') as index_handle:
+                    self._send(index_handle.read(), 'text/html; charset=utf-8')
+            else:
+                self.send_error(404)
+
+        def _send(self, body, content_type):
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            logging.info('%s %s', self.address_string(), format % args)
+
+    return DataTablesHandler
+
+def main():
+    parser = argparse.ArgumentParser(description='serve the DataTables protocol for the frontend from a Parquet dataset',
+            formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('dataset_root', metavar='dataset-root', help='the root directory of the Parquet dataset')
+    # the columns
+    parser.add_argument('--columns', '-c', metavar='C', nargs='+', help='the dataset columns to serve, in table order, defaults to those for index.html')
+    parser.add_argument('--parse-label', '-p', metavar='L', default='igblast', help='the parse to use for the default columns')
+    # query options
+    parser.add_argument('--cache-size', metavar='N', type=int, default=32, help='the number of search and sort results to cache')
+    parser.add_argument('--index-dir', metavar='D', help='the directory for the sort indexes, defaults to one in the dataset root')
+    parser.add_argument('--lazy-sort-indexes', action='store_true', help='build the sort indexes when first needed instead of at startup')
+    # server options
+    parser.add_argument('--host', metavar='H', default='localhost', help='the address to listen on')
+    parser.add_argument('--port', metavar='P', type=int, default=8000, help='the port to listen on')
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    columns = args.columns if args.columns is not None else default_columns(args.parse_label)
+    table = ParquetDataTable(args.dataset_root, columns, cache_size=args.cache_size, index_directory=args.index_dir)
+    logging.info('serving %d rows from %d row groups', table.total_rows, table.num_row_groups)
+
+    if not args.lazy_sort_indexes:
+        table.build_sort_indexes()
+
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(table))
+    logging.info('listening on http://%s:%d/', args.host, args.port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        logging.info('counters: %s', dict(table.counters))
+
+if __name__ == '__main__':
+    sys.exit(main())
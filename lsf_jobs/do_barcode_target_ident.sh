@@ -1,6 +1,7 @@
 #!/usr/bin/bash
 
 IDENTER=~/irbase/pipeline/identer_read_pairs.py
+INDEXER=~/irbase/pipeline/index_fastq_batches.py
 BARCODES=~/irbase/database/barcodes
 TARGETS=~/irbase/database/targets
 
@@ -9,6 +10,15 @@ if [ ${#BATCH_NUMBER} -ne 6 ] ; then
     echo "batch number must be 6 digits"
     exit
 fi
+# optional batch index from index_fastq_batches.py, the batch is then read from the original read files
+BATCH_INDEX=${2}
+
+if [ -n "${BATCH_INDEX}" ]; then
+    read READ1_FILE READ2_FILE < <(${INDEXER} files ${BATCH_INDEX})
+    READ_INPUT="--batch-index ${BATCH_NUMBER} --index-file ${BATCH_INDEX} -- ${READ1_FILE} ${READ2_FILE}"
+else
+    READ_INPUT="-- batch${BATCH_NUMBER}.fq1.gz batch${BATCH_NUMBER}.fq2.gz"
+fi
 
 cat <<EOF
 #BSUB -L /bin/bash
@@ -18,6 +28,6 @@ cat <<EOF
 ${IDENTER} --barcodes1 ${BARCODES}/{boydlab_isotype,boydlab_j} \
            --targets1  ${TARGETS}/{biomed2_j,boydlab_ighc} \
            --barcodes2 ${BARCODES}/boydlab_isotype \
-           --targets2  ${TARGETS}/{biomed2_fr1,biomed2_fr2} -- \
-           batch${BATCH_NUMBER}.fq{1,2}.gz | gzip >batch${BATCH_NUMBER}.ident.gz
+           --targets2  ${TARGETS}/{biomed2_fr1,biomed2_fr2} \
+           ${READ_INPUT} | gzip >batch${BATCH_NUMBER}.ident.gz
 EOF
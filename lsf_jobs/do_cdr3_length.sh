@@ -21,7 +21,7 @@ cat <<EOS
 #BSUB -L /bin/bash
 #BSUB -W 2:00
 
-${CDR3_LENGTH} ${PARSE_LABEL} --lineage ${LINEAGE_LABEL} >${OUTPUT_FILE} \\
+${CDR3_LENGTH} ${PARSE_LABEL} --lineage ${LINEAGE_LABEL} --output ${OUTPUT_FILE} \\
 EOS
 for f in "$@" ; do
     echo \"${f}\" \\
@@ -7,10 +7,12 @@ if [ ${#BATCH_NUMBER} -ne 6 ] ; then
     echo "batch number must be 6 digits"
     exit
 fi
+# optional batch index, passed on to the merge
+BATCH_INDEX=${2}
 
 cat <<EOF
 #BSUB -L /bin/bash
 #BSUB -J merge_${BATCH_NUMBER}
 
-${MERGER} ${BATCH_NUMBER}
+${MERGER} ${BATCH_NUMBER} ${BATCH_INDEX}
 EOF
@@ -8,7 +8,7 @@ LABEL=$(basename "${SOURCE}" .clones.igblast.avro)
 cat <<EOF
 #BSUB -L /bin/bash
 #BSUB -W 4:00
-#BSUB -M 18000
+#BSUB -M 4000
 #BSUB -J parquet_${LABEL}
 #BSUB -o logs/parquet_${LABEL}_%J.log
 
@@ -1,20 +1,30 @@
 #!/usr/bin/bash
 
 DATABASE=/data/RoskinLab/irep/phix/genome.fasta
-PARSER=~/irbase/pipeline/sam_align_score.py
+SCREEN=~/irbase/pipeline/phix_screen.py
+INDEXER=~/irbase/pipeline/index_fastq_batches.py
 
 BATCH_NUMBER=${1?the six digit batch number must be given}
 if [ ${#BATCH_NUMBER} -ne 6 ] ; then
     echo "batch number must be 6 digits"
     exit
 fi
+# optional batch index from index_fastq_batches.py, the batch is then read from the original read files
+BATCH_INDEX=${2}
+
+if [ -n "${BATCH_INDEX}" ]; then
+    read READ1_FILE READ2_FILE < <(${INDEXER} files ${BATCH_INDEX})
+    READ1_INPUT="${READ1_FILE} --batch-index ${BATCH_NUMBER} --index-file ${BATCH_INDEX}"
+    READ2_INPUT="${READ2_FILE} --batch-index ${BATCH_NUMBER} --index-file ${BATCH_INDEX}"
+else
+    READ1_INPUT=batch${BATCH_NUMBER}.fq1.gz
+    READ2_INPUT=batch${BATCH_NUMBER}.fq2.gz
+fi
 
 cat <<EOF
 #BSUB -L /bin/bash
 #BSUB -J phix_${BATCH_NUMBER}
 
-module load bwa
-
-bwa mem -M -p ${DATABASE} batch${BATCH_NUMBER}.fq1.gz | ${PARSER} | gzip >batch${BATCH_NUMBER}.phix1.gz
-bwa mem -M -p ${DATABASE} batch${BATCH_NUMBER}.fq2.gz | ${PARSER} | gzip >batch${BATCH_NUMBER}.phix2.gz
+${SCREEN} screen ${DATABASE} ${READ1_INPUT} | gzip >batch${BATCH_NUMBER}.phix1.gz
+${SCREEN} screen ${DATABASE} ${READ2_INPUT} | gzip >batch${BATCH_NUMBER}.phix2.gz
 EOF
@@ -7,12 +7,15 @@ MAX_MISMATCH=0.25
 THREADS=1
 
 UNMERGER=/data/RoskinLab/irbase/pipeline/fastq_concat.py
+INDEXER=/data/RoskinLab/irbase/pipeline/index_fastq_batches.py
 
 BATCH_NUMBER=${1?the six digit batch number must be given}
 if [ ${#BATCH_NUMBER} -ne 6 ] ; then
     echo "batch number must be 6 digits"
     exit
 fi
+# optional batch index from index_fastq_batches.py, the batch is then read from the original read files
+BATCH_INDEX=${2}
 
 # create temp. directory to store the merged files
 TMPDIR=$(mktemp -d)
@@ -25,8 +28,15 @@ fi
 trap "exit 1"           HUP INT PIPE QUIT TERM
 trap 'rm -rf "$TMPDIR"' EXIT
 
-${MERGER} --min-overlap=${MIN_OVERLAP} --max-overlap=${MAX_OVERLAP} --max-mismatch-density=${MAX_MISMATCH} \
-          --threads=${THREADS} --allow-outies --trim-outies --quiet --compress --output-directory=${TMPDIR} \
-          batch${BATCH_NUMBER}.fq2.gz batch${BATCH_NUMBER}.fq1.gz
+MERGER_OPTIONS="--min-overlap=${MIN_OVERLAP} --max-overlap=${MAX_OVERLAP} --max-mismatch-density=${MAX_MISMATCH} \
+                --threads=${THREADS} --allow-outies --trim-outies --quiet --compress --output-directory=${TMPDIR}"
+
+# the process substitutions must be on the merger command line, their pipes are closed when the command they are in ends
+if [ -n "${BATCH_INDEX}" ]; then
+    ${MERGER} ${MERGER_OPTIONS} <(${INDEXER} cat ${BATCH_INDEX} ${BATCH_NUMBER} --read 2) \
+                                <(${INDEXER} cat ${BATCH_INDEX} ${BATCH_NUMBER} --read 1)
+else
+    ${MERGER} ${MERGER_OPTIONS} batch${BATCH_NUMBER}.fq2.gz batch${BATCH_NUMBER}.fq1.gz
+fi
 mv ${TMPDIR}/out.extendedFrags.fastq.gz batch${BATCH_NUMBER}.merged_fq.gz
 ${UNMERGER} ${TMPDIR}/out.notCombined_1.fastq.gz ${TMPDIR}/out.notCombined_2.fastq.gz | gzip >batch${BATCH_NUMBER}.unmerged_fq.gz
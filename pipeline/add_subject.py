@@ -10,6 +10,7 @@ import time
 import fastavro
 
 from roskinlib.utils import open_compressed
+from roskinlib.seq_rec import read_labels, labels_metadata
 
 def subject_adder(records, subject):
     for record in records:
@@ -31,7 +32,8 @@ def main():
         seq_record_reader = fastavro.reader(seq_record_handle)
 
         fastavro.writer(sys.stdout.buffer, seq_record_reader.writer_schema,
-                subject_adder(seq_record_reader, args.subject), codec='bzip2')
+                subject_adder(seq_record_reader, args.subject), codec='bzip2',
+                metadata=labels_metadata(read_labels(seq_record_reader)))
 
     elapsed_time = time.time() - start_time
     logging.info('elapsed time %s', time.strftime('%H hours, %M minutes, %S seconds', time.gmtime(elapsed_time)))
@@ -8,6 +8,8 @@ from itertools import islice
 
 import fastavro
 
+from roskinlib.seq_rec import read_labels, labels_metadata
+
 
 def main():
     parser = argparse.ArgumentParser(description='output the first part of an Avro file',
@@ -21,7 +23,8 @@ def main():
     
     with open(args.avro_filename, 'rb') as avro_handle:
         reader = fastavro.reader(avro_handle)
-        fastavro.writer(sys.stdout.buffer, reader.writer_schema, islice(reader, args.records), codec='bzip2')
+        fastavro.writer(sys.stdout.buffer, reader.writer_schema, islice(reader, args.records), codec='bzip2',
+                metadata=labels_metadata(read_labels(reader)))
 
 if __name__ == '__main__':
     sys.exit(main())
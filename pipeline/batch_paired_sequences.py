@@ -7,12 +7,88 @@ import argparse
 import logging
 import time
 import os
-import gzip
+import csv
+import hashlib
+from collections import deque
+from multiprocessing import Pool
+
+from roskinlib.utils import open_compressed
+from roskinlib.fastq import read_paired_fastq_batches, split_paired_ranges
+
+MANIFEST_COLUMNS = ['batch', 'read_count', 'fq1_bytes', 'fq1_md5', 'fq2_bytes', 'fq2_md5']
+
+def file_md5(filename):
+    checksum = hashlib.md5()
+    with open(filename, 'rb') as handle:
+        for block in iter(lambda: handle.read(1 << 20), b''):
+            checksum.update(block)
+    return checksum.hexdigest()
+
+def write_batch(task):
+    # compress and write the R1 and R2 files of a batch, this runs in a worker process
+    batch_prefix, r1_data, r2_data = task
+    row = []
+    for suffix, data in [('.fq1.gz', r1_data), ('.fq2.gz', r2_data)]:
+        filename = batch_prefix + suffix
+        with open_compressed(filename, 'wb') as out_handle:
+            out_handle.write(data)
+        row += [os.path.getsize(filename), file_md5(filename)]
+    return row
+
+def write_batches(args, manifest_filename, part_batches, first_batch):
+    read_count = 0
+    batch_count = 0
+
+    # read the FASTQ files
+    with open_compressed(args.r1_filename, 'rb') as in_read1_handle, \
+         open_compressed(args.r2_filename, 'rb') as in_read2_handle, \
+         open(manifest_filename, 'wt', newline='') as manifest_handle, \
+         Pool(args.workers) as pool:
+
+        read_options = {}
+        if args.parts > 1:
+            r1_start, r1_stop, r2_start, r2_stop = split_paired_ranges(in_read1_handle, in_read2_handle, args.parts)[args.part]
+            logging.info('batching bytes %d to %d of R1 and %d to %d of R2', r1_start, r1_stop, r2_start, r2_stop)
+            in_read1_handle.seek(r1_start)
+            in_read2_handle.seek(r2_start)
+            read_options = {'r1_length': r1_stop - r1_start, 'r2_length': r2_stop - r2_start}
+
+        manifest = csv.writer(manifest_handle)
+        manifest.writerow(MANIFEST_COLUMNS)
+
+        def finish_batch():
+            batch_number, batch_read_count, result = pending.popleft()
+            manifest.writerow(['%06d' % batch_number, batch_read_count] + result.get())
+
+        # iterate over the read files, the read ids are checked to match, and hand the
+        # batches to the workers, waiting for the oldest when too many are pending
+        pending = deque()
+        for r1_batch, r2_batch in read_paired_fastq_batches(in_read1_handle, in_read2_handle, args.batch_size, **read_options):
+            if batch_count >= part_batches:
+                logging.error('part %d has more than %d batches', args.part, part_batches)
+                return 10
+            batch_number = first_batch + batch_count
 
-from Bio.SeqIO.QualityIO import FastqGeneralIterator
+            # filename prefix for the batches
+            batch_prefix = os.path.join(args.batch_dirname, 'batch%06d' % batch_number)
+
+            logging.info('creating batch %06d', batch_number)
 
-from roskinlib.utils import open_compressed, batches
+            # compressed batch output files, the records are written as they were read
+            task = (batch_prefix, r1_batch.to_bytes(), r2_batch.to_bytes())
+            pending.append((batch_number, len(r1_batch), pool.apply_async(write_batch, (task,))))
+            while len(pending) > 2 * args.workers:
+                finish_batch()
+
+            read_count += len(r1_batch)
+            batch_count += 1
 
+        while pending:
+            finish_batch()
+
+    logging.info('processed %d read pairs', read_count)
+    logging.info('created %d batches', batch_count)
+    return 0
 
 def main():
     parser = argparse.ArgumentParser(description='batch paired-end sequences from an Illumina run of an amplicon library',
@@ -25,54 +101,57 @@ def main():
     # parameters
     parser.add_argument('--batch-size', '-b', metavar='B', type=int, default=50000,
             help='the number of read pairs to insert at a time')
+    parser.add_argument('--workers', '-w', metavar='W', type=int, default=4,
+            help='the number of batches to compress and write at once')
+    # splitting one run with several jobs
+    parser.add_argument('--parts', metavar='N', type=int, default=1,
+            help='split the uncompressed read files into N byte ranges, each batched by its own job')
+    parser.add_argument('--part', metavar='I', type=int, default=0,
+            help='the byte range to batch, from 0 to N - 1, its batches are numbered from I * 1000000 / N')
 
     args = parser.parse_args()
     logging.basicConfig(level=logging.INFO)
     start_time = time.time()
 
-    # check if the batch directory already exists
-    if os.path.exists(args.batch_dirname):
-        logging.error('batch direcotry %s already exists', args.batch_dirname)
+    if not 0 <= args.part < args.parts:
+        logging.error('the part must be between 0 and %d', args.parts - 1)
+        return 10
+    if args.parts > 1 and any(f == '-' or f.endswith(('.gz', '.bz2', '.zst')) for f in [args.r1_filename, args.r2_filename]):
+        logging.error('only uncompressed read files, not standard input, can be split into parts')
         return 10
-    else:
-        os.mkdir(args.batch_dirname)
-
-    read_count = 0
-    batch_count = 0
-
-    # read the FASTQ files
-    with open_compressed(args.r1_filename, 'rt') as in_read1_handle, \
-         open_compressed(args.r2_filename, 'rt') as in_read2_handle:
-        
-        # iterate over the read files
-        for r1_batch, r2_batch in zip(batches(FastqGeneralIterator(in_read1_handle), args.batch_size),
-                                      batches(FastqGeneralIterator(in_read2_handle), args.batch_size)):
-            # filename prefix for the batches
-            batch_prefix = os.path.join(args.batch_dirname, 'batch%06d' % batch_count)
-
-            logging.info('creating batch %06d', batch_count)
-
-            # compressed batch outout files
-            with gzip.open(batch_prefix + '.fq1.gz', 'wt') as out_read1_handle, \
-                 gzip.open(batch_prefix + '.fq2.gz', 'wt') as out_read2_handle:
-
-                # for each read pair in the batch
-                for r1_read, r2_read in zip(r1_batch, r2_batch):
-                    r1_id, r1_seq, r1_qual = r1_read
-                    r2_id, r2_seq, r2_qual = r2_read
-
-                    # check that the read ids are the same
-                    assert r1_id.split(' ')[0] == r2_id.split(' ')[0], 'read ids do not match %s != %s' % (r1_id, r2_id)
-
-                    out_read1_handle.write('@%s\n%s\n+\n%s\n' % (r1_id, r1_seq, r1_qual))
-                    out_read2_handle.write('@%s\n%s\n+\n%s\n' % (r2_id, r2_seq, r2_qual))
 
-                    read_count += 1
-            
-            batch_count += 1
+    # check if the batch directory already exists, the jobs batching the other parts share it
+    if args.parts == 1:
+        if os.path.exists(args.batch_dirname):
+            logging.error('batch direcotry %s already exists', args.batch_dirname)
+            return 10
+        os.mkdir(args.batch_dirname)
+        manifest_filename = os.path.join(args.batch_dirname, 'manifest.csv')
+    else:
+        os.makedirs(args.batch_dirname, exist_ok=True)
+        manifest_filename = os.path.join(args.batch_dirname, 'manifest.part%03d.csv' % args.part)
+        if os.path.exists(manifest_filename):
+            logging.error('part %d was already batched, %s exists', args.part, manifest_filename)
+            return 10
+
+    # the batch numbers of this part
+    part_batches = 1000000 // args.parts
+    first_batch = args.part * part_batches
+
+    # the manifest is written under a temporary name and renamed once every batch is written,
+    # so a manifest is only there for a complete run
+    manifest_temp_filename = manifest_filename + '.tmp'
+    try:
+        status = write_batches(args, manifest_temp_filename, part_batches, first_batch)
+    except BaseException:
+        if os.path.exists(manifest_temp_filename):
+            os.remove(manifest_temp_filename)
+        raise
+    if status != 0:
+        os.remove(manifest_temp_filename)
+        return status
+    os.replace(manifest_temp_filename, manifest_filename)
 
-    logging.info('processed %d read pairs', read_count)
-    logging.info('created %d batches', batch_count)
     elapsed_time = time.time() - start_time
     logging.info('elapsed time %s', time.strftime('%H hours, %M minutes, %S seconds', time.gmtime(elapsed_time)))
 
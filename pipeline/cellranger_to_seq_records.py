@@ -8,11 +8,12 @@ import logging
 import time
 import csv
 
-from Bio.SeqIO.QualityIO import FastqGeneralIterator
 from fastavro import parse_schema, writer
 
 from roskinlib.utils import open_compressed
+from roskinlib.fastq import read_fastq
 from roskinlib.schemata.avro import SEQUENCE_RECORD
+from roskinlib.seq_rec import make_labels, labels_metadata
 
 def make_seq_records(cell_umis, cell_contigs, sequences, subject=None, sample=None, source=None):
     for cell in cell_umis:
@@ -53,7 +54,7 @@ def main():
 
     # read the FASTQ files
     with open_compressed(args.cell_ranger_vdj_path + '/filtered_contig_annotations.csv', 'rt') as filtered_contig, \
-         open_compressed(args.cell_ranger_vdj_path + '/filtered_contig.fastq', 'rt') as filtered_sequences:
+         open_compressed(args.cell_ranger_vdj_path + '/filtered_contig.fastq', 'rb') as filtered_sequences:
         
         cell_umi_count = {} # max UMI count for this cell
         cell_contig    = {} # contig name with the max UMI count
@@ -76,14 +77,15 @@ def main():
 
         # load the sequences for each contig
         sequences = {}
-        for contig_id, contig_seq, contig_qual in FastqGeneralIterator(filtered_sequences):
+        for contig_id, contig_seq, contig_qual in read_fastq(filtered_sequences):
             sequences[contig_id] = (contig_seq, contig_qual)
 
 
         seq_records = make_seq_records(cell_umi_count, cell_contig, sequences, subject=args.subject, sample=args.sample, source=args.source)
 
         output_schema = parse_schema(SEQUENCE_RECORD)
-        writer(sys.stdout.buffer, output_schema, seq_records, codec='bzip2')
+        writer(sys.stdout.buffer, output_schema, seq_records, codec='bzip2',
+               metadata=labels_metadata(make_labels(annotations=['umis'])))
 
     elapsed_time = time.time() - start_time
     logging.info('elapsed time %s', time.strftime('%H hours, %M minutes, %S seconds', time.gmtime(elapsed_time)))
@@ -13,6 +13,7 @@ import fastavro
 from Bio import SeqIO
 
 from roskinlib.utils import open_compressed
+from roskinlib.seq_rec import make_labels, merge_labels, read_labels, labels_metadata
 
 def clone_annotator(clone_calls, seq_record_iter, lineage_label):
     processed_count = 0
@@ -77,7 +78,11 @@ def main():
 
         annotator = clone_annotator(clone_calls, seq_record_reader, args.lineages_label)
 
-        fastavro.writer(sys.stdout.buffer, seq_record_reader.writer_schema, annotator, codec='bzip2')
+        # record the added lineage label in the file metadata
+        labels = merge_labels(read_labels(seq_record_reader), make_labels(lineages=[args.lineages_label]))
+
+        fastavro.writer(sys.stdout.buffer, seq_record_reader.writer_schema, annotator, codec='bzip2',
+                metadata=labels_metadata(labels))
 
     elapsed_time = time.time() - start_time
     logging.info('elapsed time %s', time.strftime('%H hours, %M minutes, %S seconds', time.gmtime(elapsed_time)))
@@ -8,54 +8,186 @@ import logging
 import time
 import re
 import os
+import tempfile
 from collections import Counter
-from itertools import chain
+from multiprocessing import Pool
 
 import fastavro
+from fastavro.write import Writer
 
 from roskinlib.utils import open_compressed
+from roskinlib.seq_rec import make_labels, merge_labels, read_labels, labels_metadata
 
-def avro_file_record_filter_iter(filenames, subject):
-    for filename in filenames:
-        logging.info('processing file %s', filename)
-        for record in fastavro.reader(open_compressed(filename, 'rb')):
-            if record['subject'] == subject:
-                yield record
+def subject_name(subject):
+    # the name used for records without a subject on the command line and in filenames
+    return 'none' if subject is None else subject
+
+class SubjectWriters:
+    """Append records to a destination file per subject, opening each when its first record comes.
+
+    A destination that already exists is only appended to if append is set,
+    its schema matches and its recorded labels cover the new records. rollback()
+    truncates every destination back to its size before any records were added.
+    """
+    def __init__(self, dest_template, schema, labels, append):
+        self.dest_template = dest_template
+        self.schema = schema
+        self.labels = labels
+        self.append = append
+        self.counts = Counter()
+        self._writers = {}
+        self._original_sizes = {}
+
+    def _open(self, subject):
+        filename = self.dest_template.format(subject=subject_name(subject))
+        original_size = os.path.getsize(filename) if os.path.exists(filename) else None
+
+        if original_size is not None:
+            if not self.append:
+                raise ValueError('destination file %s already exists, to append use the --apppend/-a flag to add to it' % filename)
+            logging.info('appending to existing sequence record file %s', filename)
+        if original_size:
+            # the header of an existing file can't be changed, so it must already fit the new records
+            with open_compressed(filename, 'rb') as dest_record_handle:
+                reader = fastavro.reader(dest_record_handle)
+                dest_schema = reader.writer_schema
+                dest_labels = read_labels(reader)
+            if dest_schema != self.schema:
+                raise ValueError('the schema of %s does not match that of the records to append' % filename)
+            if dest_labels is not None and merge_labels(dest_labels, self.labels) != dest_labels:
+                raise ValueError('the labels recorded in %s do not include those of the records to append, write to a new file instead' % filename)
+
+        self._original_sizes[filename] = original_size
+        handle = open_compressed(filename, 'a+b')
+        writer = Writer(handle, self.schema, codec='bzip2', metadata=labels_metadata(self.labels))
+        self._writers[subject] = (handle, writer)
+        return writer
+
+    def _writer(self, subject):
+        if subject in self._writers:
+            return self._writers[subject][1]
+        return self._open(subject)
+
+    def write(self, subject, record):
+        self._writer(subject).write(record)
+        self.counts[subject] += 1
+
+    def write_block(self, subject, block):
+        # the block's records are copied without decoding them, so it must use the destination schema
+        self._writer(subject).write_block(block)
+        self.counts[subject] += block.num_records
+
+    def close(self):
+        for handle, writer in self._writers.values():
+            writer.flush()
+            handle.close()
+        self._writers = {}
+
+    def rollback(self):
+        for handle, _ in self._writers.values():
+            try:
+                handle.close()
+            except OSError:     # e.g. the disk is full, the file is truncated anyway
+                pass
+        self._writers = {}
+        for filename, original_size in self._original_sizes.items():
+            if original_size is None:
+                os.remove(filename)
+            else:
+                os.truncate(filename, original_size)
+
+def extract_file_to_temp(task):
+    # extract the records of the subjects from one file into a temporary file per subject, written
+    # with the destination schema and uncompressed so their blocks can be copied as they are
+    filename, subjects, schema, temp_dir_name = task
+    temp_filenames = {}
+    temp_writers = {}
+    with open_compressed(filename, 'rb') as seq_record_handle:
+        reader = fastavro.reader(seq_record_handle)
+        for record in reader:
+            subject = record['subject']
+            if subjects is not None and subject not in subjects:
+                continue
+            if subject not in temp_writers:
+                temp_handle, temp_filenames[subject] = tempfile.mkstemp(suffix='.avro', dir=temp_dir_name)
+                temp_handle = os.fdopen(temp_handle, 'wb')
+                temp_writers[subject] = (temp_handle, Writer(temp_handle, schema, codec='null'))
+            temp_writers[subject][1].write(record)
+
+    for temp_handle, writer in temp_writers.values():
+        writer.flush()
+        temp_handle.close()
+    return filename, temp_filenames
 
 def main():
-    parser = argparse.ArgumentParser(description='extract sequence records from Avro files with a given subject',
+    parser = argparse.ArgumentParser(description='extract sequence records from Avro files with the given subjects',
             formatter_class=argparse.ArgumentDefaultsHelpFormatter)
     # input files
     parser.add_argument('source_record_filename', metavar='seq_record.avro', nargs='+', help='Avro files with the sequence records to extract')
-    parser.add_argument('dest_record_filename', metavar='target.avro', help='the destination Avro file')
-    parser.add_argument('subject_label', metavar='subject', help='the subject to extract, use none for un-assigned records')
+    parser.add_argument('dest_record_filename', metavar='target.avro',
+            help='the destination Avro file, for more than one subject it must include {subject} to name a file per subject')
+    parser.add_argument('subject_label', metavar='subject',
+            help='the subject to extract, a comma separated list of subjects, or all; use none for un-assigned records')
     # append
-    parser.add_argument('-a', '--append', action='store_true', help='append records to an existing Avro file')
+    parser.add_argument('-a', '--append', action='store_true', help='append records to existing Avro files')
+    # parallel processing
+    parser.add_argument('--workers', '-w', metavar='W', type=int, default=4, help='the number of input files to process at once')
 
     args = parser.parse_args()
     logging.basicConfig(level=logging.INFO)
     start_time = time.time()
 
-    if os.path.exists(args.dest_record_filename):
-        if args.append:
-            logging.info('appending to existing sequence record file %s', args.dest_record_filename)
-        else:
-            logging.error('destination file already exists, to append use the --apppend/-a flag to add to it, exiting')
-            return 10
-
-    if args.subject_label == 'none':
-        args.subject_label = None
-    logging.info('extracting records for subject %s', args.subject_label)
+    if args.subject_label == 'all':
+        subjects = None
+    else:
+        subjects = set(None if s == 'none' else s for s in args.subject_label.split(','))
+    if (subjects is None or len(subjects) > 1) and '{subject}' not in args.dest_record_filename:
+        parser.error('the destination must include {subject} when extracting more than one subject')
+    logging.info('extracting records for subjects %s', args.subject_label)
 
     # read in the first file to get the schema
     with open_compressed(args.source_record_filename[0], 'rb') as seq_record_handle:
-        reader = fastavro.reader(open_compressed(args.source_record_filename[0], 'rb'))
-        schema = reader.writer_schema
+        schema = fastavro.reader(seq_record_handle).writer_schema
+
+    # the labels used by the source files, from their metadata
+    labels = make_labels()
+    for filename in args.source_record_filename:
+        with open_compressed(filename, 'rb') as seq_record_handle:
+            labels = merge_labels(labels, read_labels(fastavro.reader(seq_record_handle)))
+
+    dest_writers = SubjectWriters(args.dest_record_filename, schema, labels, args.append)
+    try:
+        workers = min(args.workers, len(args.source_record_filename))
+        if workers <= 1:
+            # route each record to the writer for its subject
+            for filename in args.source_record_filename:
+                logging.info('processing file %s', filename)
+                with open_compressed(filename, 'rb') as seq_record_handle:
+                    for record in fastavro.reader(seq_record_handle):
+                        if subjects is None or record['subject'] in subjects:
+                            dest_writers.write(record['subject'], record)
+        else:
+            # each worker splits a file into temporary files by subject, which are added in input order
+            with tempfile.TemporaryDirectory() as temp_dir_name, Pool(workers) as pool:
+                tasks = [(filename, subjects, schema, temp_dir_name) for filename in args.source_record_filename]
+                for filename, temp_filenames in pool.imap(extract_file_to_temp, tasks):
+                    logging.info('processed file %s', filename)
+                    for subject, temp_filename in temp_filenames.items():
+                        with open(temp_filename, 'rb') as temp_handle:
+                            for block in fastavro.block_reader(temp_handle):
+                                dest_writers.write_block(subject, block)
+                        os.remove(temp_filename)
+        dest_writers.close()
+    except BaseException as e:
+        # any error, including from a worker, leaves the destination files as they were
+        logging.error('%s, removing the records added', e if str(e) else type(e).__name__)
+        dest_writers.rollback()
+        if isinstance(e, (ValueError, KeyboardInterrupt)):
+            return 10
+        raise
 
-    # open and append to the destination file
-    with open_compressed(args.dest_record_filename, 'a+b') as dest_record_handle:
-        fastavro.writer(dest_record_handle, schema,
-                avro_file_record_filter_iter(args.source_record_filename, args.subject_label), codec='bzip2')
+    for subject, count in sorted(dest_writers.counts.items(), key=lambda s: subject_name(s[0])):
+        logging.info('extracted %d records for subject %s', count, subject_name(subject))
 
     elapsed_time = time.time() - start_time
     logging.info('elapsed time %s', time.strftime('%H hours, %M minutes, %S seconds', time.gmtime(elapsed_time)))
@@ -5,10 +5,10 @@ from __future__ import print_function
 import sys
 import argparse
 
-from Bio.SeqIO.QualityIO import FastqGeneralIterator
 from Bio.Seq import _dna_complement_table
 
 from roskinlib.utils import open_compressed
+from roskinlib.fastq import read_paired_fastq
 
 
 def main():
@@ -27,9 +27,9 @@ def main():
     spacer_qual = chr(33 + args.qual_spacer) * len(spacer_seq)
 
     # read the FASTQ file
-    with open_compressed(args.fastq1_filename, 'rt') as input1_handle, \
-         open_compressed(args.fastq2_filename, 'rt') as input2_handle:
-        for r1, r2 in zip(FastqGeneralIterator(input1_handle), FastqGeneralIterator(input2_handle)):
+    with open_compressed(args.fastq1_filename, 'rb') as input1_handle, \
+         open_compressed(args.fastq2_filename, 'rb') as input2_handle:
+        for r1, r2 in read_paired_fastq(input1_handle, input2_handle):
             r1_id, r1_seq, r1_qual = r1
             r2_id, r2_seq, r2_qual = r2
 
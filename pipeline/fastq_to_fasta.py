@@ -5,9 +5,8 @@ from __future__ import print_function
 import sys
 import argparse
 
-from Bio.SeqIO.QualityIO import FastqGeneralIterator
-
 from roskinlib.utils import open_compressed
+from roskinlib.fastq import read_fastq
 
 
 def main():
@@ -21,8 +20,8 @@ def main():
     args = parser.parse_args()
 
     # read the FASTQ file
-    with open_compressed(args.fastq_filename, 'rt') as input_handle:
-        for read_id, read_seq, read_qual in FastqGeneralIterator(input_handle):
+    with open_compressed(args.fastq_filename, 'rb') as input_handle:
+        for read_id, read_seq, read_qual in read_fastq(input_handle):
             if args.trim_label:
                 read_id = read_id.split(' ')[0]
             print('>%s\n%s' % (read_id, read_seq))
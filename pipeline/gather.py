@@ -9,12 +9,13 @@ import time
 import csv
 
 from itertools import dropwhile
-from Bio.SeqIO.QualityIO import FastqGeneralIterator
 from fastavro import parse_schema
 from fastavro import writer
 
 from roskinlib.utils import open_compressed
+from roskinlib.fastq import read_fastq
 from roskinlib.schemata.avro import SEQUENCE_RECORD
+from roskinlib.seq_rec import make_labels, labels_metadata
 
 
 def next_with_match(it, match_value, key_column='pair_id'):
@@ -110,14 +111,14 @@ def main():
     output_schema = parse_schema(SEQUENCE_RECORD)
 
     # read the FASTQ files
-    with open_compressed(args.merged_fastq_filename, 'rt') as merged_read_handle, \
+    with open_compressed(args.merged_fastq_filename, 'rb') as merged_read_handle, \
          open_compressed(args.ident_filename, 'rt')        as ident_handle, \
          open_compressed(args.demux_filename, 'rt')        as demux_handle, \
          open_compressed(args.phix1_filename, 'rt')        as phix1_handle, \
          open_compressed(args.phix2_filename, 'rt')        as phix2_handle:
 
         # the master list of merged reads
-        merged_read_iter = FastqGeneralIterator(merged_read_handle)
+        merged_read_iter = read_fastq(merged_read_handle)
 
         ident_iter = csv.DictReader(ident_handle)
         demux_iter = csv.DictReader(demux_handle)
@@ -126,7 +127,11 @@ def main():
 
         gatherer = gather_to_record(merged_read_iter, ident_iter, demux_iter, phix1_iter, phix2_iter, annote_true=args.annote_set_true)
 
-        writer(sys.stdout.buffer, output_schema, gatherer, codec='bzip2')
+        # the annotations added to every record
+        labels = make_labels(annotations=['phix1', 'barcode1', 'target1', 'phix2', 'barcode2', 'target2'] +
+                                         args.annote_set_true)
+
+        writer(sys.stdout.buffer, output_schema, gatherer, codec='bzip2', metadata=labels_metadata(labels))
 
     elapsed_time = time.time() - start_time
     logging.info('elapsed time %s', time.strftime('%H hours, %M minutes, %S seconds', time.gmtime(elapsed_time)))
@@ -13,6 +13,7 @@ from fastavro import writer
 
 from roskinlib.utils import open_compressed
 from roskinlib.schemata.avro import SEQUENCE_RECORD
+from roskinlib.seq_rec import make_labels, labels_metadata
 
 def seq_record_from_genbank(genbank_record):
     sequence_annotations = {'organism':    genbank_record.annotations['organism'],
@@ -63,7 +64,8 @@ def main():
     start_time = time.time()
 
     genbank_records = genbank_filter_chain(args.genbank_filenames, args.organism, args.max_length)
-    writer(sys.stdout.buffer, avro_schema, genbank_records, codec='bzip2')
+    writer(sys.stdout.buffer, avro_schema, genbank_records, codec='bzip2',
+           metadata=labels_metadata(make_labels(annotations=['organism', 'description'])))
 
     elapsed_time = time.time() - start_time
     logging.info('elapsed time %s', time.strftime('%H hours, %M minutes, %S seconds', time.gmtime(elapsed_time)))
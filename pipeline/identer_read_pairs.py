@@ -7,9 +7,11 @@ import argparse
 import logging
 import time
 import csv
-from Bio.SeqIO.QualityIO import FastqGeneralIterator
+from contextlib import contextmanager
 
 from roskinlib.utils import open_compressed
+from roskinlib.fastq import read_paired_fastq
+from roskinlib.batch_index import BatchIndex, batch_index_filename
 from roskinlib.matcher import RandomBarcodeTargetMatcher
 
 
@@ -22,6 +24,19 @@ def load_sequences_labeled(filenames, sep='\t'):
             sequences_labeled[sequence] = ident
     return sequences_labeled
 
+@contextmanager
+def open_read_pairs(r1_filename, r2_filename, batch_number=None, index_filename=None):
+    # the read pairs of the files, or of one batch of them read through the batch index
+    if batch_number is None:
+        with open_compressed(r1_filename, 'rb') as in_read1_handle, \
+             open_compressed(r2_filename, 'rb') as in_read2_handle:
+            yield read_paired_fastq(in_read1_handle, in_read2_handle)
+    else:
+        index = BatchIndex.load(index_filename if index_filename is not None else batch_index_filename(r1_filename))
+        if index.read_number(r1_filename) != 1 or index.read_number(r2_filename) != 2:
+            raise ValueError('the batch index is not of %s and %s' % (r1_filename, r2_filename))
+        yield index.read_paired_fastq(batch_number)
+
 def main():
     parser = argparse.ArgumentParser(description='generate barcode and primer informations for FASTQ read pais', 
             formatter_class=argparse.ArgumentDefaultsHelpFormatter)
@@ -38,6 +53,9 @@ def main():
     parser.add_argument('--barcodes2', metavar='bc', nargs='+', required=True, help='file(s) with barcodes to use on read 2')
     parser.add_argument('--ran-length2',  metavar='N', type=int, default=0, help='the number of random diversity bases on read 2')
     parser.add_argument('--ran-radius2',  metavar='N', type=int, default=0, help='the maximum shift of the random diversity bases on read 2')
+    # read one batch of the files through a batch index from index_fastq_batches.py
+    parser.add_argument('--batch-index', metavar='N', type=int, help='only annotate the read pairs of batch N of the batch index')
+    parser.add_argument('--index-file', metavar='index.json', help='the batch index, the R1 filename plus .batches.json by default')
 
     args = parser.parse_args()
     logging.basicConfig(level=logging.INFO)
@@ -81,21 +99,16 @@ def main():
     writer = csv.DictWriter(sys.stdout, fieldnames=record_template.keys())
     writer.writeheader()
 
-    # read the FASTQ files
-    with open_compressed(args.r1_filename, 'rt') as in_read1_handle, \
-         open_compressed(args.r2_filename, 'rt') as in_read2_handle:
+    # read the FASTQ files, or one batch of them through the batch index
+    with open_read_pairs(args.r1_filename, args.r2_filename, args.batch_index, args.index_file) as read_pairs:
 
-        # iterate over the read files
-        for r1_read, r2_read in zip(FastqGeneralIterator(in_read1_handle),
-                                    FastqGeneralIterator(in_read2_handle)):
+        # iterate over the read files, the read ids are checked to match
+        for r1_read, r2_read in read_pairs:
             # break out the read parts
             r1_id, r1_seq, r1_qual = r1_read
             r2_id, r2_seq, r2_qual = r2_read
 
-            # make sure the read pairs match
             r1_id = r1_id.split(' ')[0]
-            r2_id = r2_id.split(' ')[0]
-            assert r1_id == r2_id, f'read {r1_id} != {r2_id}'
             
             record = record_template.copy()
             record['pair_id'] = r1_id
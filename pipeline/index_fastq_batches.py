@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+
+import sys
+import argparse
+import logging
+import time
+
+from roskinlib.batch_index import BatchIndex, batch_index_filename
+
+def build(args):
+    index = BatchIndex.build(args.r1_filename, args.r2_filename, args.batch_size)
+    index_filename = args.output if args.output is not None else batch_index_filename(args.r1_filename)
+    index.save(index_filename)
+    logging.info('indexed %d read pairs in %d batches', sum(batch[0] for batch in index.batches), len(index))
+    logging.info('wrote the batch index %s', index_filename)
+
+def list_batches(args):
+    index = BatchIndex.load(args.index_filename)
+    for batch_number in range(len(index)):
+        print('%06d' % batch_number)
+
+def files(args):
+    # the indexed R1 and R2 files, for job scripts that run a batch through the index
+    index = BatchIndex.load(args.index_filename)
+    print(*index.filenames)
+
+def cat(args):
+    # write the reads of a batch as they are in the file, e.g. for a program that needs a filename
+    index = BatchIndex.load(args.index_filename)
+    handle, length = index.open_batch(args.batch_number, args.read_number)
+    with handle:
+        while length > 0:
+            data = handle.read(min(length, 1 << 20))
+            if not data:
+                break
+            sys.stdout.buffer.write(data)
+            length -= len(data)
+
+def main():
+    parser = argparse.ArgumentParser(description='index the batches of paired-end FASTQ files so jobs can read them without batch copies',
+            formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    build_parser = subparsers.add_parser('build', help='scan the uncompressed or BGZF read files and write the batch index',
+            formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    build_parser.add_argument('r1_filename', metavar='r1_file', help='the file with the read 1 sequences')
+    build_parser.add_argument('r2_filename', metavar='r2_file', help='the file with the read 2 sequences')
+    build_parser.add_argument('--batch-size', '-b', metavar='B', type=int, default=50000, help='the number of read pairs in a batch')
+    build_parser.add_argument('--output', '-o', metavar='index.json', help='the batch index file, the R1 filename plus .batches.json by default')
+    build_parser.set_defaults(function=build)
+
+    list_parser = subparsers.add_parser('list', help='print the six digit batch numbers, like batches.sh',
+            formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    list_parser.add_argument('index_filename', metavar='index.json', help='the batch index file')
+    list_parser.set_defaults(function=list_batches)
+
+    files_parser = subparsers.add_parser('files', help='print the R1 and R2 filenames of the index',
+            formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    files_parser.add_argument('index_filename', metavar='index.json', help='the batch index file')
+    files_parser.set_defaults(function=files)
+
+    cat_parser = subparsers.add_parser('cat', help='write the R1 or R2 reads of a batch to standard output',
+            formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    cat_parser.add_argument('index_filename', metavar='index.json', help='the batch index file')
+    cat_parser.add_argument('batch_number', metavar='N', type=int, help='the batch number')
+    cat_parser.add_argument('--read', dest='read_number', type=int, choices=[1, 2], default=1, help='the read file to write from')
+    cat_parser.set_defaults(function=cat)
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    start_time = time.time()
+
+    args.function(args)
+
+    elapsed_time = time.time() - start_time
+    logging.info('elapsed time %s', time.strftime('%H hours, %M minutes, %S seconds', time.gmtime(elapsed_time)))
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,39 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+
+import sys
+import argparse
+import logging
+import time
+import os
+
+from roskinlib.record_index import RecordIndex, sorted_record_filenames, name_index_filename, build_name_index
+
+def main():
+    parser = argparse.ArgumentParser(description='index the blocks of the sorted sequence records by subject, V/J gene, CDR3 and lineage',
+            formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('parse_label', metavar='label', help='the parse label to use for the genes and CDR3')
+    parser.add_argument('pathname_base', metavar='dir_path', help='the base pathname of the directory structure from sort_seq_records.py')
+    parser.add_argument('--name-index', action='store_true', help='also write the name index of sorted files that lack one')
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    start_time = time.time()
+
+    index = RecordIndex.build(args.pathname_base, args.parse_label)
+    for key in index.keys():
+        logging.info('indexed %d values of %s', len(index.values(key)), key)
+    index.save()
+
+    if args.name_index:
+        for filename in sorted_record_filenames(args.pathname_base):
+            if not os.path.exists(name_index_filename(filename)):
+                logging.info('writing the name index for %s', filename)
+                build_name_index(filename)
+
+    elapsed_time = time.time() - start_time
+    logging.info('elapsed time %s', time.strftime('%H hours, %M minutes, %S seconds', time.gmtime(elapsed_time)))
+
+if __name__ == '__main__':
+    sys.exit(main())
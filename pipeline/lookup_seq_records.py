@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+
+import sys
+import argparse
+import logging
+
+import fastavro
+
+from roskinlib.record_index import RecordIndex
+from roskinlib.seq_rec import read_labels, labels_metadata
+
+def main():
+    parser = argparse.ArgumentParser(description='output the sequence records matching all the given criteria using the index from index_seq_records.py',
+            formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('pathname_base', metavar='dir_path', help='the base pathname of the indexed directory structure')
+    # the criteria
+    parser.add_argument('--subject', '-s', metavar='S', help='records for the subject')
+    parser.add_argument('--v-gene', '-v', metavar='V', help='records with the V-gene, without the allele')
+    parser.add_argument('--j-gene', '-j', metavar='J', help='records with the J-gene, without the allele')
+    parser.add_argument('--cdr3-aa', metavar='AA', help='records with the CDR3 amino acid sequence')
+    parser.add_argument('--cdr3-nt', metavar='NT', help='records with the CDR3 nucleotide sequence')
+    parser.add_argument('--lineage', '-l', metavar=('label', 'id'), nargs=2, help='records in the lineage with the lineage label')
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    criteria = {key: getattr(args, key) for key in ['subject', 'v_gene', 'j_gene', 'cdr3_aa', 'cdr3_nt']
+                if getattr(args, key) is not None}
+    if args.lineage is not None:
+        criteria['lineage_' + args.lineage[0]] = args.lineage[1]
+    if len(criteria) == 0:
+        parser.error('at least one criterion is needed')
+
+    index = RecordIndex.load(args.pathname_base)
+    if len(index.files) == 0:
+        logging.error('no sequence record files were indexed, exiting')
+        return 10
+    block_count = sum(len(blocks) for blocks in index.blocks(**criteria).values())
+    logging.info('reading %d of %d blocks', block_count, sum(len(f['offsets']) for f in index.files))
+
+    # all the files share the schema
+    with open(index.dataset_root / index.files[0]['path'], 'rb') as seq_record_handle:
+        reader = fastavro.reader(seq_record_handle)
+        schema = reader.writer_schema
+        labels = read_labels(reader)
+
+    fastavro.writer(sys.stdout.buffer, schema, index.lookup(**criteria), codec='bzip2',
+            metadata=labels_metadata(labels))
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -14,6 +14,7 @@ from Bio import SeqIO
 
 from roskinlib.utils import open_compressed, make_range
 from roskinlib.parsers.igblast import IgBLASTParser
+from roskinlib.seq_rec import make_labels, merge_labels, read_labels, labels_metadata
 
 
 def get_padding(seq):
@@ -134,7 +135,11 @@ def main():
         annotator = igblast_annotator(germline_lengths, seq_record_reader, igblast_parse_reader, args.parse_label,
                                     args.min_v_score, args.min_j_score)
 
-        fastavro.writer(sys.stdout.buffer, seq_record_reader.writer_schema, annotator, codec='bzip2')
+        # record the added parse label in the file metadata
+        labels = merge_labels(read_labels(seq_record_reader), make_labels(parses=[args.parse_label]))
+
+        fastavro.writer(sys.stdout.buffer, seq_record_reader.writer_schema, annotator, codec='bzip2',
+                metadata=labels_metadata(labels))
 
     elapsed_time = time.time() - start_time
     logging.info('elapsed time %s', time.strftime('%H hours, %M minutes, %S seconds', time.gmtime(elapsed_time)))
@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+
+import sys
+import argparse
+import logging
+import time
+import csv
+
+import numpy as np
+
+from roskinlib.utils import open_compressed
+from roskinlib.fastq import read_fastq_batches
+from roskinlib.kmer_screen import KmerIndex
+from roskinlib.sam import best_read_scores
+from roskinlib.batch_index import BatchIndex
+
+
+def read_pair_id(read_id):
+    # the read name as bwa reports it, without a /1 or /2 suffix
+    pair_id = read_id.decode('ascii')
+    if pair_id.endswith('/1') or pair_id.endswith('/2'):
+        pair_id = pair_id[:-2]
+    return pair_id
+
+def screen_scores(index, batches):
+    # the score of each read by its pair id
+    for batch in batches:
+        scores = index.scores(batch.sequences())
+        for read_id, score in zip(batch.ids(), scores.tolist()):
+            yield read_pair_id(read_id), score
+
+def fastq_file_batches(fastq_filename, batch_size, batch_index=None, batch_number=None):
+    # the FastqBatch objects of a file, or of one batch of it read through the batch index
+    if batch_index is not None:
+        yield from batch_index.read_fastq_batches(batch_number, batch_index.read_number(fastq_filename), batch_size)
+    else:
+        with open_compressed(fastq_filename, 'rb') as fastq_handle:
+            yield from read_fastq_batches(fastq_handle, batch_size)
+
+def screen(args):
+    batch_index = None
+    if args.batch_index is not None:
+        if args.index_file is None:
+            logging.error('the batch index file must be given with --index-file')
+            return 10
+        batch_index = BatchIndex.load(args.index_file)
+
+    index = KmerIndex.from_fasta(args.genome_filename, k=args.kmer_size,
+                                 mismatch_penalty=args.mismatch_penalty, min_score=args.min_score)
+    logging.info('indexed %d %d-mers of %s', len(index.codes), index.k, args.genome_filename)
+
+    writer = csv.writer(sys.stdout)
+    writer.writerow(['pair_id', 'align_score'])
+
+    read_count = 0
+    hit_count = 0
+    for fastq_filename in args.fastq_filenames:
+        batches = fastq_file_batches(fastq_filename, args.batch_size, batch_index, args.batch_index)
+        # the best score of each interleaved pair, like bwa mem -p
+        for pair_id, score in best_read_scores(screen_scores(index, batches)):
+            writer.writerow([pair_id, score])
+            read_count += 1
+            if score > 0:
+                hit_count += 1
+
+    logging.info('screened %d reads, %d hit the genome', read_count, hit_count)
+
+def read_scores(filename):
+    with open_compressed(filename, 'rt') as score_handle:
+        return {record['pair_id']: int(record['align_score']) for record in csv.DictReader(score_handle)}
+
+def concordance(args):
+    kmer_scores = read_scores(args.screen_filename)
+    bwa_scores = read_scores(args.bwa_filename)
+    pair_ids = [pair_id for pair_id in bwa_scores if pair_id in kmer_scores]
+    if len(pair_ids) < len(bwa_scores) or len(pair_ids) < len(kmer_scores):
+        logging.warning('%d reads are only scored by bwa and %d only by the screen',
+                        len(bwa_scores) - len(pair_ids), len(kmer_scores) - len(pair_ids))
+
+    screen_hits = np.array([kmer_scores[p] > args.threshold for p in pair_ids], dtype=bool)
+    bwa_hits = np.array([bwa_scores[p] > args.threshold for p in pair_ids], dtype=bool)
+    both = screen_hits & bwa_hits
+    screen_values = np.array([kmer_scores[p] for p in pair_ids], dtype=np.float64)[both]
+    bwa_values = np.array([bwa_scores[p] for p in pair_ids], dtype=np.float64)[both]
+
+    report = [('reads',              len(pair_ids)),
+              ('both_hit',           int(both.sum())),
+              ('bwa_only_hit',       int((bwa_hits & ~screen_hits).sum())),
+              ('screen_only_hit',    int((screen_hits & ~bwa_hits).sum())),
+              ('neither_hit',        int((~screen_hits & ~bwa_hits).sum())),
+              ('sensitivity',        float(both.sum() / bwa_hits.sum()) if bwa_hits.any() else None),
+              ('precision',          float(both.sum() / screen_hits.sum()) if screen_hits.any() else None),
+              ('mean_score_diff',    float(np.mean(screen_values - bwa_values)) if both.any() else None),
+              ('mean_abs_score_diff', float(np.mean(np.abs(screen_values - bwa_values))) if both.any() else None),
+              ('score_correlation',  float(np.corrcoef(screen_values, bwa_values)[0, 1]) if both.sum() > 1 else None)]
+
+    writer = csv.writer(sys.stdout)
+    writer.writerow(['measure', 'value'])
+    writer.writerows(report)
+
+def main():
+    parser = argparse.ArgumentParser(description='screen reads for PhiX contamination with a k-mer index of the genome',
+            formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    screen_parser = subparsers.add_parser('screen', help='write the pair_id,align_score table of the reads, like sam_align_score.py',
+            formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    screen_parser.add_argument('genome_filename', metavar='genome.fasta', help='the PhiX genome')
+    screen_parser.add_argument('fastq_filenames', metavar='file.fq', nargs='*', default=['-'], help='the FASTQ files to screen')
+    screen_parser.add_argument('--kmer-size', '-k', metavar='K', type=int, default=19, help='the length of the k-mers, like the bwa mem minimum seed length')
+    screen_parser.add_argument('--mismatch-penalty', metavar='P', type=int, default=4, help='the score taken off for each break in the k-mer hits')
+    screen_parser.add_argument('--min-score', '-T', metavar='S', type=int, default=30, help='report lower scores as 0, like the bwa mem output threshold')
+    screen_parser.add_argument('--batch-size', '-b', metavar='B', type=int, default=100000, help='the number of reads to score at a time')
+    screen_parser.add_argument('--batch-index', metavar='N', type=int, help='only screen the reads of batch N of the batch index')
+    screen_parser.add_argument('--index-file', metavar='index.json', help='the batch index from index_fastq_batches.py, needed with --batch-index')
+    screen_parser.set_defaults(function=screen)
+
+    concordance_parser = subparsers.add_parser('concordance', help='compare the scores of the screen to those of the bwa mem path for the same reads',
+            formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    concordance_parser.add_argument('screen_filename', metavar='screen.csv', help='the scores from the screen')
+    concordance_parser.add_argument('bwa_filename', metavar='bwa.csv', help='the scores from bwa mem and sam_align_score.py')
+    concordance_parser.add_argument('--threshold', '-t', metavar='S', type=int, default=0, help='scores above this are PhiX hits')
+    concordance_parser.set_defaults(function=concordance)
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    start_time = time.time()
+
+    status = args.function(args)
+
+    elapsed_time = time.time() - start_time
+    logging.info('elapsed time %s', time.strftime('%H hours, %M minutes, %S seconds', time.gmtime(elapsed_time)))
+    return status
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -6,12 +6,8 @@ import sys
 import argparse
 import logging
 import time
-import re
-from collections import Counter
 
-import fastavro
-
-from roskinlib.utils import open_compressed
+from roskinlib.stats import StatsEngine
 
 
 def main():
@@ -24,7 +20,7 @@ def main():
     logging.basicConfig(level=logging.INFO)
     start_time = time.time()
 
-    subject_source_counts = Counter()
+    engine = StatsEngine(['subject_counts'])
 
     if len(args.seq_record_filename) == 0:
         seq_record_filenames = ['-']
@@ -33,14 +29,10 @@ def main():
 
     for record_filename in seq_record_filenames:
         logging.info('processing file %s', record_filename)
-        with open_compressed(record_filename, 'rb') as seq_record_handle:
-            for record in fastavro.reader(seq_record_handle):
-                subject = record['subject']
-                source  = record['source']
-                subject_source_counts[(subject, source)] += 1
-
-    for subject, source in subject_source_counts:
-        print(subject, source, subject_source_counts[(subject, source)], sep='\t')
+        engine.add_file(record_filename)
+
+    for subject, source, count in engine.statistics['subject_counts'].rows():
+        print(subject, source, count, sep='\t')
     
 if __name__ == '__main__':
     sys.exit(main())
@@ -6,71 +6,180 @@ import sys
 import argparse
 import logging
 import time
-import itertools
 import io
+import os
+import uuid
 
 import fastavro
 import pyarrow as pa
 import pyarrow.parquet as pq
 
+from Bio.Seq import Seq
+
 from roskinlib.utils import open_compressed
 from roskinlib.schemata.avro import SEQUENCE, PARSE
+from roskinlib.seq_rec import best_vdj_score, get_query_region, v_mutation_counts, read_labels, scan_labels
+from roskinlib.parsers.igblast import region_labels
 
-def deduce_schema(filename, examine_records=1000):
-    with open_compressed(filename, 'rb') as file_handle:
-        reader = fastavro.reader(file_handle)
-
-        # read a batch of records, size examine_records, to figure out what columns to make
-        parses_ids = set()
-        lineages_ids = set()
-        for record in itertools.islice(reader, examine_records):
-            if 'parses' in record:
-                parses_ids.update(record['parses'].keys())
-            if 'lineages' in record:
-                lineages_ids.update(record['lineages'].keys())
-
-        schema = pa.schema([pa.field('subject',  pa.string(), nullable=False),
-                            pa.field('sample',   pa.string(), nullable=True),
-                            pa.field('source',   pa.string(), nullable=False),
-                            pa.field('name',     pa.string(), nullable=False),
-                            pa.field('sequence', pa.binary(), nullable=False)] +
-                           [pa.field('parse_' + p, pa.binary(), nullable=True) for p in sorted(parses_ids)] +
-                           [pa.field('lineage_' + p, pa.string(), nullable=True) for p in sorted(lineages_ids)])
-
-        return schema, parses_ids, lineages_ids
-
-def avro_1st_field_iterator(filename, fieldname):
-    with open_compressed(filename, 'rb') as file_handle:
-        reader = fastavro.reader(file_handle)
-        for record in reader:
-            yield record[fieldname]
-
-def avro_2nd_field_iterator(filename, fieldname1, fieldname2):
-    with open_compressed(filename, 'rb') as file_handle:
-        reader = fastavro.reader(file_handle)
-        for record in reader:
-            yield record[fieldname1][fieldname2]
+# the columns used to partition the dataset into directories
+PARTITION_COLUMNS = ['subject', 'sample', 'source']
+HIVE_DEFAULT_PARTITION = '__HIVE_DEFAULT_PARTITION__'
+# used for gene names and other columns with only a few distinct values
+DICTIONARY_STRING = pa.dictionary(pa.int32(), pa.string())
 
-def avro_2nd_field_missable_iterator(filename, fieldname1, fieldname2):
+def deduce_schema(filename, layout='columnar'):
+    # use the labels recorded in the file metadata to figure out what columns to make
     with open_compressed(filename, 'rb') as file_handle:
-        reader = fastavro.reader(file_handle)
-        for record in reader:
-            if fieldname2 in record[fieldname1]:
-                yield record[fieldname1][fieldname2]
-            else:
-                yield None
-
-def avro_encoder(it, schema):
-    for i in it:
-        if i is None:
-            yield None
+        labels = read_labels(fastavro.reader(file_handle))
+
+    # older files don't have them, so read just the labels of every record
+    if labels is None:
+        logging.info('no labels recorded in %s, scanning the records for them', filename)
+        with open_compressed(filename, 'rb') as file_handle:
+            labels = scan_labels(file_handle)
+
+    labels = {k: sorted(v) for k, v in labels.items()}
+    labels['regions'] = list(region_labels)
+
+    if layout == 'columnar':
+        schema = columnar_schema(labels)
+    else:
+        schema = binary_schema(labels)
+
+    return schema, labels
+
+def binary_schema(labels):
+    # the sequence and parses are stored as Avro encoded blobs
+    return pa.schema([pa.field('subject',  pa.string(), nullable=False),
+                      pa.field('sample',   pa.string(), nullable=True),
+                      pa.field('source',   pa.string(), nullable=False),
+                      pa.field('name',     pa.string(), nullable=False),
+                      pa.field('sequence', pa.binary(), nullable=False)] +
+                     [pa.field('parse_' + p, pa.binary(), nullable=True) for p in labels['parses']] +
+                     [pa.field('lineage_' + p, pa.string(), nullable=True) for p in labels['lineages']])
+
+def binary_row(record, labels, sequence_avro_schema, parse_avro_schema):
+    return [record['name'], avro_encode(record['sequence'], sequence_avro_schema)] + \
+           [avro_encode(record['parses'].get(p), parse_avro_schema) for p in labels['parses']] + \
+           [record['lineages'].get(l) for l in labels['lineages']]
+
+def columnar_schema(labels):
+    # each parse is flattened into its own set of columns, repeated values are dictionary encoded
+    fields = [pa.field('subject',  pa.string(), nullable=False),
+              pa.field('sample',   pa.string(), nullable=True),
+              pa.field('source',   pa.string(), nullable=False),
+              pa.field('name',     pa.string(), nullable=False),
+              pa.field('sequence', pa.string(), nullable=False),
+              pa.field('qual',     pa.string(), nullable=False)] + \
+             [pa.field('annotation_' + a, DICTIONARY_STRING, nullable=True) for a in labels['annotations']]
+
+    for p in labels['parses']:
+        prefix = 'parse_' + p + '_'
+        fields += [pa.field(prefix + 'chain',           DICTIONARY_STRING),
+                   pa.field(prefix + 'has_stop_codon',  pa.bool_()),
+                   pa.field(prefix + 'v_j_in_frame',    pa.bool_()),
+                   pa.field(prefix + 'positive_strand', pa.bool_()),
+                   pa.field(prefix + 'v_name',          DICTIONARY_STRING),
+                   pa.field(prefix + 'v_score',         pa.float32()),
+                   pa.field(prefix + 'd_name',          DICTIONARY_STRING),
+                   pa.field(prefix + 'd_score',         pa.float32()),
+                   pa.field(prefix + 'j_name',          DICTIONARY_STRING),
+                   pa.field(prefix + 'j_score',         pa.float32()),
+                   pa.field(prefix + 'cdr3_nt',         pa.string()),
+                   pa.field(prefix + 'cdr3_aa',         pa.string()),
+                   pa.field(prefix + 'v_mismatches',    pa.int32()),
+                   pa.field(prefix + 'v_matches',       pa.int32())]
+        for r in labels['regions']:
+            fields += [pa.field(prefix + r + '_start', pa.int32()),
+                       pa.field(prefix + r + '_stop',  pa.int32())]
+
+    fields += [pa.field('lineage_' + l, pa.string(), nullable=True) for l in labels['lineages']]
+
+    return pa.schema(fields)
+
+def columnar_parse_values(parse, regions):
+    if parse is None:
+        return [None] * (14 + 2 * len(regions))
+
+    best_v, best_v_score, best_d, best_d_score, best_j, best_j_score = best_vdj_score(parse)
+
+    cdr3_nt = get_query_region(parse, 'CDR3')
+    cdr3_aa = None if cdr3_nt is None else str(Seq(cdr3_nt).translate())
+
+    v_mismatches, v_matches = v_mutation_counts(parse)
+
+    values = [parse['chain'], parse['has_stop_codon'], parse['v_j_in_frame'], parse['positive_strand'],
+              best_v, best_v_score, best_d, best_d_score, best_j, best_j_score,
+              cdr3_nt, cdr3_aa, v_mismatches, v_matches]
+    for r in regions:
+        region_range = parse['ranges'].get(r)
+        if region_range is None:
+            values += [None, None]
         else:
-            data = io.BytesIO()
-            fastavro.schemaless_writer(data, schema, i)
-            yield data.getvalue()
-
-def take(n, iterable):
-    return list(itertools.islice(iterable, n))
+            values += [region_range['start'], region_range['stop']]
+
+    return values
+
+def columnar_row(record, labels):
+    sequence = record['sequence']
+    annotations = sequence['annotations']
+
+    row = [record['name'], sequence['sequence'], sequence['qual']] + \
+          [None if annotations.get(a) is None else str(annotations[a]) for a in labels['annotations']]
+    for p in labels['parses']:
+        row += columnar_parse_values(record['parses'].get(p), labels['regions'])
+    row += [record['lineages'].get(l) for l in labels['lineages']]
+
+    return row
+
+def avro_encode(value, schema):
+    if value is None:
+        return None
+    else:
+        data = io.BytesIO()
+        fastavro.schemaless_writer(data, schema, value)
+        return data.getvalue()
+
+def partition_path(dataset_root, values):
+    # HIVE style directories, with the same placeholder for missing values as pyarrow
+    parts = ['%s=%s' % (column, HIVE_DEFAULT_PARTITION if value is None else value)
+             for column, value in zip(PARTITION_COLUMNS, values)]
+    return os.path.join(dataset_root, *parts)
+
+class PartitionWriter:
+    """Accumulates the rows of one partition and writes them out a row group at a time.
+    """
+    def __init__(self, dataset_root, values, schema, batch_size):
+        self.path = partition_path(dataset_root, values)
+        self.schema = schema
+        self.batch_size = batch_size
+        self.columns = [[] for _ in schema]
+        self.row_count = 0
+        self.writer = None
+
+    def append(self, row):
+        for column, value in zip(self.columns, row):
+            column.append(value)
+        if len(self.columns[0]) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if len(self.columns[0]) == 0:
+            return
+        if self.writer is None:
+            os.makedirs(self.path, exist_ok=True)
+            filename = os.path.join(self.path, uuid.uuid4().hex + '.parquet')
+            self.writer = pq.ParquetWriter(filename, self.schema, compression='gzip')
+        table = pa.Table.from_arrays([pa.array(c, type=f.type) for c, f in zip(self.columns, self.schema)],
+                                     schema=self.schema)
+        self.writer.write_table(table)
+        self.row_count += table.num_rows
+        self.columns = [[] for _ in self.schema]
+
+    def close(self):
+        self.flush()
+        if self.writer is not None:
+            self.writer.close()
 
 def main():
     parser = argparse.ArgumentParser(description='convert a sequence records in Avro file format to Paquet',
@@ -80,46 +189,50 @@ def main():
     # output directory
     parser.add_argument('dataset_root', metavar='dataset-root', help='the root directory of the Parquet dataset')
     # options
-    parser.add_argument('--batch-size', '-b', metavar='B', type=int, default=50000, help='the number of rows to insert at a time')
+    parser.add_argument('--batch-size', '-b', metavar='B', type=int, default=50000, help='the number of rows in each row group')
+    parser.add_argument('--layout', choices=['columnar', 'binary'], default='columnar',
+            help='flatten the parses into columns or store them as Avro encoded binary')
 
     args = parser.parse_args()
     logging.basicConfig(level=logging.INFO)
     start_time = time.time()
 
     filename = args.seq_record_filename
-    batch_n = args.batch_size
-
-    sequence_avro_schema = fastavro.parse_schema(SEQUENCE)
-    parse_avro_schema    = fastavro.parse_schema(PARSE)
-
-    parquet_schema, parses_ids, lineages_ids = deduce_schema(filename)
-
-    data_iters = [avro_1st_field_iterator(filename, 'subject'),
-                  avro_1st_field_iterator(filename, 'sample'),
-                  avro_1st_field_iterator(filename, 'source'),
-                  avro_1st_field_iterator(filename, 'name'),
-                  avro_encoder(avro_1st_field_iterator(filename, 'sequence'), sequence_avro_schema)] + \
-                 [avro_encoder(avro_2nd_field_iterator(filename, 'parses', p), parse_avro_schema) for p in parses_ids] + \
-                 [avro_2nd_field_missable_iterator(filename, 'lineages', l) for l in lineages_ids]
-
-    #with pq.ParquetWriter(sys.stdout.buffer, parquet_schema, compression='gzip') as parquet_file:
-
-    table = pa.Table.from_arrays(data_iters, schema=parquet_schema)
-    pq.write_to_dataset(table, root_path=args.dataset_root, partition_cols=['subject', 'sample', 'source'], compression='gzip')
-
-    #tables_written = 0
-    #still_data = True
-    #while still_data:
-    #    data = [take(batch_n, i) for i in data_iters]
-    #    table = pa.Table.from_arrays(data, schema=parquet_schema)
-    #
-    #    if table.num_rows == 0:
-    #        still_data = False
-    #    else:
-    #        #parquet_file.write_table(table)
-    #        pq.write_to_dataset(table, root_path=args.dataset_root, partition_cols=['subject', 'sample', 'source'], compression='gzip')
-    #        tables_written += 1
 
+    # the parse schema uses the range type defined in the sequence schema
+    named_schemas = {}
+    sequence_avro_schema = fastavro.parse_schema(SEQUENCE, named_schemas)
+    parse_avro_schema    = fastavro.parse_schema(PARSE, named_schemas)
+
+    parquet_schema, labels = deduce_schema(filename, layout=args.layout)
+
+    # the partition columns are in the directory names, not the files
+    file_schema = pa.schema([f for f in parquet_schema if f.name not in PARTITION_COLUMNS])
+
+    # decode each record once, routing its row to the writer for its partition
+    partition_writers = {}
+    record_count = 0
+    with open_compressed(filename, 'rb') as file_handle:
+        for record in fastavro.reader(file_handle):
+            values = tuple(record[c] for c in PARTITION_COLUMNS)
+            if values not in partition_writers:
+                logging.info('writing partition %s', partition_path(args.dataset_root, values))
+                partition_writers[values] = PartitionWriter(args.dataset_root, values, file_schema, args.batch_size)
+
+            if args.layout == 'columnar':
+                row = columnar_row(record, labels)
+            else:
+                row = binary_row(record, labels, sequence_avro_schema, parse_avro_schema)
+            partition_writers[values].append(row)
+
+            record_count += 1
+            if record_count % 100000 == 0:
+                logging.info('processed %d records', record_count)
+
+    for partition_writer in partition_writers.values():
+        partition_writer.close()
+
+    logging.info('wrote %d records to %d partitions', record_count, len(partition_writers))
     elapsed_time = time.time() - start_time
     logging.info('elapsed time %s', time.strftime('%H hours, %M minutes, %S seconds', time.gmtime(elapsed_time)))
     
@@ -6,13 +6,8 @@ import sys
 import argparse
 import logging
 import time
-import re
-import os
-from collections import Counter
-from itertools import chain
 
-import fastavro
-from roskinlib.utils import open_compressed
+from roskinlib.stats import StatsEngine
 
 
 def main():
@@ -27,7 +22,12 @@ def main():
     logging.basicConfig(level=logging.INFO)
     start_time = time.time()
 
-    record_count = 0
+    engine = StatsEngine(['ident_counts'], parse_label=args.parse_label)
+    for filename in args.seq_record_filenames:
+        logging.info('processing sequence record file %s', filename)
+        engine.add_file(filename)
+
+    record_count = engine.record_count
     no_subject = 0
     no_subject_full_ident = 0
     no_subject_phix = 0
@@ -35,34 +35,19 @@ def main():
     yes_subject = 0
     yes_subject_parsed = 0
 
-    for filename in args.seq_record_filenames:
-        logging.info('processing sequence record file %s', filename)
-        with open_compressed(filename, 'rb') as input_handle:
-            reader = fastavro.reader(input_handle)
-            for record in reader:
-                record_count += 1
-
-                if record['subject'] is None:
-                    no_subject += 1
-
-                    if record['sequence']['annotations']['barcode1'] is not None and \
-                       record['sequence']['annotations']['target1']  is not None and \
-                       record['sequence']['annotations']['barcode1'] is not None and \
-                       record['sequence']['annotations']['target2']  is not None:
-                        no_subject_full_ident += 1
-
-                    if record['sequence']['annotations']['phix1'] > 0 or \
-                       record['sequence']['annotations']['phix2'] > 0:
-                        no_subject_phix += 1
-
-                    if args.parse_label:
-                        if args.parse_label in record['parses'] and record['parses'][args.parse_label] is not None:
-                            no_subject_parsed += 1
-                else:
-                    yes_subject += 1
-                    if args.parse_label:
-                        if args.parse_label in record['parses'] and record['parses'][args.parse_label] is not None:
-                            yes_subject_parsed += 1
+    for has_subject, parsed, full_ident, phix, count in engine.statistics['ident_counts'].rows():
+        if not has_subject:
+            no_subject += count
+            if full_ident:
+                no_subject_full_ident += count
+            if phix:
+                no_subject_phix += count
+            if parsed:
+                no_subject_parsed += count
+        else:
+            yes_subject += count
+            if parsed:
+                yes_subject_parsed += count
 
     print('processed %d records' % record_count)
     print('  %d (%0.2f%%) had subject' % (yes_subject, 100*yes_subject/record_count))
@@ -11,31 +11,15 @@ import tempfile
 from operator import itemgetter
 
 import fastavro
-from fastavro.io.binary_encoder import BinaryEncoder
-from fastavro.io.json_encoder import AvroJSONEncoder
 from fastavro.read import SYNC_SIZE
 from fastavro.write import Writer
 
 from roskinlib.utils import open_compressed
+from roskinlib.seq_rec import make_labels, merge_labels, read_labels, labels_metadata
+from roskinlib.record_index import write_name_sorted_records
 
-def open_avro(fo, schema, codec='null', sync_interval=1000 * SYNC_SIZE, metadata=None,
-              validator=None, sync_marker=None, codec_compression_level=None):
-    if isinstance(fo, AvroJSONEncoder):
-        writer_class = JSONWriter
-    else:
-        # Assume a binary IO if an encoder isn't given
-        writer_class = Writer
-        fo = BinaryEncoder(fo)
-
-    output = writer_class(fo,
-                          schema,
-                          codec,
-                          sync_interval,
-                          metadata,
-                          validator,
-                          sync_marker,
-                          codec_compression_level)
-    return output
+def open_avro(fo, schema, codec='null', sync_interval=1000 * SYNC_SIZE, metadata=None):
+    return Writer(fo, schema, codec=codec, sync_interval=sync_interval, metadata=metadata)
 
 def main():
     parser = argparse.ArgumentParser(description='sort the sequence records in the given Avro file into a HIVE style directory structure',
@@ -47,6 +31,7 @@ def main():
     arg_group = parser.add_mutually_exclusive_group(required=False)
     arg_group.add_argument('--no-none', action='store_true', help='do not process records without a subject')
     arg_group.add_argument('--only-none', action='store_true', help='only process records without a subject')
+    parser.add_argument('--block-records', metavar='N', type=int, default=1000, help='the number of records in each block of the sorted files')
 
     args = parser.parse_args()
     logging.basicConfig(level=logging.INFO)
@@ -65,10 +50,12 @@ def main():
         logging.info('writing sequences to %s', temp_dir_name)
         temp_handles = {}
         temp_writers = {}
+        labels = make_labels()  # the labels used across all the input files
         for filename in args.seq_record_filenames:
             logging.info('loading sequence records from %s', filename)
             with open_compressed(filename, 'rb') as seq_record_handle:
                 seq_record_reader = fastavro.reader(seq_record_handle)
+                labels = merge_labels(labels, read_labels(seq_record_reader))
                 for record in seq_record_reader:
                     subject = record['subject']
                     source  = record['source']
@@ -115,8 +102,8 @@ def main():
 
                 logging.info('writing records subject=%s/source=%s', subject, source)
                 output_filename = os.path.join(base_path, f'subject={subject}', f'source={source}.avro')
-                with open(output_filename, 'wb') as output_handle:
-                    fastavro.writer(output_handle, reader.writer_schema, records, codec='bzip2')
+                write_name_sorted_records(output_filename, reader.writer_schema, records, codec='bzip2',
+                        metadata=labels_metadata(labels), block_records=args.block_records)
                 del records
 
     elapsed_time = time.time() - start_time
@@ -12,7 +12,7 @@ import fastavro
 from Bio.Seq import Seq
 from roskinlib.utils import batches
 from roskinlib.seq_rec import best_vdj_score, get_query_region, remove_allele
-from roskinlib.warehouse import DirectoryWarehouse
+from roskinlib.warehouse import DirectoryWarehouse, PackedWarehouse
 
 def main():
     parser = argparse.ArgumentParser(description='batch paired-end sequences from an Illumina run of an amplicon library',
@@ -32,12 +32,15 @@ def main():
     # default cutoffs for V- and J-scores
     parser.add_argument('--min-v-score', '-v', metavar='S',  type=int, default=70, help='minimum V-segment score')
     parser.add_argument('--min-j-score', '-j', metavar='S',  type=int, default=26, help='minimum J-segment score')
+    # storage
+    parser.add_argument('--packed', action='store_true', help='pack the batch files into a single file, only one job can write to it at a time')
 
     args = parser.parse_args()
     logging.basicConfig(level=logging.INFO)
     start_time = time.time()
 
-    warehouse = DirectoryWarehouse(args.batch_dirname, 'v_segment', 'j_segment', 'cdr3_len', 'subject',
+    warehouse_class = PackedWarehouse if args.packed else DirectoryWarehouse
+    warehouse = warehouse_class(args.batch_dirname, 'v_segment', 'j_segment', 'cdr3_len', 'subject',
         value_encoder=lambda x: str(x).replace('/', 's'))
 
     read_count = 0
@@ -108,14 +111,18 @@ def main():
 
     logging.info('making batch files')
 
-    for signature, cdr3_aa in data.items():
-        best_v, best_j, cdr3_length = signature
+    with warehouse.writer('wt') as writer:
+        for signature, cdr3_aa in data.items():
+            best_v, best_j, cdr3_length = signature
 
-        with warehouse.open('.fasta', 'wt', v_segment=best_v, j_segment=best_j, cdr3_len=cdr3_length,
-                subject=subject) as fasta_file_handle:
-            for sequence, labels in cdr3_aa.items():
-                for l in batches(labels, args.max_idents):
-                    fasta_file_handle.write('>%s\n%s\n' % (','.join([';'.join(i) for i in l]), sequence))
+            records = ['>%s\n%s\n' % (','.join([';'.join(i) for i in l]), sequence)
+                       for sequence, labels in cdr3_aa.items() for l in batches(labels, args.max_idents)]
+            writer.write('.fasta', ''.join(records), v_segment=best_v, j_segment=best_j, cdr3_len=cdr3_length,
+                    subject=subject)
+
+    warehouse.close()
+    logging.info('wrote %d batch files, made %d directories',
+            warehouse.counters['partitions_opened'], warehouse.counters['directories_made'])
 
     logging.info('processed %s sequence records', read_count)
     logging.info('    %d records had no parse or poor V- and J-scores', unparsed_count)
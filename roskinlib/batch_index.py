@@ -0,0 +1,166 @@
+"""Virtual batches of a paired-end run, read straight from the original FASTQ files.
+
+A batch index holds, for each batch, where its reads start in the R1 and
+R2 files and how many bytes of reads it has. The files must be uncompressed
+or BGZF, where the start is a virtual offset: the offset of the block in
+the file shifted up 16 bits plus the offset within the decompressed block,
+as samtools and tabix use.
+"""
+import io
+import os
+import json
+
+import numpy as np
+
+from .bgzf import is_bgzf, bgzf_blocks, ThreadedGzipReader
+from .utils import compression_threads
+from .fastq import read_fastq_batches, read_paired_fastq_batches
+
+BATCH_INDEX_SUFFIX = '.batches.json'
+
+def batch_index_filename(r1_filename):
+    """Return the default batch index filename of a run, named after its R1 file.
+    """
+    return r1_filename + BATCH_INDEX_SUFFIX
+
+def _is_bgzf_file(filename):
+    with open(filename, 'rb') as handle:
+        if is_bgzf(handle):
+            return True
+        if handle.peek(2)[:2] == b'\x1f\x8b' or filename.endswith(('.bz2', '.zst')):
+            raise ValueError('%s can\'t be read from the middle, only uncompressed and BGZF files can be indexed, '
+                             'recompress it with bgzip' % filename)
+    return False
+
+def _chunks(handle, bgzf, chunk_size=1 << 22):
+    # the (virtual offset of the start, data) of each piece of the decompressed file
+    if bgzf:
+        for offset, data in bgzf_blocks(handle):
+            yield offset << 16, data
+    else:
+        offset = 0
+        for data in iter(lambda: handle.read(chunk_size), b''):
+            yield offset, data
+            offset += len(data)
+
+def _scan_batches(filename, bgzf, batch_size):
+    # the virtual and decompressed offsets of the first record of each batch, the decompressed size and the number of records
+    lines_per_batch = 4 * batch_size
+    starts = []
+    line_count = 0
+    size = 0
+    last_byte = b'\n'
+    with open(filename, 'rb') as handle:
+        for offset, data in _chunks(handle, bgzf):
+            if not starts and data:
+                starts.append((offset, 0))
+            newlines = np.flatnonzero(np.frombuffer(data, dtype=np.uint8) == ord('\n'))
+            # the newlines that end the last record of a batch
+            first = (-line_count - 1) % lines_per_batch
+            for position in newlines[first::lines_per_batch].tolist():
+                starts.append((offset + position + 1, size + position + 1))
+            line_count += len(newlines)
+            size += len(data)
+            if data:
+                last_byte = data[-1:]
+    if last_byte != b'\n':
+        line_count += 1
+    if line_count % 4 != 0:
+        raise ValueError('%s is not a four line FASTQ file' % filename)
+    # a batch can't start at the end of the file
+    starts = [(offset, start) for offset, start in starts if start < size]
+    return starts, size, line_count // 4
+
+class BatchIndex:
+    """The virtual batches of a pair of R1 and R2 FASTQ files.
+
+    Each batch is a (read count, R1 offset, R1 length, R2 offset, R2 length)
+    list, the lengths are of the decompressed reads.
+    """
+    def __init__(self, filenames, batch_size, batches, file_sizes=None, bgzf=None):
+        self.filenames = [os.path.abspath(f) for f in filenames]
+        self.batch_size = batch_size
+        self.batches = batches
+        self.file_sizes = file_sizes if file_sizes is not None else [os.path.getsize(f) for f in self.filenames]
+        self.bgzf = bgzf if bgzf is not None else [_is_bgzf_file(f) for f in self.filenames]
+
+    def __len__(self):
+        return len(self.batches)
+
+    @classmethod
+    def build(cls, r1_filename, r2_filename, batch_size=50000):
+        """Scan the files once and split them into batches of batch_size read pairs.
+        """
+        filenames = [r1_filename, r2_filename]
+        bgzf = [_is_bgzf_file(f) for f in filenames]
+        (r1_starts, r1_size, r1_count), (r2_starts, r2_size, r2_count) = \
+                [_scan_batches(f, b, batch_size) for f, b in zip(filenames, bgzf)]
+        if r1_count != r2_count:
+            raise ValueError('the read files have different numbers of reads, %d != %d' % (r1_count, r2_count))
+
+        batches = []
+        r1_stops = [start for _, start in r1_starts[1:]] + [r1_size]
+        r2_stops = [start for _, start in r2_starts[1:]] + [r2_size]
+        for number, ((r1_offset, r1_start), r1_stop, (r2_offset, r2_start), r2_stop) in \
+                enumerate(zip(r1_starts, r1_stops, r2_starts, r2_stops)):
+            read_count = min(batch_size, r1_count - number * batch_size)
+            batches.append([read_count, r1_offset, r1_stop - r1_start, r2_offset, r2_stop - r2_start])
+        return cls(filenames, batch_size, batches, bgzf=bgzf)
+
+    def save(self, filename):
+        with open(filename, 'wt') as index_handle:
+            json.dump({'filenames': self.filenames, 'file_sizes': self.file_sizes, 'bgzf': self.bgzf,
+                       'batch_size': self.batch_size, 'batches': self.batches}, index_handle)
+
+    @classmethod
+    def load(cls, filename):
+        with open(filename, 'rt') as index_handle:
+            index = json.load(index_handle)
+        return cls(index['filenames'], index['batch_size'], index['batches'], index['file_sizes'], index['bgzf'])
+
+    def read_number(self, filename):
+        """Return 1 or 2 for the R1 or R2 file of the index.
+        """
+        for number, indexed_filename in enumerate(self.filenames, 1):
+            if os.path.exists(filename) and os.path.samefile(filename, indexed_filename):
+                return number
+        raise ValueError('%s is not one of the indexed files' % filename)
+
+    def open_batch(self, batch_number, read_number, threads=None):
+        """Return a binary handle at the first read of a batch in the R1 or R2 file, and the number of bytes of its reads.
+        """
+        if not 0 <= batch_number < len(self.batches):
+            raise ValueError('there is no batch %d, the index has %d batches' % (batch_number, len(self.batches)))
+        filename = self.filenames[read_number - 1]
+        if os.path.getsize(filename) != self.file_sizes[read_number - 1]:
+            raise ValueError('%s changed since it was indexed' % filename)
+        batch = self.batches[batch_number]
+        offset, length = batch[2 * read_number - 1], batch[2 * read_number]
+
+        handle = open(filename, 'rb')
+        if not self.bgzf[read_number - 1]:
+            handle.seek(offset)
+            return handle, length
+        if threads is None:
+            threads = compression_threads()
+        handle.seek(offset >> 16)
+        reader = io.BufferedReader(ThreadedGzipReader(handle, threads), buffer_size=1 << 20)
+        reader.read(offset & 0xffff)
+        return reader, length
+
+    def read_fastq_batches(self, batch_number, read_number, batch_size=10000, threads=None):
+        """Yield the reads of a batch from the R1 or R2 file as FastqBatch objects.
+        """
+        handle, length = self.open_batch(batch_number, read_number, threads)
+        with handle:
+            yield from read_fastq_batches(handle, batch_size, length=length)
+
+    def read_paired_fastq(self, batch_number, batch_size=10000, threads=None):
+        """Yield the R1 and R2 (title, sequence, quality) string tuples of each read pair of a batch, checking the ids match.
+        """
+        r1_handle, r1_length = self.open_batch(batch_number, 1, threads)
+        r2_handle, r2_length = self.open_batch(batch_number, 2, threads)
+        with r1_handle, r2_handle:
+            for r1_batch, r2_batch in read_paired_fastq_batches(r1_handle, r2_handle, batch_size,
+                                                                r1_length=r1_length, r2_length=r2_length):
+                yield from zip(r1_batch.records(), r2_batch.records())
@@ -0,0 +1,199 @@
+"""Read and write gzip files with a pool of threads.
+
+BGZF files are gzip files made of independent members of at most 64 KiB,
+each with its compressed size in a BC extra field, as used by samtools and
+tabix. Any gzip reader can read them, and because the blocks can be found
+without decompressing anything they can be compressed and decompressed in
+parallel. zlib releases the GIL, so threads are enough for this.
+"""
+import io
+import struct
+import zlib
+import gzip
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# the uncompressed size of a block, chosen by samtools so a compressed block always fits in 64 KiB
+BLOCK_SIZE = 0xff00
+# the number of blocks given to a thread at a time
+_BLOCKS_PER_TASK = 16
+
+_BGZF_HEADER = struct.Struct('<4BI2BH2BHH')
+_BGZF_MAGIC = b'\x1f\x8b\x08\x04'
+# the empty block that ends a BGZF file
+_BGZF_EOF = bytes.fromhex('1f8b08040000000000ff0600424302001b0003000000000000000000')
+
+def _compress_block(data, level):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    deflated = compressor.compress(data) + compressor.flush()
+    header = _BGZF_HEADER.pack(0x1f, 0x8b, 8, 4, 0, 0, 0xff, 6, ord('B'), ord('C'), 2,
+                               len(deflated) + _BGZF_HEADER.size + 8 - 1)
+    return header + deflated + struct.pack('<II', zlib.crc32(data), len(data))
+
+def _compress_blocks(data, level):
+    return b''.join(_compress_block(data[start:start + BLOCK_SIZE], level)
+                    for start in range(0, len(data), BLOCK_SIZE))
+
+def _bgzf_block_size(header):
+    # the size of the BGZF block starting with these bytes, or None if it isn't one
+    if len(header) < _BGZF_HEADER.size or header[:4] != _BGZF_MAGIC:
+        return None
+    fields = _BGZF_HEADER.unpack_from(header)
+    extra_length, subfield_1, subfield_2, subfield_length, block_size = fields[7:]
+    if extra_length != 6 or (subfield_1, subfield_2, subfield_length) != (ord('B'), ord('C'), 2):
+        return None
+    return block_size + 1
+
+def _decompress_blocks(blocks):
+    pieces = []
+    for block in blocks:
+        data = zlib.decompress(block[_BGZF_HEADER.size:-8], -15)
+        crc, size = struct.unpack_from('<II', block, len(block) - 8)
+        if size != len(data) or crc != zlib.crc32(data):
+            raise IOError('BGZF block failed its CRC check')
+        pieces.append(data)
+    return b''.join(pieces)
+
+def is_bgzf(handle):
+    """Return True if a buffered binary handle is at the start of a BGZF file, without reading from it.
+    """
+    return _bgzf_block_size(handle.peek(_BGZF_HEADER.size)[:_BGZF_HEADER.size]) is not None
+
+def _read_block(handle):
+    # the next whole compressed block of a BGZF file, None at the end of the file
+    header = handle.read(_BGZF_HEADER.size)
+    if not header:
+        return None
+    block_size = _bgzf_block_size(header)
+    if block_size is None:
+        raise IOError('not a BGZF block, the file is not all BGZF')
+    block = header + handle.read(block_size - len(header))
+    if len(block) != block_size:
+        raise IOError('truncated BGZF block')
+    return block
+
+def bgzf_blocks(handle):
+    """Yield the offset in the file and the decompressed data of each block of a BGZF file.
+    """
+    offset = handle.tell()
+    for block in iter(lambda: _read_block(handle), None):
+        yield offset, _decompress_blocks([block])
+        offset += len(block)
+
+class ThreadedGzipReader(io.RawIOBase):
+    """Read a gzip file, decompressing it ahead of the reader in a pool of threads.
+
+    BGZF files are decompressed by all the threads a group of blocks at a
+    time. Other gzip files can't be split, so one thread decompresses them
+    while the caller works on what was decompressed before.
+    """
+    def __init__(self, handle, threads=4, close_handle=True):
+        self.handle = handle if isinstance(handle, io.BufferedReader) else io.BufferedReader(handle)
+        self.close_handle = close_handle
+        self.bgzf = is_bgzf(self.handle)
+        if self.bgzf:
+            self._executor = ThreadPoolExecutor(threads)
+            self._ahead = 2 * threads
+        else:
+            self._gzip_file = gzip.GzipFile(fileobj=self.handle)
+            self._executor = ThreadPoolExecutor(1)
+            self._ahead = 2
+        self._pending = deque()
+        self._buffer = b''
+        self._position = 0
+        self._at_end = False
+
+    def _next_blocks(self):
+        # read the next group of compressed blocks, this runs in the caller's thread
+        blocks = []
+        while len(blocks) < _BLOCKS_PER_TASK:
+            block = _read_block(self.handle)
+            if block is None:
+                break
+            blocks.append(block)
+        return blocks
+
+    def _fill(self):
+        # keep the pool busy with the tasks after the one about to be used
+        while not self._at_end and len(self._pending) < self._ahead:
+            if self.bgzf:
+                blocks = self._next_blocks()
+                if not blocks:
+                    self._at_end = True
+                    break
+                self._pending.append(self._executor.submit(_decompress_blocks, blocks))
+            else:
+                # one worker, so the reads happen in order
+                self._pending.append(self._executor.submit(self._gzip_file.read, _BLOCKS_PER_TASK * BLOCK_SIZE))
+        if not self._pending:
+            return False
+        self._buffer = self._pending.popleft().result()
+        self._position = 0
+        if not self.bgzf and not self._buffer:
+            # the end of a plain gzip file, BGZF files can have empty blocks anywhere
+            self._at_end = True
+            self._pending.clear()
+            return False
+        return True
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while self._position >= len(self._buffer):
+            if not self._fill():
+                return 0
+        size = min(len(buffer), len(self._buffer) - self._position)
+        buffer[:size] = self._buffer[self._position:self._position + size]
+        self._position += size
+        return size
+
+    def close(self):
+        if not self.closed:
+            self._executor.shutdown(wait=True)
+            if self.close_handle:
+                self.handle.close()
+        super().close()
+
+class BgzfWriter(io.RawIOBase):
+    """Write a BGZF file, compressing the blocks in a pool of threads.
+    """
+    def __init__(self, handle, threads=4, level=6, close_handle=True):
+        self.handle = handle
+        self.level = level
+        self.close_handle = close_handle
+        self._executor = ThreadPoolExecutor(threads)
+        self._pending = deque()
+        self._ahead = 2 * threads
+        self._buffer = bytearray()
+
+    def writable(self):
+        return True
+
+    def _submit(self, data):
+        self._pending.append(self._executor.submit(_compress_blocks, data, self.level))
+        while len(self._pending) > self._ahead:
+            self.handle.write(self._pending.popleft().result())
+
+    def write(self, data):
+        self._buffer += data
+        task_size = _BLOCKS_PER_TASK * BLOCK_SIZE
+        if len(self._buffer) >= task_size:
+            whole = len(self._buffer) - len(self._buffer) % task_size
+            for start in range(0, whole, task_size):
+                self._submit(bytes(self._buffer[start:start + task_size]))
+            del self._buffer[:whole]
+        return len(data)
+
+    def close(self):
+        if not self.closed:
+            if self._buffer:
+                self._submit(bytes(self._buffer))
+                self._buffer.clear()
+            while self._pending:
+                self.handle.write(self._pending.popleft().result())
+            self.handle.write(_BGZF_EOF)
+            self._executor.shutdown(wait=True)
+            if self.close_handle:
+                self.handle.close()
+        super().close()
@@ -0,0 +1,337 @@
+import os
+import json
+import hashlib
+import logging
+import pathlib
+import threading
+from collections import Counter, OrderedDict, namedtuple
+
+import numpy as np
+import pyarrow.parquet as pq
+
+# the placeholder pyarrow and seq_record_to_parquet.py use for missing partition values
+HIVE_DEFAULT_PARTITION = '__HIVE_DEFAULT_PARTITION__'
+# the directory, under the dataset root, where the sort indexes are kept
+SORT_INDEX_DIRNAME = '_sort_indexes'
+
+RowGroup = namedtuple('RowGroup', ['path', 'index', 'num_rows', 'partition'])
+
+def _cell(value):
+    # DataTables gets every value as a string, like it would from MySQL
+    if value is None:
+        return ''
+    return str(value)
+
+def _dictionary_encode(column):
+    """Return the distinct values of an Arrow column and the code of each row, -1 for nulls.
+    """
+    values = []
+    codes = []
+    for chunk in column.chunks:
+        if not hasattr(chunk, 'dictionary'):
+            chunk = chunk.dictionary_encode()
+        indices = chunk.indices.to_numpy(zero_copy_only=False)
+        if chunk.null_count > 0:
+            nulls = chunk.is_null().to_numpy(zero_copy_only=False)
+            indices = np.where(nulls, -1, np.nan_to_num(indices) + len(values))
+        else:
+            indices = indices + len(values)
+        codes.append(indices.astype(np.int64))
+        values.extend(chunk.dictionary.to_pylist())
+    if len(codes) == 0:
+        return values, np.empty(0, dtype=np.int64)
+    return values, np.concatenate(codes)
+
+class ParquetDataTable:
+    """Answer DataTables server-side processing requests from a partitioned Parquet dataset.
+
+    The dataset is the directory tree written by seq_record_to_parquet.py. Only
+    the row groups holding the requested page are read. Column searches on the
+    partition columns skip whole row groups without reading them, other searches
+    read just the searched columns. Sorting uses a precomputed rank of every
+    row for each column, kept on disk under the dataset root, and the row
+    numbers matching recent searches and orderings are cached.
+
+    Columns missing from the dataset are served as empty strings.
+    """
+    def __init__(self, dataset_root, columns, cache_size=32, index_directory=None):
+        self.dataset_root = pathlib.Path(dataset_root)
+        self.columns = list(columns)
+        self.cache_size = cache_size
+        if index_directory is None:
+            self.index_directory = self.dataset_root / SORT_INDEX_DIRNAME
+        else:
+            self.index_directory = pathlib.Path(index_directory)
+        self.counters = Counter()   # counts of row groups read and pruned, and of cache hits
+        self.partition_keys = []
+        self._files = {}
+        self._file_columns = {}
+        self._row_groups = []
+        self._sort_orders = {}
+        self._sort_ranks = {}
+        self._results = OrderedDict()
+        # building a sort index and the result cache are shared between threads, and
+        # each Parquet file is read by one thread at a time, queries otherwise run at once
+        self._index_lock = threading.RLock()
+        self._cache_lock = threading.Lock()
+        self._file_locks = {}
+        self._file_stats = []
+
+        self._scan()
+        self._signature = hashlib.sha1(json.dumps(self._file_stats).encode('utf-8')).hexdigest()
+        self._offsets = np.cumsum([0] + [row_group.num_rows for row_group in self._row_groups])
+        self.total_rows = int(self._offsets[-1])
+        self.num_row_groups = len(self._row_groups)
+
+        for column in self.columns:
+            if column not in self.partition_keys and \
+                    not any(column in names for names in self._file_columns.values()):
+                logging.warning('column %s is not in the dataset, it will be empty', column)
+
+    def _scan(self):
+        for directory, subdirectories, filenames in os.walk(self.dataset_root):
+            # skip the sort indexes and other hidden directories, in a fixed order
+            subdirectories[:] = sorted(d for d in subdirectories if d[0] not in '_.')
+
+            partition = {}
+            for part in pathlib.Path(directory).relative_to(self.dataset_root).parts:
+                key, value = part.split('=', 1)
+                partition[key] = None if value == HIVE_DEFAULT_PARTITION else value
+                if key not in self.partition_keys:
+                    self.partition_keys.append(key)
+
+            for filename in sorted(filenames):
+                if filename[0] in '_.' or not filename.endswith('.parquet'):
+                    continue
+                path = os.path.join(directory, filename)
+                parquet_file = pq.ParquetFile(path)
+                self._files[path] = parquet_file
+                self._file_locks[path] = threading.Lock()
+                stat = os.stat(path)
+                self._file_stats.append([os.path.relpath(path, self.dataset_root), stat.st_size, stat.st_mtime_ns,
+                                         parquet_file.metadata.num_rows])
+                self._file_columns[path] = set(parquet_file.schema_arrow.names)
+                for index in range(parquet_file.num_row_groups):
+                    num_rows = parquet_file.metadata.row_group(index).num_rows
+                    self._row_groups.append(RowGroup(path, index, num_rows, partition))
+
+    def _read_row_group(self, row_group, columns):
+        columns = [c for c in columns if c in self._file_columns[row_group.path]]
+        self.counters['row_groups_read'] += 1
+        with self._file_locks[row_group.path]:
+            return self._files[row_group.path].read_row_group(row_group.index, columns=columns)
+
+    def _dictionary_column(self, row_group, column, table):
+        # the distinct values of the column in the row group and the code of each row
+        if column in self.partition_keys:
+            value = row_group.partition.get(column)
+            if value is None:
+                return [], np.full(row_group.num_rows, -1, dtype=np.int64)
+            return [value], np.zeros(row_group.num_rows, dtype=np.int64)
+        elif table is not None and column in table.column_names:
+            return _dictionary_encode(table.column(column))
+        else:
+            return [], np.full(row_group.num_rows, -1, dtype=np.int64)
+
+    def _match(self, row_group, column, needle, table):
+        values, codes = self._dictionary_column(row_group, column, table)
+        # test each distinct value once, the extra False is for the nulls
+        hits = np.array([needle in _cell(v).lower() for v in values] + [False], dtype=bool)
+        return hits[codes]
+
+    def _filter(self, global_search, searchable, column_searches):
+        """Return the numbers of the rows matching the searches, in dataset order.
+        """
+        partition_searches = [(c, s) for c, s in column_searches if c in self.partition_keys]
+        read_columns = set(c for c, _ in column_searches if c not in self.partition_keys)
+        if global_search:
+            read_columns.update(c for c in searchable if c not in self.partition_keys)
+
+        matches = []
+        for row_group, offset in zip(self._row_groups, self._offsets):
+            # searches on the partition columns don't need the data
+            if any(needle not in _cell(row_group.partition.get(column)).lower()
+                   for column, needle in partition_searches):
+                self.counters['row_groups_pruned'] += 1
+                continue
+
+            table = self._read_row_group(row_group, read_columns) if read_columns else None
+            mask = np.ones(row_group.num_rows, dtype=bool)
+            for column, needle in column_searches:
+                mask &= self._match(row_group, column, needle, table)
+            if global_search and mask.any():
+                any_mask = np.zeros(row_group.num_rows, dtype=bool)
+                for column in searchable:
+                    any_mask |= self._match(row_group, column, global_search, table)
+                mask &= any_mask
+
+            matches.append(np.flatnonzero(mask) + offset)
+
+        if len(matches) == 0:
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate(matches)
+
+    def _sort_index_filename(self, column):
+        return self.index_directory / (column + '.npz')
+
+    def sort_rank(self, column):
+        """Return the rank of the value of the column in each row of the whole dataset, nulls first.
+
+        Equal values have equal ranks, so the ranks of several columns can be combined.
+        """
+        if column in self._sort_ranks:
+            return self._sort_ranks[column]
+        with self._index_lock:
+            if column not in self._sort_ranks:
+                self._sort_ranks[column] = self._load_or_build_sort_rank(column)
+            return self._sort_ranks[column]
+
+    def _load_or_build_sort_rank(self, column):
+        # use the saved ranks if they are for the same files, by name, size, modification time and rows
+        filename = self._sort_index_filename(column)
+        if filename.exists():
+            with np.load(filename) as saved:
+                if str(saved['signature']) == self._signature:
+                    return saved['rank']
+            logging.info('sort index for %s is out of date', column)
+
+        logging.info('building the sort index for %s', column)
+        codes = np.empty(self.total_rows, dtype=np.int64)
+        value_codes = {None: -1}
+        for row_group, offset in zip(self._row_groups, self._offsets):
+            table = self._read_row_group(row_group, [column])
+            values, row_group_codes = self._dictionary_column(row_group, column, table)
+            # map the codes of the row group onto codes for the whole dataset, the extra -1 is for the nulls
+            global_codes = np.array([value_codes.setdefault(v, len(value_codes) - 1) for v in values] + [-1],
+                                    dtype=np.int64)
+            codes[offset:offset + row_group.num_rows] = global_codes[row_group_codes]
+
+        # rank the distinct values, then give each row the rank of its value
+        value_ranks = np.empty(len(value_codes), dtype=np.int64)
+        sorted_values = sorted(value_codes, key=lambda v: (v is not None, v))
+        value_ranks[[value_codes[v] + 1 for v in sorted_values]] = np.arange(len(sorted_values))
+        rank = value_ranks[codes + 1]
+        if len(value_codes) < 2 ** 31:
+            rank = rank.astype(np.int32)
+
+        os.makedirs(self.index_directory, exist_ok=True)
+        np.savez(filename, rank=rank, signature=np.array(self._signature))
+        return rank
+
+    def sort_order(self, column):
+        """Return the row numbers of the whole dataset in the sorted order of the column.
+        """
+        if column not in self._sort_orders:
+            rank = self.sort_rank(column)
+            with self._index_lock:
+                if column not in self._sort_orders:
+                    self._sort_orders[column] = np.argsort(rank, kind='stable')
+        return self._sort_orders[column]
+
+    def _cached(self, key, compute):
+        with self._cache_lock:
+            if key in self._results:
+                self.counters['cache_hits'] += 1
+                self._results.move_to_end(key)
+                return self._results[key]
+        # two threads may compute the same result, the cache isn't held while they do
+        result = compute()
+        with self._cache_lock:
+            self._results[key] = result
+            if len(self._results) > self.cache_size:
+                self._results.popitem(last=False)
+        return result
+
+    def _ordered(self, global_search, searchable, column_searches, order):
+        """Return the numbers of the matching rows in order, a range when it is all rows in dataset order.
+        """
+        filtered = global_search or column_searches
+        if filtered:
+            rows = self._cached(('filter', global_search, searchable, column_searches),
+                                lambda: self._filter(global_search, searchable, column_searches))
+        else:
+            rows = range(self.total_rows)
+
+        if len(order) == 0:
+            return rows
+        elif len(order) == 1 and not filtered:
+            column, descending = order[0]
+            sort_order = self.sort_order(column)
+            return sort_order[::-1] if descending else sort_order
+
+        def compute():
+            row_array = np.asarray(rows, dtype=np.int64)
+            # lexsort uses the last key as the primary one
+            keys = []
+            for column, descending in reversed(order):
+                rank = self.sort_rank(column)[row_array].astype(np.int64)
+                keys.append(-rank if descending else rank)
+            return row_array[np.lexsort(keys)]
+
+        return self._cached(('order', global_search, searchable, column_searches, order), compute)
+
+    def read_rows(self, row_numbers):
+        """Return the rows, as lists of strings, reading only the row groups they are in.
+        """
+        row_numbers = np.asarray(row_numbers, dtype=np.int64)
+        row_group_numbers = np.searchsorted(self._offsets, row_numbers, side='right') - 1
+        rows = [None] * len(row_numbers)
+        for row_group_number in np.unique(row_group_numbers):
+            row_group = self._row_groups[row_group_number]
+            positions = np.flatnonzero(row_group_numbers == row_group_number)
+            local_rows = row_numbers[positions] - self._offsets[row_group_number]
+
+            table = self._read_row_group(row_group, [c for c in self.columns if c not in self.partition_keys])
+            cells = []
+            for column in self.columns:
+                if column in self.partition_keys:
+                    cells.append([_cell(row_group.partition.get(column))] * len(positions))
+                elif column in table.column_names:
+                    cells.append([_cell(v) for v in table.column(column).take(local_rows).to_pylist()])
+                else:
+                    cells.append([''] * len(positions))
+
+            for position, row in zip(positions, zip(*cells)):
+                rows[position] = list(row)
+        return rows
+
+    def build_sort_indexes(self):
+        for column in self.columns:
+            self.sort_rank(column)
+
+    def query(self, parameters):
+        """Answer a DataTables server-side processing request, given its parameters as a dict of strings.
+        """
+        draw   = int(parameters.get('draw', 0))
+        start  = max(int(parameters.get('start', 0)), 0)
+        length = int(parameters.get('length', 10))
+
+        global_search = parameters.get('search[value]', '').strip().lower()
+        searchable = []
+        column_searches = []
+        for number, column in enumerate(self.columns):
+            if parameters.get('columns[%d][searchable]' % number, 'true') != 'true':
+                continue
+            searchable.append(column)
+            column_search = parameters.get('columns[%d][search][value]' % number, '').strip().lower()
+            if column_search:
+                column_searches.append((column, column_search))
+
+        order = []
+        number = 0
+        while 'order[%d][column]' % number in parameters:
+            column_number = int(parameters['order[%d][column]' % number])
+            if 0 <= column_number < len(self.columns) and \
+                    parameters.get('columns[%d][orderable]' % column_number, 'true') == 'true':
+                order.append((self.columns[column_number],
+                              parameters.get('order[%d][dir]' % number, 'asc') == 'desc'))
+            number += 1
+
+        rows = self._ordered(global_search, tuple(searchable), tuple(column_searches), tuple(order))
+        page = rows[start:] if length < 0 else rows[start:start + length]
+        data = self.read_rows(page)
+
+        return {'draw': draw,
+                'recordsTotal': self.total_rows,
+                'recordsFiltered': len(rows),
+                'data': data}
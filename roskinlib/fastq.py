@@ -0,0 +1,254 @@
+"""Read four line FASTQ files in large binary chunks.
+
+A FastqBatch keeps the bytes of many records and NumPy arrays of where the
+title, sequence and quality of each one start and stop, so records are only
+turned into strings when asked for, and a whole batch can be written out
+again without being taken apart.
+"""
+import io
+
+import numpy as np
+
+_newline = ord('\n')
+_carriage_return = ord('\r')
+_space = ord(' ')
+
+def _binary(handle):
+    # the binary handle under a text one, e.g. from open_compressed(filename, 'rt')
+    if isinstance(handle, io.TextIOBase):
+        return handle.buffer
+    return handle
+
+class FastqBatch:
+    """Some consecutive FASTQ records, stored as their bytes and the offsets of their parts.
+
+    The title_start/stop, seq_start/stop and qual_start/stop arrays are
+    offsets into data, the title doesn't include the @. array is a NumPy view
+    of data.
+    """
+    def __init__(self, data, newlines):
+        self.data = data
+        self.array = np.frombuffer(data, dtype=np.uint8)
+        line_ends = newlines.reshape(-1, 4)
+        line_starts = np.empty_like(line_ends)
+        line_starts[:, 0] = np.concatenate([[0], line_ends[:-1, 3] + 1])
+        line_starts[:, 1:] = line_ends[:, :-1] + 1
+        # drop the \r of \r\n line ends
+        line_stops = line_ends - (self.array[np.maximum(line_ends - 1, 0)] == _carriage_return)
+
+        if not (np.all(self.array[line_starts[:, 0]] == ord('@')) and np.all(self.array[line_starts[:, 2]] == ord('+'))):
+            raise ValueError('not a four line FASTQ file')
+        self.title_start = line_starts[:, 0] + 1
+        self.title_stop = line_stops[:, 0]
+        self.seq_start = line_starts[:, 1]
+        self.seq_stop = line_stops[:, 1]
+        self.qual_start = line_starts[:, 3]
+        self.qual_stop = line_stops[:, 3]
+        if not np.array_equal(self.seq_stop - self.seq_start, self.qual_stop - self.qual_start):
+            raise ValueError('FASTQ sequence and quality lengths differ')
+        self._plus_lengths = line_stops[:, 2] - line_starts[:, 2]
+
+    def __len__(self):
+        return len(self.title_start)
+
+    def id_stops(self):
+        """Return where the id of each record, the title up to the first space, stops.
+        """
+        spaces = np.flatnonzero(self.array == _space)
+        if len(spaces) == 0:
+            return self.title_stop
+        first = np.searchsorted(spaces, self.title_start)
+        first_space = spaces[np.minimum(first, len(spaces) - 1)]
+        return np.where((first < len(spaces)) & (first_space < self.title_stop), first_space, self.title_stop)
+
+    def ids(self):
+        """Return the ids of the records as a list of bytes.
+        """
+        data = self.data
+        return [data[start:stop] for start, stop in zip(self.title_start.tolist(), self.id_stops().tolist())]
+
+    def titles(self):
+        data = self.data
+        return [data[start:stop].decode('ascii') for start, stop in zip(self.title_start.tolist(), self.title_stop.tolist())]
+
+    def sequences(self):
+        data = self.data
+        return [data[start:stop].decode('ascii') for start, stop in zip(self.seq_start.tolist(), self.seq_stop.tolist())]
+
+    def qualities(self):
+        data = self.data
+        return [data[start:stop].decode('ascii') for start, stop in zip(self.qual_start.tolist(), self.qual_stop.tolist())]
+
+    def records(self):
+        """Return the (title, sequence, quality) of each record as strings, like FastqGeneralIterator.
+        """
+        return zip(self.titles(), self.sequences(), self.qualities())
+
+    def to_bytes(self):
+        """Return the records as FASTQ, with bare + lines and \\n line ends.
+
+        This is the bytes read unless they need to be cleaned up.
+        """
+        if np.all(self._plus_lengths == 1) and not np.any(self.array == _carriage_return):
+            return self.data
+        return b''.join(b'@%s\n%s\n+\n%s\n' % (self.data[title_start:title_stop],
+                                               self.data[seq_start:seq_stop],
+                                               self.data[qual_start:qual_stop])
+                        for title_start, title_stop, seq_start, seq_stop, qual_start, qual_stop in
+                        zip(self.title_start.tolist(), self.title_stop.tolist(), self.seq_start.tolist(),
+                            self.seq_stop.tolist(), self.qual_start.tolist(), self.qual_stop.tolist()))
+
+def read_fastq_batches(handle, batch_size=10000, chunk_size=1 << 22, length=None):
+    """Yield FastqBatch objects of batch_size records, the last one can be smaller.
+
+    The handle is read chunk_size bytes at a time, and only length bytes of it
+    if that is given. Text handles are read through their binary buffer.
+    """
+    handle = _binary(handle)
+    buffer = bytearray()
+    newlines = np.empty(0, dtype=np.int64)
+    at_end = False
+    while True:
+        while len(newlines) < 4 * batch_size and not at_end:
+            if length is not None:
+                chunk = handle.read(min(chunk_size, length))
+                length -= len(chunk)
+            else:
+                chunk = handle.read(chunk_size)
+            if not chunk:
+                at_end = True
+                if buffer and buffer[-1] != _newline:
+                    buffer.append(_newline)
+                    newlines = np.append(newlines, len(buffer) - 1)
+                break
+            newlines = np.concatenate([newlines, np.flatnonzero(np.frombuffer(chunk, dtype=np.uint8) == _newline) + len(buffer)])
+            buffer += chunk
+
+        record_count = min(batch_size, len(newlines) // 4)
+        if record_count == 0:
+            if buffer.strip():
+                raise ValueError('truncated FASTQ record at the end of the file')
+            return
+        end = int(newlines[4 * record_count - 1]) + 1
+        yield FastqBatch(bytes(buffer[:end]), newlines[:4 * record_count])
+        del buffer[:end]
+        newlines = newlines[4 * record_count:] - end
+
+def read_fastq(handle, **options):
+    """Yield the (title, sequence, quality) of each record as strings, a drop in for FastqGeneralIterator.
+    """
+    for batch in read_fastq_batches(handle, **options):
+        yield from batch.records()
+
+def _check_pairs(r1_batch, r2_batch):
+    if r1_batch is None or r2_batch is None or len(r1_batch) != len(r2_batch):
+        raise ValueError('the read files have different numbers of reads')
+    r1_ids = r1_batch.ids()
+    r2_ids = r2_batch.ids()
+    if r1_ids != r2_ids:
+        r1_id, r2_id = next((r1, r2) for r1, r2 in zip(r1_ids, r2_ids) if r1 != r2)
+        raise ValueError('read ids do not match %s != %s' % (r1_id.decode('ascii'), r2_id.decode('ascii')))
+
+def read_paired_fastq_batches(r1_handle, r2_handle, batch_size=10000, r1_length=None, r2_length=None, **options):
+    """Yield (R1 batch, R2 batch) pairs of FastqBatch objects, checking the ids of the reads match.
+
+    A ValueError is raised if an id, the title up to the first space,
+    doesn't match or one file has more reads than the other. The lengths
+    limit how much of each file is read.
+    """
+    r1_batches = read_fastq_batches(r1_handle, batch_size, length=r1_length, **options)
+    r2_batches = read_fastq_batches(r2_handle, batch_size, length=r2_length, **options)
+    for r1_batch in r1_batches:
+        r2_batch = next(r2_batches, None)
+        _check_pairs(r1_batch, r2_batch)
+        yield r1_batch, r2_batch
+    if next(r2_batches, None) is not None:
+        raise ValueError('the read files have different numbers of reads')
+
+def read_paired_fastq(r1_handle, r2_handle, **options):
+    """Yield the R1 and R2 (title, sequence, quality) string tuples of each read pair, checking the ids match.
+    """
+    for r1_batch, r2_batch in read_paired_fastq_batches(r1_handle, r2_handle, **options):
+        yield from zip(r1_batch.records(), r2_batch.records())
+
+def _is_record_start(data, position, at_end=False):
+    # True if a FASTQ record starts at position in data, checked from the line structure, as a quality line can start with @ too
+    lines = data[position:position + (1 << 16)].split(b'\n', 4)
+    if len(lines) < 5 and not (at_end and len(lines) >= 4):
+        return False
+    return lines[0].startswith(b'@') and lines[2].startswith(b'+') and \
+           len(lines[1].rstrip(b'\r')) == len(lines[3].rstrip(b'\r'))
+
+def next_record_start(handle, offset, window=1 << 16):
+    """Return the offset of the first FASTQ record starting at or after offset in a seekable binary handle.
+
+    The end of the file is returned if there is none.
+    """
+    if offset <= 0:
+        return 0
+    while True:
+        handle.seek(offset - 1)
+        data = handle.read(window)
+        at_end = len(data) < window
+        position = data.find(b'\n@')
+        while position >= 0:
+            if _is_record_start(data, position + 1, at_end):
+                return offset + position
+            position = data.find(b'\n@', position + 1)
+        if at_end:
+            return offset - 1 + len(data)
+        window *= 2
+
+def find_record(handle, record_id, near, window=1 << 20):
+    """Return the offset of the FASTQ record with the given id, as bytes, in a seekable binary handle.
+
+    The search starts around near and widens until the record is found, so
+    the R2 read of an R1 read can be found quickly when the files are split
+    at about the same place. A ValueError is raised if it isn't there.
+    """
+    handle.seek(0, io.SEEK_END)
+    size = handle.tell()
+    title = b'\n@' + record_id
+    while True:
+        start = max(near - window, 0)
+        handle.seek(start)
+        # a record at the start of the file has no line end before it
+        prefix = b'\n' if start == 0 else b''
+        data = prefix + handle.read(2 * window)
+        at_end = start + len(data) - len(prefix) >= size
+        position = data.find(title)
+        while position >= 0:
+            title_end = position + len(title)
+            if data[title_end:title_end + 1] in (b' ', b'\n', b'\r') and _is_record_start(data, position + 1, at_end):
+                return start - len(prefix) + position + 1
+            position = data.find(title, position + 1)
+        if start == 0 and at_end:
+            raise ValueError('read %s not found' % record_id.decode('ascii'))
+        window *= 4
+
+def _file_size(handle):
+    handle.seek(0, io.SEEK_END)
+    return handle.tell()
+
+def split_paired_ranges(r1_handle, r2_handle, parts):
+    """Split a pair of uncompressed FASTQ files into byte ranges that hold the same read pairs.
+
+    Returns a (r1_start, r1_stop, r2_start, r2_stop) tuple for each of the
+    parts, the R1 file is split into about equal parts at record starts and
+    the R2 file where the same reads start.
+    """
+    r1_size = _file_size(r1_handle)
+    r2_size = _file_size(r2_handle)
+    starts = [(0, 0)]
+    for part in range(1, parts):
+        r1_start = max(next_record_start(r1_handle, part * r1_size // parts), starts[-1][0])
+        if r1_start >= r1_size:
+            r2_start = r2_size
+        else:
+            r1_handle.seek(r1_start)
+            record_id = r1_handle.readline()[1:].rstrip(b'\r\n').split(b' ')[0]
+            r2_start = find_record(r2_handle, record_id, r1_start * r2_size // max(r1_size, 1))
+        starts.append((r1_start, r2_start))
+    starts.append((r1_size, r2_size))
+    return [(r1_start, r1_stop, r2_start, r2_stop)
+            for (r1_start, r2_start), (r1_stop, r2_stop) in zip(starts[:-1], starts[1:])]
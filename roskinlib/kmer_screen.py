@@ -0,0 +1,89 @@
+import numpy as np
+
+from Bio import SeqIO
+
+from .record_batches import concatenate, segment_sums
+
+# the 2-bit code of each base, 4 for anything that isn't a base
+_base_codes = np.full(256, 4, dtype=np.uint64)
+for _code, _bases in enumerate(['Aa', 'Cc', 'Gg', 'Tt']):
+    for _base in _bases:
+        _base_codes[ord(_base)] = _code
+
+def _reverse_complement(sequence):
+    return sequence[::-1].translate(str.maketrans('ACGTacgt', 'TGCAtgca'))
+
+def kmer_codes(sequences, k):
+    """Return the 2-bit code and start of every k-mer of the sequences without an ambiguous base.
+
+    The starts are offsets into the concatenated sequences. The k-mers never
+    span two sequences.
+    """
+    assert 0 < k <= 31, 'the k-mer size must be between 1 and 31'
+    if len(sequences) == 0:
+        return np.empty(0, dtype=np.uint64), np.empty(0, dtype=np.int64)
+    data, ends = concatenate(sequences)
+    bases = _base_codes[data]
+    window_count = max(len(data) - k + 1, 0)
+    if window_count == 0:
+        return np.empty(0, dtype=np.uint64), np.empty(0, dtype=np.int64)
+
+    codes = np.zeros(window_count, dtype=np.uint64)
+    for offset in range(k):
+        codes = (codes << np.uint64(2)) | (bases[offset:offset + window_count] & np.uint64(3))
+
+    # a window is kept if it ends within its sequence and has no ambiguous bases
+    lengths = np.diff(np.concatenate([[0], ends]))
+    sequence_ends = np.repeat(ends, lengths)[:window_count]
+    ambiguous = np.concatenate([[0], np.cumsum(bases == 4)])
+    starts = np.arange(window_count)
+    keep = (starts + k <= sequence_ends) & (ambiguous[starts + k] == ambiguous[starts])
+    return codes[keep], starts[keep]
+
+class KmerIndex:
+    """The k-mers of both strands of a small reference, for screening reads against it.
+
+    A read is scored like a local alignment to the reference: the bases
+    covered by k-mers shared with the reference are matches and each
+    uncovered stretch between two covered ones is taken to be a mismatch. So
+    a read that matches the reference except for a few scattered mismatches
+    gets about the score bwa mem gives it with its default scoring, and
+    scores below min_score are reported as 0, like an unaligned read.
+    """
+    def __init__(self, sequences, k=19, mismatch_penalty=4, min_score=30):
+        self.k = k
+        self.mismatch_penalty = mismatch_penalty
+        self.min_score = min_score
+        both_strands = list(sequences) + [_reverse_complement(s) for s in sequences]
+        self.codes = np.unique(kmer_codes(both_strands, k)[0])
+
+    @classmethod
+    def from_fasta(cls, filename, **options):
+        with open(filename, 'rt') as fasta_handle:
+            sequences = [str(record.seq) for record in SeqIO.parse(fasta_handle, 'fasta')]
+        return cls(sequences, **options)
+
+    def scores(self, sequences):
+        """Return the score of each sequence as an array.
+        """
+        if len(sequences) == 0:
+            return np.empty(0, dtype=np.int64)
+        codes, starts = kmer_codes(sequences, self.k)
+        hits = starts[np.isin(codes, self.codes)]
+
+        # mark the bases covered by the k-mers found in the reference
+        ends = np.cumsum([len(s) for s in sequences], dtype=np.int64)
+        total_length = int(ends[-1])
+        depth = np.bincount(hits, minlength=total_length + 1) - np.bincount(hits + self.k, minlength=total_length + 1)
+        covered = np.cumsum(depth)[:total_length] > 0
+
+        # the covered stretches of each sequence
+        sequence_start = np.zeros(total_length, dtype=bool)
+        sequence_start[np.concatenate([[0], ends[:-1]])[np.diff(np.concatenate([[0], ends])) > 0]] = True
+        stretch_start = covered & (sequence_start | ~np.concatenate([[False], covered[:-1]]))
+
+        covered_counts = segment_sums(covered, ends)
+        stretch_counts = segment_sums(stretch_start, ends)
+        scores = covered_counts - self.mismatch_penalty * np.maximum(stretch_counts - 1, 0)
+        scores[scores < self.min_score] = 0
+        return scores
@@ -0,0 +1,100 @@
+import sys
+import csv
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+_gap = ord('-')
+_match = ord('.')
+_mismatch_bases = np.frombuffer(b'ACGTN', dtype=np.uint8)
+
+def concatenate(strings):
+    """Return the strings as one array of bytes and the offset of the end of each.
+    """
+    data = np.frombuffer(''.join(strings).encode('ascii'), dtype=np.uint8)
+    ends = np.cumsum([len(s) for s in strings], dtype=np.int64)
+    return data, ends
+
+def segment_sums(mask, ends):
+    """Return the number of true values of the mask in each segment given by its end, empty segments included.
+    """
+    totals = np.concatenate([[0], np.cumsum(mask, dtype=np.int64)])
+    starts = np.concatenate([[0], ends[:-1]])
+    return totals[ends] - totals[starts]
+
+def ungapped_lengths(alignments):
+    """Return the number of non-gap characters in each alignment string.
+    """
+    if len(alignments) == 0:
+        return np.empty(0, dtype=np.int64)
+    data, ends = concatenate(alignments)
+    return segment_sums(data != _gap, ends)
+
+def mismatch_counts(query_alignments, v_alignments):
+    """Count the mismatched and matched bases of each pair of lined up query and V-segment alignments.
+
+    Positions that are gaps in the query are skipped, a . in the V-segment is
+    a match and a base is a mismatch, like roskinlib.seq_rec.v_mutation_counts.
+    """
+    if len(query_alignments) == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    query_data, ends = concatenate(query_alignments)
+    v_data, v_ends = concatenate(v_alignments)
+    assert np.array_equal(ends, v_ends), 'the query and V-segment alignments must have the same lengths'
+
+    not_gap = query_data != _gap
+    diff_counts = segment_sums(not_gap & np.isin(v_data, _mismatch_bases), ends)
+    same_counts = segment_sums(not_gap & (v_data == _match), ends)
+    return diff_counts, same_counts
+
+class RecordBatchWriter:
+    """Write Arrow record batches with a fixed schema to a Parquet or CSV file, - for stdout.
+    """
+    def __init__(self, filename, schema, output_format='parquet'):
+        assert output_format in ('parquet', 'csv'), 'the output format must be parquet or csv'
+        self.schema = schema
+        self.output_format = output_format
+        self.row_count = 0
+        if filename == '-':
+            self.handle = sys.stdout.buffer if output_format == 'parquet' else sys.stdout
+            self._close_handle = False
+        else:
+            self.handle = open(filename, 'wb' if output_format == 'parquet' else 'wt', newline=None if output_format == 'parquet' else '')
+            self._close_handle = True
+        if output_format == 'parquet':
+            self._parquet_writer = pq.ParquetWriter(self.handle, schema, compression='gzip')
+        else:
+            self._csv_writer = csv.writer(self.handle)
+            self._csv_writer.writerow(schema.names)
+
+    def write_columns(self, columns):
+        arrays = [c.cast(f.type) if isinstance(c, pa.Array) else pa.array(c, type=f.type)
+                  for c, f in zip(columns, self.schema)]
+        batch = pa.RecordBatch.from_arrays(arrays, schema=self.schema)
+        if self.output_format == 'parquet':
+            self._parquet_writer.write_table(pa.Table.from_batches([batch]))
+        else:
+            self._csv_writer.writerows(zip(*[c.to_pylist() for c in batch.columns]))
+        self.row_count += batch.num_rows
+
+    def close(self):
+        if self.output_format == 'parquet':
+            self._parquet_writer.close()
+        if self._close_handle:
+            self.handle.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+def write_histogram(filename, columns, counts):
+    """Write a histogram, given as a Counter of key tuples, as a CSV file sorted by key.
+    """
+    with open(filename, 'wt', newline='') as histogram_handle:
+        writer = csv.writer(histogram_handle)
+        writer.writerow(columns + ['count'])
+        for key in sorted(counts, key=lambda k: tuple((v is None, v if v is not None else 0) for v in k)):
+            writer.writerow(list(key) + [counts[key]])
@@ -0,0 +1,309 @@
+import io
+import os
+import json
+import logging
+import pathlib
+from bisect import bisect_right
+from collections import defaultdict
+from itertools import islice
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+import fastavro
+from fastavro.write import Writer
+from Bio.Seq import Seq
+
+from .seq_rec import best_vdj_score, get_query_region, remove_allele
+
+# the name of the directory, in the dataset root, holding the secondary index
+RECORD_INDEX_DIRNAME = '_record_index'
+# the rows of a postings file read at a time, a lookup only reads the row groups that can hold its value
+POSTINGS_ROW_GROUP_SIZE = 1 << 16
+# the keys every record is indexed by, the lineages are added as lineage_<label>
+INDEX_KEYS = ['subject', 'v_gene', 'j_gene', 'cdr3_aa', 'cdr3_nt']
+# the suffix of the sidecar file with the first and last record name of each block of a sorted file
+NAME_INDEX_SUFFIX = '.names'
+
+def _read_long(handle):
+    # an Avro zigzag varint
+    shift = 0
+    value = 0
+    while True:
+        byte = handle.read(1)
+        if not byte:
+            raise ValueError('truncated Avro block')
+        value |= (byte[0] & 0x7f) << shift
+        if byte[0] < 0x80:
+            return (value >> 1) ^ -(value & 1)
+        shift += 7
+
+class AvroBlockFile:
+    """An Avro file whose blocks can be read in any order given their offsets.
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self.handle = open(filename, 'rb')
+        block_reader = fastavro.block_reader(self.handle)
+        self.writer_schema = block_reader.writer_schema
+        self.metadata = block_reader.metadata
+        # the header, everything before the first block, is put in front of a block to decode it
+        first_block = next(iter(block_reader), None)
+        header_size = first_block.offset if first_block is not None else os.path.getsize(filename)
+        self.handle.seek(0)
+        self._header = self.handle.read(header_size)
+
+    def blocks(self):
+        # read from the start with its own reader, so it doesn't disturb read_block
+        with open(self.filename, 'rb') as handle:
+            for block in fastavro.block_reader(handle):
+                yield block.offset, block
+
+    def read_block(self, offset):
+        """Return the records of the block starting at offset.
+        """
+        # the block is its record count, its size, the data and the sync marker
+        self.handle.seek(offset)
+        _read_long(self.handle)
+        size = _read_long(self.handle)
+        block_size = self.handle.tell() - offset + size + 16
+        self.handle.seek(offset)
+        block = self.handle.read(block_size)
+        return list(fastavro.reader(io.BytesIO(self._header + block)))
+
+    def close(self):
+        self.handle.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+def sorted_record_filenames(dataset_root):
+    # the files written by sort_seq_records.py
+    return sorted(pathlib.Path(dataset_root).glob('subject=*/source=*.avro'))
+
+def record_keys(record, parse_label):
+    """Return the index keys of a sequence record and their values, missing values are left out.
+    """
+    parse = record['parses'].get(parse_label)
+    best_v, _, _, _, best_j, _ = best_vdj_score(parse)
+    cdr3_nt = get_query_region(parse, 'CDR3')
+
+    keys = {'subject': record['subject'],
+            'v_gene':  None if best_v is None else remove_allele(best_v),
+            'j_gene':  None if best_j is None else remove_allele(best_j),
+            'cdr3_nt': cdr3_nt,
+            'cdr3_aa': None if cdr3_nt is None else str(Seq(cdr3_nt).translate())}
+    for label, lineage in record['lineages'].items():
+        keys['lineage_' + label] = lineage
+
+    return {key: value for key, value in keys.items() if value is not None}
+
+class RecordIndex:
+    """Postings of the blocks of a sorted sequence record dataset by subject, V/J gene, CDR3 and lineage.
+
+    Each file of the dataset is listed with the offsets of its Avro blocks.
+    For each key and value the index has the blocks, as (file number, block
+    number), holding at least one record with that value. A lookup decodes only
+    the blocks on the postings of every criterion and returns the records in
+    them that match.
+
+    The postings of each key are a Parquet file of (value, file, block) rows
+    sorted by value, so a lookup reads only the row groups whose value range
+    holds the value it wants, never the whole index.
+    """
+    def __init__(self, dataset_root, parse_label, files, index_keys, postings=None):
+        self.dataset_root = pathlib.Path(dataset_root)
+        self.parse_label = parse_label
+        self.files = files              # dicts with the relative path, size and block offsets of each file
+        self.index_keys = index_keys    # the keys with postings
+        self._postings = postings       # key -> postings table, when built in memory
+
+    @classmethod
+    def build(cls, dataset_root, parse_label):
+        files = []
+        postings = defaultdict(lambda: defaultdict(set))
+        for file_number, filename in enumerate(sorted_record_filenames(dataset_root)):
+            logging.info('indexing %s', filename)
+            offsets = []
+            with AvroBlockFile(filename) as block_file:
+                for block_number, (offset, block) in enumerate(block_file.blocks()):
+                    offsets.append(offset)
+                    for record in block:
+                        for key, value in record_keys(record, parse_label).items():
+                            postings[key][value].add((file_number, block_number))
+            files.append({'path': str(filename.relative_to(dataset_root)),
+                          'size': os.path.getsize(filename),
+                          'offsets': offsets})
+
+        tables = {}
+        for key, key_postings in postings.items():
+            rows = sorted((str(value), file_number, block_number)
+                          for value, blocks in key_postings.items() for file_number, block_number in blocks)
+            values, file_numbers, block_numbers = zip(*rows)
+            tables[key] = pa.table({'value': pa.array(values, type=pa.string()),
+                                    'file':  pa.array(file_numbers, type=pa.int32()),
+                                    'block': pa.array(block_numbers, type=pa.int32())})
+        return cls(dataset_root, parse_label, files, sorted(tables), tables)
+
+    @classmethod
+    def load(cls, dataset_root):
+        with open(os.path.join(dataset_root, RECORD_INDEX_DIRNAME, 'index.json'), 'rt') as index_handle:
+            index = json.load(index_handle)
+        return cls(dataset_root, index['parse_label'], index['files'], index['keys'])
+
+    def _index_directory(self):
+        return self.dataset_root / RECORD_INDEX_DIRNAME
+
+    def _postings_filename(self, key):
+        return self._index_directory() / (key + '.parquet')
+
+    def save(self):
+        assert self._postings is not None, 'only a built index can be saved'
+        os.makedirs(self._index_directory(), exist_ok=True)
+        for key, table in self._postings.items():
+            pq.write_table(table, self._postings_filename(key), row_group_size=POSTINGS_ROW_GROUP_SIZE)
+        with open(self._index_directory() / 'index.json', 'wt') as index_handle:
+            json.dump({'parse_label': self.parse_label, 'files': self.files, 'keys': self.index_keys}, index_handle)
+
+    def _read_postings(self, key, columns, value=None):
+        # the postings of a key, or just of one value of it
+        if key not in self.index_keys:
+            return pa.table({c: pa.array([], type=pa.string() if c == 'value' else pa.int32()) for c in columns})
+        if self._postings is not None:
+            table = self._postings[key]
+            if value is not None:
+                table = table.filter(pc.equal(table.column('value'), value))
+            return table.select(columns)
+        filters = None if value is None else [('value', '==', value)]
+        return pq.read_table(self._postings_filename(key), columns=columns, filters=filters)
+
+    def keys(self):
+        return list(self.index_keys)
+
+    def values(self, key):
+        return sorted(pc.unique(self._read_postings(key, ['value']).column('value')).to_pylist())
+
+    def blocks(self, **criteria):
+        """Return the block numbers, by file number, that can hold records matching all the criteria.
+        """
+        assert len(criteria) > 0, 'at least one criterion is needed'
+
+        candidates = None
+        for key, value in criteria.items():
+            postings = self._read_postings(key, ['file', 'block'], str(value))
+            # one number for each (file, block) pair
+            pairs = postings.column('file').to_numpy().astype(np.int64) << 32 | postings.column('block').to_numpy()
+            candidates = pairs if candidates is None else np.intersect1d(candidates, pairs)
+        candidates = np.unique(candidates)
+
+        blocks = defaultdict(list)
+        for pair in candidates.tolist():
+            blocks[pair >> 32].append(pair & 0xffffffff)
+        return dict(blocks)
+
+    def lookup(self, **criteria):
+        """Yield the sequence records matching all the criteria, given as key=value.
+        """
+        for file_number, block_numbers in sorted(self.blocks(**criteria).items()):
+            file_entry = self.files[file_number]
+            filename = self.dataset_root / file_entry['path']
+            if os.path.getsize(filename) != file_entry['size']:
+                raise ValueError('%s has changed since it was indexed, rebuild the index' % filename)
+
+            with AvroBlockFile(filename) as block_file:
+                for block_number in block_numbers:
+                    for record in block_file.read_block(file_entry['offsets'][block_number]):
+                        keys = record_keys(record, self.parse_label)
+                        if all(keys.get(key) == value for key, value in criteria.items()):
+                            yield record
+
+def name_index_filename(filename):
+    return str(filename) + NAME_INDEX_SUFFIX
+
+def save_name_index(filename, blocks):
+    with open(name_index_filename(filename), 'wt') as index_handle:
+        for offset, first_name, last_name in blocks:
+            print(offset, first_name, last_name, sep='\t', file=index_handle)
+
+def write_name_sorted_records(filename, schema, records, codec='bzip2', metadata=None, block_records=1000):
+    """Write records, already sorted by name, to an Avro file along with its name index.
+
+    The blocks are cut every block_records records, so each lookup decodes at
+    most that many records.
+    """
+    blocks = []
+    with open(filename, 'wb') as output_handle:
+        # blocks are only written when flushed
+        writer = Writer(output_handle, schema, codec=codec, sync_interval=2 ** 62, metadata=metadata)
+        records = iter(records)
+        while True:
+            block = list(islice(records, block_records))
+            if len(block) == 0:
+                break
+            offset = output_handle.tell()
+            for record in block:
+                writer.write(record)
+            writer.flush()
+            blocks.append((offset, block[0]['name'], block[-1]['name']))
+    save_name_index(filename, blocks)
+
+def build_name_index(filename):
+    """Write the name index for an existing sorted file by reading it.
+    """
+    blocks = []
+    with AvroBlockFile(filename) as block_file:
+        for offset, block in block_file.blocks():
+            names = [record['name'] for record in block]
+            if len(names) > 0:
+                blocks.append((offset, names[0], names[-1]))
+    save_name_index(filename, blocks)
+
+class NameIndexedFile(AvroBlockFile):
+    """A name sorted sequence record file read by record name using its name index.
+
+    The block that can hold a name is found by a binary search on the first
+    names of the blocks and is the only one decoded.
+    """
+    def __init__(self, filename):
+        self.offsets = []
+        self.first_names = []
+        self.last_names = []
+        with open(name_index_filename(filename), 'rt') as index_handle:
+            for line in index_handle:
+                offset, first_name, last_name = line.rstrip('\n').split('\t')
+                self.offsets.append(int(offset))
+                self.first_names.append(first_name)
+                self.last_names.append(last_name)
+        super().__init__(filename)
+
+    def _block_number(self, name):
+        block_number = bisect_right(self.first_names, name) - 1
+        if block_number < 0 or name > self.last_names[block_number]:
+            return None
+        return block_number
+
+    def get(self, name):
+        """Return the record with the name, None if there isn't one.
+        """
+        return self.get_many([name]).get(name)
+
+    def get_many(self, names):
+        """Return the records with the names, as a dict by name, decoding each block needed once.
+        """
+        names_by_block = defaultdict(set)
+        for name in names:
+            block_number = self._block_number(name)
+            if block_number is not None:
+                names_by_block[block_number].add(name)
+
+        records = {}
+        for block_number in sorted(names_by_block):
+            block_names = names_by_block[block_number]
+            for record in self.read_block(self.offsets[block_number]):
+                if record['name'] in block_names:
+                    records[record['name']] = record
+        return records
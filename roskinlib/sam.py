@@ -0,0 +1,141 @@
+"""Read the alignment scores of SAM and BAM files without a SAM library.
+"""
+import io
+import gzip
+import struct
+
+_FLAG_UNMAPPED = 0x4
+
+_BAM_MAGIC = b'BAM\x01'
+# the fixed length part of a BAM alignment record after the block size
+_bam_record = struct.Struct('<iiBBHHHiiii')
+# the sizes of the BAM tag value types, Z, H and B tags have a variable size
+_bam_tag_sizes = {b'A': 1, b'c': 1, b'C': 1, b's': 2, b'S': 2, b'i': 4, b'I': 4, b'f': 4}
+_bam_integer_formats = {b'c': '<b', b'C': '<B', b's': '<h', b'S': '<H', b'i': '<i', b'I': '<I'}
+
+def _missing_score(name, flag):
+    # bwa mem gives unmapped reads an AS of 0, any other alignment needs one
+    if flag & _FLAG_UNMAPPED:
+        return 0
+    raise ValueError('no alignment score found for %s' % name)
+
+def _sam_chunk_scores(lines):
+    # the read names and scores of a list of SAM alignment lines, a list at a time is much
+    # faster than a line at a time, and the tags are at the end so the AS tag is searched from there
+    names = [line.split(b'\t', 1)[0].decode('ascii') for line in lines]
+    tag_starts = [line.rfind(b'\tAS:i:') for line in lines]
+    if -1 in tag_starts:
+        scores = [int(line[start + 6:].partition(b'\t')[0]) if start >= 0 else
+                  _missing_score(name, int(line.split(b'\t', 2)[1]))
+                  for name, line, start in zip(names, lines, tag_starts)]
+    else:
+        scores = [int(line[start + 6:].partition(b'\t')[0]) for line, start in zip(lines, tag_starts)]
+    return zip(names, scores)
+
+def sam_alignment_scores(handle, chunk_size=1 << 22):
+    """Yield the read name and AS tag of each alignment of a binary SAM file handle.
+
+    The file is read in large chunks that are split into lines at once, and
+    only the read name and the AS tag of each line are looked at. Unmapped
+    reads without an AS tag get a score of 0.
+    """
+    remainder = b''
+    while True:
+        chunk = handle.read(chunk_size)
+        if not chunk:
+            break
+        lines = (remainder + chunk).split(b'\n')
+        remainder = lines.pop()
+        while lines and lines[0].startswith(b'@'):     # skip the header lines
+            lines.pop(0)
+        yield from _sam_chunk_scores(lines)
+    if remainder and not remainder.startswith(b'@'):
+        yield from _sam_chunk_scores([remainder])
+
+def _bam_tag_score(tags):
+    # the value of the AS tag in the tags of a BAM record, or None
+    position = 0
+    while position < len(tags):
+        tag = tags[position:position + 2]
+        value_type = tags[position + 2:position + 3]
+        position += 3
+        if tag == b'AS' and value_type in _bam_integer_formats:
+            return struct.unpack_from(_bam_integer_formats[value_type], tags, position)[0]
+        if value_type in _bam_tag_sizes:
+            position += _bam_tag_sizes[value_type]
+        elif value_type in (b'Z', b'H'):
+            position = tags.index(b'\x00', position) + 1
+        elif value_type == b'B':
+            subtype = tags[position:position + 1]
+            count, = struct.unpack_from('<i', tags, position + 1)
+            position += 5 + count * _bam_tag_sizes[subtype]
+        else:
+            raise ValueError('unknown BAM tag type %r' % value_type)
+    return None
+
+def _read_exactly(handle, size):
+    data = handle.read(size)
+    if len(data) != size:
+        raise ValueError('truncated BAM file')
+    return data
+
+def bam_alignment_scores(handle):
+    """Yield the read name and AS tag of each alignment of an uncompressed BAM stream.
+
+    Decompress the BGZF blocks first, e.g. with gzip. Unmapped reads without
+    an AS tag get a score of 0.
+    """
+    if _read_exactly(handle, 4) != _BAM_MAGIC:
+        raise ValueError('not a BAM file')
+    header_length, = struct.unpack('<i', _read_exactly(handle, 4))
+    _read_exactly(handle, header_length)
+    reference_count, = struct.unpack('<i', _read_exactly(handle, 4))
+    for _ in range(reference_count):
+        name_length, = struct.unpack('<i', _read_exactly(handle, 4))
+        _read_exactly(handle, name_length + 4)
+
+    while True:
+        block_size = handle.read(4)
+        if not block_size:
+            break
+        if len(block_size) != 4:
+            raise ValueError('truncated BAM file')
+        block = _read_exactly(handle, struct.unpack('<i', block_size)[0])
+        _, _, name_length, _, _, cigar_count, flag, sequence_length, _, _, _ = _bam_record.unpack_from(block)
+        name = block[_bam_record.size:_bam_record.size + name_length - 1].decode('ascii')
+        tags_start = _bam_record.size + name_length + 4 * cigar_count + (sequence_length + 1) // 2 + sequence_length
+        score = _bam_tag_score(block[tags_start:])
+        yield name, score if score is not None else _missing_score(name, flag)
+
+def alignment_scores(handle):
+    """Yield the read name and AS tag of each alignment of a binary SAM or BAM file handle.
+
+    The format is found from the first bytes, handles that can't peek, like a
+    zstandard reader, are buffered first. BAM files are decompressed here.
+    """
+    if not hasattr(handle, 'peek'):
+        handle = io.BufferedReader(handle)
+    if handle.peek(2)[:2] == b'\x1f\x8b':
+        handle = gzip.GzipFile(fileobj=handle)
+    if handle.peek(4)[:4] == _BAM_MAGIC:
+        return bam_alignment_scores(handle)
+    return sam_alignment_scores(handle)
+
+def best_read_scores(scores):
+    """Reduce the scores of the alignments of each read to the best one.
+
+    The alignments of a read must be next to each other, as bwa mem writes
+    them. Each read is yielded once, after all its alignments are seen.
+    """
+    prev_name = None
+    best_score = None
+    for name, score in scores:
+        if name == prev_name:
+            if score > best_score:
+                best_score = score
+        else:
+            if prev_name is not None:
+                yield prev_name, best_score
+            prev_name, best_score = name, score
+    if prev_name is not None:
+        yield prev_name, best_score
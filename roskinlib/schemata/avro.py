@@ -1,3 +1,5 @@
+import copy
+
 SEQUENCE_RECORD={
     "namespace": "roskinlab",
     "name": "sequence_record",
@@ -180,3 +182,19 @@ for f in SEQUENCE_RECORD['fields']:
         PARSE = f['type']['values'][1]
 assert SEQUENCE['type'] == 'record' and SEQUENCE['name'] == 'sequence'
 assert PARSE['type'] == 'record' and PARSE['name'] == 'parse'
+
+# a reader schema that projects sequence records down to the fields that hold labels,
+# the parse records themselves are dropped to only their presence
+SEQUENCE_RECORD_LABELS = copy.deepcopy(SEQUENCE_RECORD)
+_label_fields = []
+for f in SEQUENCE_RECORD_LABELS['fields']:
+    if f['name'] == 'sequence':
+        f['type']['fields'] = [g for g in f['type']['fields'] if g['name'] == 'annotations']
+        _label_fields.append(f)
+    elif f['name'] == 'parses':
+        f['type']['values'][1]['fields'] = []
+        _label_fields.append(f)
+    elif f['name'] == 'lineages':
+        _label_fields.append(f)
+SEQUENCE_RECORD_LABELS['fields'] = _label_fields
+del _label_fields
@@ -1,3 +1,14 @@
+import json
+
+import fastavro
+
+from .schemata.avro import SEQUENCE_RECORD_LABELS
+
+# the Avro file metadata key listing the labels used by the records in the file
+LABELS_METADATA_KEY = 'roskinlab.labels'
+# the kinds of labels, the parse labels, lineage labels, and sequence annotation keys
+LABEL_KINDS = ['parses', 'lineages', 'annotations']
+
 def best_vdj_score(parse):
     best_v       = None
     best_v_score = None
@@ -28,6 +39,41 @@ def get_parse_query(parse):
         assert alignment['type'] == 'Q'
         return alignment['alignment']
 
+def best_alignment(parse, alignment_type):
+    if parse is not None:
+        for a in parse['alignments']:
+            if a['type'] == alignment_type:
+                return a
+    return None
+
+_mutation_count_bases = set(['A', 'C', 'G', 'T', 'N'])
+def v_mutation_counts(parse):
+    """Count the mismatched and matched bases between the query and the best V-segment.
+
+    Positions that are gaps in the query are skipped. Returns (None, None) if there is
+    no V-segment alignment.
+    """
+    best_v = best_alignment(parse, 'V')
+    if best_v is None:
+        return None, None
+
+    # line the V-segment up with the query using its padding
+    query = get_parse_query(parse)
+    v_start = best_v['padding']['start']
+    v_align = best_v['alignment']
+    q_align = query[v_start:v_start + len(v_align)]
+
+    diff_count = 0
+    same_count = 0
+    for q, v in zip(q_align, v_align):
+        if q != '-': # skip if gap
+            if v == '.':
+                same_count += 1
+            elif v in _mutation_count_bases:
+                diff_count += 1
+
+    return diff_count, same_count
+
 def make_slice(range_):
     return slice(range_['start'], range_['stop'])
 
@@ -45,3 +91,43 @@ def get_query_region(parse, region):
 
 def remove_allele(s):
     return s.split('*')[0]
+
+def make_labels(parses=(), lineages=(), annotations=()):
+    return {'parses': set(parses), 'lineages': set(lineages), 'annotations': set(annotations)}
+
+def merge_labels(*labels_list):
+    """Combine sets of labels, if any of them is unknown (None) the result is unknown.
+    """
+    merged = make_labels()
+    for labels in labels_list:
+        if labels is None:
+            return None
+        for kind in LABEL_KINDS:
+            merged[kind].update(labels.get(kind, ()))
+    return merged
+
+def read_labels(reader):
+    """Return the labels recorded in the metadata of an Avro file, or None if they weren't recorded.
+    """
+    value = reader.metadata.get(LABELS_METADATA_KEY)
+    if value is None:
+        return None
+    labels = json.loads(value)
+    return make_labels(**{kind: labels.get(kind, ()) for kind in LABEL_KINDS})
+
+def labels_metadata(labels):
+    """Avro file metadata recording the labels, None if the labels are unknown.
+    """
+    if labels is None:
+        return None
+    return {LABELS_METADATA_KEY: json.dumps({kind: sorted(labels[kind]) for kind in LABEL_KINDS})}
+
+def scan_labels(handle):
+    """Find the labels used in an Avro file by reading only the label fields of each record.
+    """
+    labels = make_labels()
+    for record in fastavro.reader(handle, reader_schema=SEQUENCE_RECORD_LABELS):
+        labels['parses'].update(record['parses'].keys())
+        labels['lineages'].update(record['lineages'].keys())
+        labels['annotations'].update(record['sequence']['annotations'].keys())
+    return labels
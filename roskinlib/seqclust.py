@@ -2,11 +2,14 @@
 """
 from __future__ import print_function
 
+import re
+import array
 import tempfile
 import shutil
 import os.path
 from io import StringIO
 
+import numpy as np
 from Bio import SeqIO
 
 class SeqCluster(object):
@@ -124,61 +127,229 @@ def ParseCDHITMember(line):
 
     return number, length, name, (rep_start, rep_stop), (member_start, member_stop), identity, strand
 
-def CDHITClustIterator(handle):
-    """Parse the outout of one of the CD-HIT programs.
-
-    Parsed the output of CD-HIT, CD-HIT-EST, or CD-HIT-454 and yeilds SeqCluster objects
-    for each cluster. The name of the cluster is given as "Cluster NNN" as given by CD-HIT.
+# a CD-HIT cluster header or member line, e.g.
+#   >Cluster 0
+#   0\t12aa, >seq1... *
+#   1\t12aa, >seq2... at 1:12:1:12/+/91.67%
+_re_cdhit_line = re.compile(r'^(?:>(?P<cluster>[^\n]*)|'
+                            r'\d+\t(?P<length>\d+)(?:aa|nt), >(?P<name>[^\n]*?)\.\.\. '
+                            r'(?:\*|at (?:(?P<overlap>\d+:\d+:\d+:\d+)/)?(?:(?P<strand>[+-])/)?(?P<identity>[0-9.]+)%))$',
+                            re.MULTILINE)
+
+class CDHITClusterTable(object):
+    """The members of CD-HIT clusters stored by column.
+
+    Each member line of a .clstr file is one row. The cluster column is the index into
+    cluster_names for the cluster the member belongs to. Representatives have an
+    identity of 100.0 and are flagged in the representative column. Missing overlaps
+    are stored as -1 and missing strands as None.
     """
+    def __init__(self):
+        self.cluster_names  = []
+        self.cluster        = array.array('l')
+        self.name           = []
+        self.length         = array.array('l')
+        self.identity       = array.array('d')
+        self.representative = array.array('b')
+        self.rep_start      = array.array('l')
+        self.rep_stop       = array.array('l')
+        self.member_start   = array.array('l')
+        self.member_stop    = array.array('l')
+        self.strand         = []
+
+    def __len__(self):
+        return len(self.name)
+
+    def cluster_number(self, index):
+        """Return the number CD-HIT gave a cluster, e.g. 12 for "Cluster 12".
+        """
+        return int(self.cluster_names[index].split(' ')[1])
+
+    def _add_chunk(self, chunk):
+        # local names for the columns, this is the hot loop
+        cluster_names  = self.cluster_names
+        cluster        = self.cluster.append
+        name           = self.name.append
+        length         = self.length.append
+        identity       = self.identity.append
+        representative = self.representative.append
+        rep_start      = self.rep_start.append
+        rep_stop       = self.rep_stop.append
+        member_start   = self.member_start.append
+        member_stop    = self.member_stop.append
+        strand         = self.strand.append
+
+        line_count = 0
+        for line_count, match in enumerate(_re_cdhit_line.finditer(chunk), 1):
+            cluster_name, member_length, member_name, overlap, member_strand, member_identity = match.groups()
+            if cluster_name is not None:
+                cluster_names.append(cluster_name.strip())
+                continue
+
+            assert len(cluster_names) > 0, 'CD-HIT member line found before the first cluster'
+            cluster(len(cluster_names) - 1)
+            name(member_name)
+            length(int(member_length))
+            if member_identity is None:
+                identity(100.0)
+                representative(True)
+            else:
+                identity(float(member_identity))
+                representative(False)
+            if overlap is None:
+                rep_start(-1)
+                rep_stop(-1)
+                member_start(-1)
+                member_stop(-1)
+            else:
+                r_start, r_stop, m_start, m_stop = overlap.split(':')
+                rep_start(int(r_start))
+                rep_stop(int(r_stop))
+                member_start(int(m_start))
+                member_stop(int(m_stop))
+            strand(member_strand)
+
+        # every line in the chunk must have been matched
+        if line_count != chunk.count('\n'):
+            raise ValueError('unable to parse CD-HIT cluster file, %d of %d lines matched' %
+                             (line_count, chunk.count('\n')))
+
+def ReadCDHITClusters(handle, chunk_size=1 << 20):
+    """Read the .clstr output of one of the CD-HIT programs into a CDHITClusterTable.
+
+    The file is read in chunks of chunk_size characters that are parsed with a single
+    regular expression. Anything before the first cluster (line starting with >) is
+    skipped.
+    """
+    table = CDHITClusterTable()
+
     # skip any header stuff, i.e. everything until we hit a >
-    line = handle.readline()
+    remainder = ''
     while True:
-        if line == "":
-            return  # premature end of file, or just empty?
-        elif line.startswith(">"):  # new clusters start with >
+        chunk = handle.read(chunk_size)
+        if not chunk:
+            return table    # premature end of file, or just empty?
+        remainder += chunk
+        if remainder.startswith('>'):
+            break
+        cluster_start = remainder.find('\n>')
+        if cluster_start >= 0:
+            remainder = remainder[cluster_start + 1:]
             break
+        remainder = remainder[remainder.rfind('\n') + 1:]
 
     while True:
-        # new clusters start with >
-        assert line[0] == ">", "CD-HIT output files should start with a '>' character"
-        cluster_name = line[1:].strip()
-        cluster_members = []
-
-        line = handle.readline()
-        while True:
-            if not line:    # end of file
-                break
-            elif line[0] == ">":    # start of a new cluster
-                break
-            
-            # parse the member line
-            number, length, name, rep_overlap, member_overlap, identity, strand = ParseCDHITMember(line)
-            new_member = SeqClusterMember(name)
-            # add the CD-HIT specific metadata, identity handled below
-            new_member.length = length
-            if rep_overlap:
-                assert member_overlap is not None
-                new_member.rep_overlap = rep_overlap
-                new_member.member_overlap = member_overlap
-            if strand:
-                new_member.strand = strand
-            # if this is the representative (indicated by percent identity being None), store it
-            if identity is None:
-                representative = new_member
-                new_member.identity = 100.0
-            else:
-                new_member.identity = identity
-
-            cluster_members.append(new_member)
+        chunk = handle.read(chunk_size)
+        if not chunk:
+            break
+        # only parse complete lines
+        remainder += chunk
+        last_newline = remainder.rfind('\n')
+        if last_newline >= 0:
+            table._add_chunk(remainder[:last_newline + 1])
+            remainder = remainder[last_newline + 1:]
 
-            line = handle.readline()    # get the next line
+    # handle a final line without a trailing newline
+    if remainder:
+        if not remainder.endswith('\n'):
+            remainder += '\n'
+        table._add_chunk(remainder)
 
-        yield SeqCluster(cluster_name, representative, cluster_members)
+    return table
 
-        if not line:    # end of file
-            return  # StopIteration
+def CDHITClustIterator(handle):
+    """Parse the outout of one of the CD-HIT programs.
 
-    assert False, "I found a counter-example to the Riemann hypothesis!"
+    Parsed the output of CD-HIT, CD-HIT-EST, or CD-HIT-454 and yeilds SeqCluster objects
+    for each cluster. The name of the cluster is given as "Cluster NNN" as given by CD-HIT.
+    The file is parsed with ReadCDHITClusters, use that directly to avoid creating the
+    per-member objects.
+    """
+    table = ReadCDHITClusters(handle)
+
+    cluster_members = []
+    representative = None
+    for i in range(len(table)):
+        new_member = SeqClusterMember(table.name[i])
+        # add the CD-HIT specific metadata
+        new_member.length = table.length[i]
+        new_member.identity = table.identity[i]
+        if table.rep_start[i] >= 0:
+            new_member.rep_overlap = (table.rep_start[i], table.rep_stop[i])
+            new_member.member_overlap = (table.member_start[i], table.member_stop[i])
+        if table.strand[i]:
+            new_member.strand = table.strand[i]
+        if table.representative[i]:
+            representative = new_member
+
+        cluster_members.append(new_member)
+
+        # yield the cluster once we've seen its last member
+        if i + 1 == len(table) or table.cluster[i + 1] != table.cluster[i]:
+            yield SeqCluster(table.cluster_names[table.cluster[i]], representative, cluster_members)
+            cluster_members = []
+            representative = None
+
+def GreedyClustIterator(sequences, identity_cutoff, throw_away_length=10):
+    """Greedy incremental clustering of equal length sequences.
+
+    Clusters the given (name, sequence) pairs like CD-HIT run with global identity
+    (-G 1) and assignment to the most similar representative (-g 1). Sequences are
+    considered in the order given; each joins the representative it has the highest
+    ungapped identity with if that identity is at least identity_cutoff, otherwise it
+    becomes a new representative. Sequences no longer than throw_away_length are
+    dropped (-l). Yields SeqCluster objects named "Cluster NNN" with members in input
+    order, as CDHITClustIterator does.
+    """
+    names = []
+    encoded = []
+    for name, sequence in sequences:
+        if len(sequence) > throw_away_length:
+            names.append(name)
+            encoded.append(sequence.encode('ascii'))
+    if len(names) == 0:
+        return
+
+    length = len(encoded[0])
+    if any(len(s) != length for s in encoded):
+        raise ValueError('greedy clustering requires sequences of equal length')
+
+    encoded = np.frombuffer(b''.join(encoded), dtype=np.uint8).reshape(len(names), length)
+    representatives = np.empty_like(encoded)
+    representative_count = 0
+    assignment = np.empty(len(names), dtype=np.intp)
+    identities = np.empty(len(names), dtype=np.float64)
+
+    for i in range(len(names)):
+        if representative_count > 0:
+            # identity to all the current representatives at once
+            match_counts = (representatives[:representative_count] == encoded[i]).sum(axis=1)
+            best = int(np.argmax(match_counts))
+            identity = match_counts[best] / length
+            if identity >= identity_cutoff:
+                assignment[i] = best
+                identities[i] = 100.0 * identity
+                continue
+        # otherwise start a new cluster
+        representatives[representative_count] = encoded[i]
+        assignment[i] = representative_count
+        identities[i] = 100.0
+        representative_count += 1
+
+    cluster_members = [[] for _ in range(representative_count)]
+    cluster_representatives = [None] * representative_count
+    for i, name in enumerate(names):
+        new_member = SeqClusterMember(name)
+        new_member.length = length
+        new_member.identity = float(identities[i])
+        cluster_number = assignment[i]
+        if cluster_representatives[cluster_number] is None:
+            cluster_representatives[cluster_number] = new_member
+        cluster_members[cluster_number].append(new_member)
+
+    for cluster_number in range(representative_count):
+        yield SeqCluster('Cluster %d' % cluster_number, cluster_representatives[cluster_number],
+                         cluster_members[cluster_number])
 
 def DNAClustHandler(sequences, identity_cutoff, **kwargs):
     """Cluster DNA sequences with dnaclust.
@@ -0,0 +1,160 @@
+import math
+import base64
+import hashlib
+import heapq
+import random
+from array import array
+
+def _hash128(value):
+    # a hash that is the same in every process, unlike hash()
+    digest = hashlib.blake2b(str(value).encode('utf-8'), digest_size=16).digest()
+    return int.from_bytes(digest[:8], 'big'), int.from_bytes(digest[8:], 'big')
+
+class HyperLogLog:
+    """Estimate the number of distinct values added using 2**precision small registers.
+
+    The relative error is about 1.04 / sqrt(2**precision). Sketches with the
+    same precision are merged by taking the larger of each register.
+    """
+    def __init__(self, precision=12):
+        assert 4 <= precision <= 18, 'the precision must be between 4 and 18'
+        self.precision = precision
+        self.registers = bytearray(1 << precision)
+
+    def add(self, value):
+        h, _ = _hash128(value)
+        index = h >> (64 - self.precision)
+        rest = h & ((1 << (64 - self.precision)) - 1)
+        # the position of the first set bit of the rest of the hash
+        rank = (64 - self.precision) - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other):
+        assert self.precision == other.precision, 'only sketches with the same precision can be merged'
+        self.registers = bytearray(max(a, b) for a, b in zip(self.registers, other.registers))
+
+    def estimate(self):
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        raw = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if raw <= 2.5 * m and zeros > 0:
+            # few values, use linear counting
+            return m * math.log(m / zeros)
+        return raw
+
+    def state(self):
+        return {'precision': self.precision, 'registers': base64.b64encode(bytes(self.registers)).decode('ascii')}
+
+    @classmethod
+    def from_state(cls, state):
+        sketch = cls(state['precision'])
+        sketch.registers = bytearray(base64.b64decode(state['registers']))
+        return sketch
+
+class CountMinSketch:
+    """Estimate the number of times each value was added, never under counting.
+
+    The counts are kept in depth rows of width counters. The most common
+    top_k values seen so far are tracked as candidates, so the heavy hitters can
+    be listed without keeping every value. Sketches with the same shape are
+    merged by adding the counters, the candidates are then re-estimated.
+    """
+    def __init__(self, width=2048, depth=4, top_k=10):
+        self.width = width
+        self.depth = depth
+        self.top_k = top_k
+        self.counters = [array('q', bytes(8 * width)) for _ in range(depth)]
+        self.candidates = {}
+
+    def _columns(self, value):
+        h1, h2 = _hash128(value)
+        return [(h1 + row * h2) % self.width for row in range(self.depth)]
+
+    def add(self, value, count=1):
+        estimate = None
+        for counters, column in zip(self.counters, self._columns(value)):
+            counters[column] += count
+            if estimate is None or counters[column] < estimate:
+                estimate = counters[column]
+        self._update_candidates({value: estimate})
+
+    def _update_candidates(self, estimates):
+        self.candidates.update(estimates)
+        if len(self.candidates) > self.top_k:
+            self.candidates = dict(heapq.nlargest(self.top_k, self.candidates.items(), key=lambda c: c[1]))
+
+    def estimate(self, value):
+        return min(counters[column] for counters, column in zip(self.counters, self._columns(value)))
+
+    def top(self):
+        """Return the most common values and their estimated counts, most common first.
+        """
+        return sorted(self.candidates.items(), key=lambda c: (-c[1], c[0]))
+
+    def merge(self, other):
+        assert (self.width, self.depth) == (other.width, other.depth), 'only sketches with the same shape can be merged'
+        for counters, other_counters in zip(self.counters, other.counters):
+            for column, count in enumerate(other_counters):
+                if count:
+                    counters[column] += count
+        values = set(self.candidates) | set(other.candidates)
+        self.candidates = {}
+        self._update_candidates({value: self.estimate(value) for value in values})
+
+    def state(self):
+        return {'width': self.width, 'depth': self.depth, 'top_k': self.top_k,
+                'counters': [base64.b64encode(counters.tobytes()).decode('ascii') for counters in self.counters],
+                'candidates': list(self.candidates.items())}
+
+    @classmethod
+    def from_state(cls, state):
+        sketch = cls(state['width'], state['depth'], state['top_k'])
+        for counters, encoded in zip(sketch.counters, state['counters']):
+            counters[:] = array('q', base64.b64decode(encoded))
+        sketch.candidates = {value: count for value, count in state['candidates']}
+        return sketch
+
+class ReservoirSample:
+    """Keep a uniform random sample of at most size of the items added.
+
+    Each item gets a random priority and the items with the smallest
+    priorities are kept, so two samples are merged by keeping the smallest
+    of both.
+    """
+    def __init__(self, size, seed=None):
+        self.size = size
+        self.random = random.Random(seed)
+        self.items = []     # a heap of (-priority, item number, item), so the largest priority is first
+        self.count = 0
+
+    def add(self, item):
+        priority = self.random.random()
+        self.count += 1
+        if len(self.items) < self.size:
+            heapq.heappush(self.items, (-priority, self.count, item))
+        elif -priority > self.items[0][0]:
+            heapq.heapreplace(self.items, (-priority, self.count, item))
+
+    def merge(self, other):
+        assert self.size == other.size, 'only samples of the same size can be merged'
+        # renumber the other items so they never tie with these
+        items = self.items + [(p, self.count + n, item) for p, n, item in other.items]
+        self.items = heapq.nlargest(self.size, items, key=lambda i: i[0])
+        heapq.heapify(self.items)
+        self.count += other.count
+
+    def sample(self):
+        return [item for _, _, item in sorted(self.items, key=lambda i: i[1])]
+
+    def state(self):
+        return {'size': self.size, 'count': self.count, 'items': [[p, n, item] for p, n, item in self.items]}
+
+    @classmethod
+    def from_state(cls, state):
+        sample = cls(state['size'])
+        sample.count = state['count']
+        sample.items = [(p, n, item) for p, n, item in state['items']]
+        heapq.heapify(sample.items)
+        return sample
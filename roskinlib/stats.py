@@ -0,0 +1,371 @@
+import math
+import json
+from collections import Counter
+
+import fastavro
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from .utils import open_compressed
+from .seq_rec import best_vdj_score, get_query_region, v_mutation_counts
+from .sketches import HyperLogLog, CountMinSketch, ReservoirSample
+
+class RecordView:
+    """The values of a sequence record the statistics are computed from.
+
+    The parse derived values are only worked out the first time one of the
+    statistics asks for them, and then shared by all of them.
+    """
+    def __init__(self, record, parse_label=None, lineage_label=None, min_v_score=70, min_j_score=26):
+        self.record = record
+        self.parse_label = parse_label
+        self.lineage_label = lineage_label
+        self.min_v_score = min_v_score
+        self.min_j_score = min_j_score
+        self._scores = None
+
+    @property
+    def subject(self):
+        return self.record['subject']
+
+    @property
+    def source(self):
+        return self.record['source']
+
+    @property
+    def type(self):
+        return self.record['sequence']['annotations'].get('target1')
+
+    @property
+    def lineage(self):
+        return self.record['lineages'].get(self.lineage_label)
+
+    @property
+    def parse(self):
+        return self.record['parses'].get(self.parse_label)
+
+    @property
+    def has_subject(self):
+        return self.subject is not None
+
+    @property
+    def parsed(self):
+        return self.parse is not None
+
+    @property
+    def full_ident(self):
+        # the barcode and both targets were identified, records not from reads have none of them
+        annotations = self.record['sequence']['annotations']
+        return annotations.get('barcode1') is not None and annotations.get('target1') is not None and \
+               annotations.get('target2') is not None
+
+    @property
+    def phix(self):
+        annotations = self.record['sequence']['annotations']
+        return (annotations.get('phix1') or 0) > 0 or (annotations.get('phix2') or 0) > 0
+
+    @property
+    def v_j_in_frame(self):
+        return None if self.parse is None else self.parse['v_j_in_frame']
+
+    @property
+    def has_stop_codon(self):
+        return None if self.parse is None else self.parse['has_stop_codon']
+
+    @property
+    def good_parse(self):
+        # the parse has V and J-segment alignments with at least the minimum scores
+        if self._scores is None:
+            _, v_score, _, _, _, j_score = best_vdj_score(self.parse)
+            self._scores = v_score, j_score
+        v_score, j_score = self._scores
+        return v_score is not None and j_score is not None and \
+               v_score >= self.min_v_score and j_score >= self.min_j_score
+
+    @property
+    def cdr3(self):
+        # the CDR3 nucleotide sequence
+        if not self.good_parse:
+            return None
+        return get_query_region(self.parse, 'CDR3')
+
+    @property
+    def cdr3_length(self):
+        cdr3 = self.cdr3
+        return None if cdr3 is None else len(cdr3)
+
+    @property
+    def mutation_level(self):
+        if not self.good_parse:
+            return None
+        diff_count, same_count = v_mutation_counts(self.parse)
+        if diff_count is None or diff_count + same_count == 0:
+            return None
+        return diff_count / (diff_count + same_count)
+
+# the Parquet schema metadata key holding the rest of the state of a partial result
+PARTIAL_METADATA_KEY = b'roskinlab.partial'
+
+def _row_sort_key(row):
+    # missing values last, numbers in numeric order
+    return tuple((v is None, v if v is not None else 0) for v in row)
+
+class GroupCount:
+    """Count the records by the values of some keys.
+
+    The keys are (column name, function of a RecordView) pairs. Records that
+    where is false for are skipped. Counts from different sets of records are
+    combined with merge.
+    """
+    def __init__(self, keys, where=None):
+        self.keys = keys
+        self.where = where
+        self.counts = Counter()
+
+    @property
+    def columns(self):
+        return [column for column, _ in self.keys] + ['count']
+
+    def add(self, view):
+        if self.where is None or self.where(view):
+            self.counts[tuple(key(view) for _, key in self.keys)] += 1
+
+    def merge(self, other):
+        self.counts.update(other.counts)
+
+    def rows(self):
+        for key in sorted(self.counts, key=_row_sort_key):
+            yield key + (self.counts[key],)
+
+    def state(self):
+        return [list(key) + [count] for key, count in self.counts.items()]
+
+    def load_state(self, state):
+        self.counts = Counter({tuple(row[:-1]): row[-1] for row in state})
+
+    def to_table(self):
+        keys = list(self.counts)
+        columns = {column: [key[i] for key in keys] for i, column in enumerate(self.columns[:-1])}
+        columns['count'] = pa.array([self.counts[key] for key in keys], type=pa.int64())
+        return pa.table(columns)
+
+    def load_table(self, table):
+        columns = [table.column(column).to_pylist() for column in self.columns]
+        self.counts = Counter({tuple(row[:-1]): row[-1] for row in zip(*columns)})
+
+def bin_lower_edge(value, bin_width):
+    """Return the lower edge of the histogram bin of a value.
+
+    A value on an edge, like 0.29 with a width of 0.01, is in the bin above it
+    even though the floating point division puts it just below.
+    """
+    return round(math.floor(value / bin_width + 1e-9) * bin_width, 10)
+
+class Histogram(GroupCount):
+    """Count the records by the bin of a value, within groups given by some keys.
+
+    Records without the value are skipped. The bin of a value is its lower edge.
+    """
+    def __init__(self, keys, value, bin_width=1, where=None):
+        value_column, value_function = value
+        self.bin_width = bin_width
+        def value_bin(view):
+            v = value_function(view)
+            if v is None:
+                return None
+            return bin_lower_edge(v, bin_width)
+        def has_value(view):
+            return (where is None or where(view)) and value_function(view) is not None
+        super().__init__(keys + [(value_column, value_bin)], has_value)
+
+class SketchGroups:
+    """Keep a sketch of the values of each group given by some keys.
+
+    Subclasses give the sketch class, how to make a new sketch, and the rows
+    for the sketch of a group. Sketches are merged group by group.
+    """
+    sketch_class = None
+
+    def __init__(self, keys, value):
+        self.keys = keys
+        self.value_column, self.value = value
+        self.sketches = {}
+
+    def new_sketch(self):
+        raise NotImplementedError
+
+    def add(self, view):
+        value = self.value(view)
+        if value is not None:
+            group = tuple(key(view) for _, key in self.keys)
+            if group not in self.sketches:
+                self.sketches[group] = self.new_sketch()
+            self.sketches[group].add(value)
+
+    def merge(self, other):
+        for group, sketch in other.sketches.items():
+            if group in self.sketches:
+                self.sketches[group].merge(sketch)
+            else:
+                self.sketches[group] = sketch
+
+    def state(self):
+        return [list(group) + [sketch.state()] for group, sketch in self.sketches.items()]
+
+    def load_state(self, state):
+        self.sketches = {tuple(row[:-1]): self.sketch_class.from_state(row[-1]) for row in state}
+
+class DistinctCount(SketchGroups):
+    """Estimate the number of distinct values within groups given by some keys, with a HyperLogLog sketch per group.
+
+    The memory used doesn't grow with the number of values.
+    """
+    sketch_class = HyperLogLog
+
+    def __init__(self, keys, value, precision=12):
+        super().__init__(keys, value)
+        self.precision = precision
+
+    @property
+    def columns(self):
+        return [column for column, _ in self.keys] + ['distinct_' + self.value_column]
+
+    def new_sketch(self):
+        return HyperLogLog(self.precision)
+
+    def rows(self):
+        for group in sorted(self.sketches, key=_row_sort_key):
+            yield group + (int(round(self.sketches[group].estimate())),)
+
+class TopCounts(SketchGroups):
+    """Estimate the most common values within groups given by some keys, with a count-min sketch per group.
+    """
+    sketch_class = CountMinSketch
+
+    def __init__(self, keys, value, top_k=10):
+        super().__init__(keys, value)
+        self.top_k = top_k
+
+    @property
+    def columns(self):
+        return [column for column, _ in self.keys] + [self.value_column, 'count']
+
+    def new_sketch(self):
+        return CountMinSketch(top_k=self.top_k)
+
+    def rows(self):
+        for group in sorted(self.sketches, key=_row_sort_key):
+            for value, count in self.sketches[group].top():
+                yield group + (value, count)
+
+def _key(column):
+    return column, lambda view: getattr(view, column)
+
+_score_groups = [_key('subject'), _key('source'), _key('type'), _key('v_j_in_frame'), _key('has_stop_codon')]
+
+def make_statistics(names, mutation_bin_width=0.01):
+    """Return the accumulators for the statistics with the given names, in a dict by name.
+    """
+    statistics = {'read_counts':    lambda: GroupCount([_key('subject'), _key('type')]),
+                  'subject_counts': lambda: GroupCount([_key('subject'), _key('source')]),
+                  'parse_counts':   lambda: GroupCount([_key('has_subject'), _key('parsed')]),
+                  'ident_counts':   lambda: GroupCount([_key('has_subject'), _key('parsed'), _key('full_ident'), _key('phix')]),
+                  'clone_counts':   lambda: GroupCount([_key('subject'), _key('source'), _key('type'), _key('lineage')],
+                                                       where=lambda view: view.lineage is not None),
+                  'cdr3_length':    lambda: Histogram(list(_score_groups), _key('cdr3_length')),
+                  'mutation_level': lambda: Histogram(list(_score_groups), _key('mutation_level'),
+                                                      bin_width=mutation_bin_width),
+                  # the streaming summaries, these use a fixed amount of memory per subject
+                  'distinct_cdr3':     lambda: DistinctCount([_key('subject')], _key('cdr3')),
+                  'distinct_lineages': lambda: DistinctCount([_key('subject')], _key('lineage')),
+                  'top_clones':        lambda: TopCounts([_key('subject')], _key('lineage'))}
+    for name in names:
+        if name not in statistics:
+            raise ValueError('unknown statistic %s' % name)
+    return {name: statistics[name]() for name in names}
+
+STATISTICS = ['read_counts', 'subject_counts', 'parse_counts', 'ident_counts', 'clone_counts', 'cdr3_length', 'mutation_level',
+              'distinct_cdr3', 'distinct_lineages', 'top_clones']
+
+class StatsEngine:
+    """Compute several statistics of sequence records in one decoding pass.
+
+    The options are passed on to the RecordView of each record. state() gives
+    the partial results as plain lists and dicts, so engines that processed
+    different files can be saved, loaded and merged. If sample_size is given a
+    uniform random sample of the records is kept as well.
+    """
+    def __init__(self, names, **options):
+        self.names = list(names)
+        self.options = options
+        self.mutation_bin_width = options.pop('mutation_bin_width', 0.01)
+        self.sample_size = options.pop('sample_size', 0)
+        self.statistics = make_statistics(self.names, self.mutation_bin_width)
+        self.sample = ReservoirSample(self.sample_size) if self.sample_size > 0 else None
+        self.writer_schema = None   # the schema of the records, for writing out the sample
+        self.record_count = 0
+
+    def add(self, record):
+        view = RecordView(record, **self.options)
+        for statistic in self.statistics.values():
+            statistic.add(view)
+        if self.sample is not None:
+            self.sample.add(record)
+        self.record_count += 1
+
+    def add_file(self, filename):
+        with open_compressed(filename, 'rb') as seq_record_handle:
+            reader = fastavro.reader(seq_record_handle)
+            if self.writer_schema is None:
+                self.writer_schema = reader.writer_schema
+            for record in reader:
+                self.add(record)
+
+    def merge(self, other):
+        assert self.names == other.names and self.options == other.options and \
+               self.mutation_bin_width == other.mutation_bin_width and self.sample_size == other.sample_size, \
+               'only the same statistics computed the same way can be merged'
+        for name, statistic in self.statistics.items():
+            statistic.merge(other.statistics[name])
+        if self.sample is not None:
+            self.sample.merge(other.sample)
+        if self.writer_schema is None:
+            self.writer_schema = other.writer_schema
+        self.record_count += other.record_count
+
+    def state(self):
+        return {'names': self.names,
+                'options': dict(self.options, mutation_bin_width=self.mutation_bin_width, sample_size=self.sample_size),
+                'record_count': self.record_count,
+                'statistics': {name: statistic.state() for name, statistic in self.statistics.items()},
+                'sample': None if self.sample is None else self.sample.state(),
+                'writer_schema': self.writer_schema}
+
+    @classmethod
+    def from_state(cls, state):
+        engine = cls(state['names'], **state['options'])
+        engine.record_count = state['record_count']
+        for name, statistic in engine.statistics.items():
+            statistic.load_state(state['statistics'][name])
+        if state.get('sample') is not None:
+            engine.sample = ReservoirSample.from_state(state['sample'])
+        engine.writer_schema = state.get('writer_schema')
+        return engine
+
+def write_partial_table(filename, engine):
+    """Write the partial result of an engine with one statistic as a Parquet table of its keys and counts.
+    """
+    assert len(engine.statistics) == 1, 'a partial table holds one statistic'
+    state = engine.state()
+    del state['statistics']
+    table = engine.statistics[engine.names[0]].to_table()
+    table = table.replace_schema_metadata({PARTIAL_METADATA_KEY: json.dumps(state)})
+    pq.write_table(table, filename, compression='gzip')
+
+def read_partial_table(filename):
+    table = pq.read_table(filename)
+    state = json.loads(table.schema.metadata[PARTIAL_METADATA_KEY])
+    engine = StatsEngine(state['names'], **state['options'])
+    engine.record_count = state['record_count']
+    engine.statistics[engine.names[0]].load_table(table)
+    return engine
@@ -1,13 +1,55 @@
 import gzip
 import bz2
+import io
+import os
 import itertools
 import sys
 
-def open_compressed(filename, mode='rb'):
+from .bgzf import ThreadedGzipReader, BgzfWriter
+
+def compression_threads():
+    """Return the number of threads open_compressed uses by default, from the ROSKINLAB_THREADS environment variable.
+    """
+    return int(os.environ.get('ROSKINLAB_THREADS', '1'))
+
+def _buffered(raw, mode):
+    if 'r' in mode:
+        handle = io.BufferedReader(raw, buffer_size=1 << 20)
+    else:
+        handle = io.BufferedWriter(raw, buffer_size=1 << 20)
+    if 't' in mode:
+        return io.TextIOWrapper(handle)
+    return handle
+
+def _open_zstd(filename, mode, threads):
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError('the zstandard package is needed to read and write %s' % filename)
+    if 'r' in mode:
+        return zstandard.open(filename, mode)
+    return zstandard.open(filename, mode, cctx=zstandard.ZstdCompressor(threads=threads if threads > 1 else 0))
+
+def open_compressed(filename, mode='rb', threads=None):
+    """Open a file, compressed or not by its extension, or stdin or stdout for -.
+
+    With more than one thread, .gz files are decompressed ahead of the reader
+    in a pool of threads, and written as BGZF, which is still gzip, with the
+    blocks compressed in parallel. .zst files need the zstandard package.
+    """
+    if threads is None:
+        threads = compression_threads()
     if filename.endswith('.gz'):
+        if threads > 1 and mode.strip('bt') in ('r', 'w'):
+            if 'r' in mode:
+                return _buffered(ThreadedGzipReader(open(filename, 'rb'), threads), mode)
+            else:
+                return _buffered(BgzfWriter(open(filename, 'wb'), threads), mode)
         return gzip.open(filename, mode)
     elif filename.endswith('.bz2'):
         return bz2.open(filename, mode)
+    elif filename.endswith('.zst'):
+        return _open_zstd(filename, mode, threads)
     elif filename == '-':
         if 'r' in mode:
             if 'b' in mode:
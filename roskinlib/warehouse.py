@@ -1,18 +1,55 @@
 import sys
+import os
+import io
+import json
+import logging
 import pathlib
+import shutil
+import tempfile
+from collections import Counter, OrderedDict
+
+# the name of the file used to store the partition index
+MANIFEST_FILENAME = '_partitions.json'
+# the names of the files holding the packed partitions and their offsets
+PACKED_DATA_FILENAME  = '_packed.data'
+PACKED_INDEX_FILENAME = '_packed.index'
+# the file that marks a packed warehouse as being written
+PACKED_LOCK_FILENAME  = '_packed.lock'
+
+def _node_to_json(node):
+    if isinstance(node, set):
+        return sorted(node)
+    else:
+        return {value: _node_to_json(child) for value, child in node.items()}
+
+def _node_from_json(node):
+    if isinstance(node, list):
+        return set(node)
+    else:
+        return {value: _node_from_json(child) for value, child in node.items()}
 
 class DirectoryWarehouse:
-    def __init__(self, root_directory, *partition_keys, file_leaf=True, value_encoder=str):
+    def __init__(self, root_directory, *partition_keys, file_leaf=True, value_encoder=str, manifest=False):
         self.root_directory = pathlib.Path(root_directory)
         self.partition_keys = partition_keys
         self.file_leaf = file_leaf
         self.value_encoder = value_encoder
+        self.manifest = manifest    # store the partition index in a file in the root directory
+        self.counters = Counter()   # counts of directories made and partitions opened for writing
+        self._partition_index = None
+        self._manifest_dirty = False
+        self._made_directories = set()
 
-    def filename(self, filename_or_suffix, *args, **kwargs):
+    def filename(self, filename_or_suffix, *args, write=False, **kwargs):
+        # write is True if the caller will make the file, it is then added to the partition index
         directory, filename = self._make_dir_file_name(filename_or_suffix, args, kwargs, self.value_encoder)
 
         # make the directory
-        directory.mkdir(parents=True, exist_ok=True)
+        self._make_directory(directory)
+
+        if write:
+            self._add_to_index(self._directory_values(kwargs), filename[len(self.partition_keys[-1]) + 1:])
+            self._manifest_changed()
 
         return directory / filename
 
@@ -20,10 +57,19 @@ class DirectoryWarehouse:
         directory, filename = self._make_dir_file_name(filename_or_suffix, args, kwargs, self.value_encoder)
 
         # make the diretory
-        directory.mkdir(parents=True, exist_ok=True)
+        self._make_directory(directory)
+
+        # keep the partition index up to date
+        if 'r' not in mode or '+' in mode:
+            self.counters['partitions_opened'] += 1
+            self._add_to_index(self._directory_values(kwargs), filename[len(self.partition_keys[-1]) + 1:])
+            self._manifest_changed()
 
         return (directory / filename).open(mode=mode)
 
+    def writer(self, mode='wt', max_open=256):
+        return WarehouseWriter(self, mode, max_open)
+
     def exists(self, filename_or_suffix, *args, **kwargs):
         directory, filename = self._make_dir_file_name(filename_or_suffix, args, kwargs, self.value_encoder)
 
@@ -36,50 +82,138 @@ class DirectoryWarehouse:
                 'postional partition arguments overlap with given key/value arguments'
             keyvalue_args[key] = value
 
-        # initilize
-        dir_path = self.root_directory
-        values = []
+        if not self.file_leaf:
+            assert False, 'not let implemented'
+
+        # answer the query from the partition index
+        yield from self._query_index(self._index(), 0, suffix, keyvalue_args, [])
+
+    def close(self):
+        # rewrite the manifest with the partitions written
+        if self._manifest_dirty:
+            if self._partition_index is not None:
+                self.save_manifest()
+            self._manifest_dirty = False
+
+    def __enter__(self):
+        return self
 
-        # for each partition key
-        for key in self.partition_keys[:-1]:
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def refresh(self):
+        # drop the partition index, it will be rebuilt from the directory structure when next used
+        self._partition_index = None
+        if self.manifest and self._manifest_filename().exists():
+            self._manifest_filename().unlink()
+
+    def save_manifest(self):
+        manifest = {'partition_keys': list(self.partition_keys),
+                    'partitions': _node_to_json(self._index())}
+        with self._manifest_filename().open('wt') as manifest_handle:
+            json.dump(manifest, manifest_handle)
+
+    def _query_index(self, node, level, suffix, keyvalue_args, values):
+        key = self.partition_keys[level]
+
+        # for each partition key but the last
+        if level < len(self.partition_keys) - 1:
             # if defined, add value
             if key in keyvalue_args:
                 value = self.value_encoder(keyvalue_args[key])
-                dir_path = dir_path / (key + '=' + value)
-                values.append(value)
+                if value in node:
+                    yield from self._query_index(node[value], level + 1, suffix, keyvalue_args, values + [value])
             else:   # or iterate over the values in the warehouse
-                key_label = key + '='
-                if dir_path.is_dir():
-                    for level in dir_path.iterdir():
-                        if level.name.startswith(key_label):
-                            value = level.name[len(key_label):]
-                            yield from self.partitions(suffix, **keyvalue_args, **{key: value})
-                break
+                for value, child in list(node.items()):
+                    yield from self._query_index(child, level + 1, suffix, keyvalue_args, values + [value])
         else:
-            # the last value is treated differently
-            if self.file_leaf:
-                # if the final key is given
-                final_key = self.partition_keys[-1]
-                if final_key in keyvalue_args:
-                    final_value = keyvalue_args[final_key]
-                    # give the list without the last value
-                    if final_value is None:
+            # the last value is treated differently, the node is the set of leaf names
+            suffix_stop = None if len(suffix) == 0 else -len(suffix)
+            if key in keyvalue_args:
+                final_value = keyvalue_args[key]
+                # give the list without the last value
+                if final_value is None:
+                    if any(leaf.endswith(suffix) for leaf in node):
                         yield values
-                    else:
-                        final_value = self.value_encoder(final_value)
-                        dir_path = dir_path / (final_key + '=' + final_value + suffix)
-                        if dir_path.exists():
-                            yield values + [final_value]
-                else:   # otherwise, iterate over what's in the warehouse
-                    key_label = final_key + '='
-                    if dir_path.is_dir():
-                        for level in dir_path.iterdir():
-                            if level.name.startswith(key_label) and level.name.endswith(suffix):
-                                suffix_stop = None if len(suffix) == 0 else -len(suffix)
-                                value = level.name[len(key_label):suffix_stop]
-                                yield values + [value]
-            else:
-                assert False, 'not let implemented'
+                else:
+                    final_value = self.value_encoder(final_value)
+                    if final_value + suffix in node:
+                        yield values + [final_value]
+            else:   # otherwise, iterate over what's in the warehouse
+                for leaf in list(node):
+                    if leaf.endswith(suffix):
+                        yield values + [leaf[:suffix_stop]]
+
+    def _index(self):
+        # build the index on first use, from the manifest if there is one
+        if self._partition_index is None:
+            if self.manifest and self._manifest_filename().exists():
+                self._partition_index = self._load_manifest()
+            if self._partition_index is None:
+                self._partition_index = self._scan_level(self.root_directory, 0)
+                if self.manifest and self.root_directory.is_dir():
+                    self.save_manifest()
+        return self._partition_index
+
+    def _scan_level(self, dir_path, level):
+        # the index is a tree of dicts, one level per directory, with the set of leaf names at the bottom
+        key_label = self.partition_keys[level] + '='
+        last_level = level == len(self.partition_keys) - 1
+        node = set() if last_level else {}
+
+        try:
+            with os.scandir(dir_path) as entries:
+                entries = list(entries)
+        except (FileNotFoundError, NotADirectoryError):
+            return node
+
+        for entry in entries:
+            if entry.name.startswith(key_label):
+                value = entry.name[len(key_label):]
+                if last_level:
+                    node.add(value)
+                elif entry.is_dir():
+                    node[value] = self._scan_level(entry.path, level + 1)
+        return node
+
+    def _add_to_index(self, directory_values, leaf):
+        # record a newly written partition in the index, if it has been built
+        if self._partition_index is None or not self.file_leaf:
+            return
+        node = self._partition_index
+        for level, value in enumerate(directory_values):
+            child = set() if level == len(directory_values) - 1 else {}
+            node = node.setdefault(value, child)
+        node.add(leaf)
+
+    def _manifest_changed(self):
+        # a partition may have been added, a manifest not backed by the index in memory is now stale
+        if self.manifest:
+            if self._partition_index is None and self._manifest_filename().exists():
+                self._manifest_filename().unlink()
+            self._manifest_dirty = True
+
+    def _make_directory(self, directory):
+        # only make each directory once
+        if directory not in self._made_directories:
+            directory.mkdir(parents=True, exist_ok=True)
+            self._made_directories.add(directory)
+            self.counters['directories_made'] += 1
+
+    def _directory_values(self, keyvalue_args):
+        return [self.value_encoder(keyvalue_args[key]) for key in self.partition_keys[:-1]]
+
+    def _manifest_filename(self):
+        return self.root_directory / MANIFEST_FILENAME
+
+    def _load_manifest(self):
+        with self._manifest_filename().open('rt') as manifest_handle:
+            manifest = json.load(manifest_handle)
+        # ignore manifests for a different partitioning
+        if manifest['partition_keys'] != list(self.partition_keys):
+            logging.warning('ignoring manifest %s with different partition keys', self._manifest_filename())
+            return None
+        return _node_from_json(manifest['partitions'])
 
     def _make_dir_file_name(self, filename_or_suffix, positional_args, keyvalue_args, value_encoder):
         # convert the positional arguments into key/value arguments
@@ -108,3 +242,266 @@ class DirectoryWarehouse:
             filename = filename_or_suffix
 
         return directory, filename
+
+
+class WarehouseWriter:
+    """Write to many partitions of a warehouse, keeping a bounded pool of open handles.
+
+    Writes to a partition go to an open handle if there is one. Otherwise the
+    partition is opened, closing the least recently used handle if max_open are
+    already open. A partition is opened with the given mode the first time and
+    reopened in append mode after that. All handles are closed on exit.
+    """
+    def __init__(self, warehouse, mode='wt', max_open=256):
+        assert mode[:1] in ('w', 'a') and '+' not in mode, 'the writer mode must be w or a'
+        self.warehouse = warehouse
+        self.mode = mode
+        self.append_mode = 'a' + mode[1:]
+        self.max_open = max_open
+        self._handles = OrderedDict()
+        self._opened = set()
+
+    def write(self, filename_or_suffix, data, *args, **kwargs):
+        directory, filename = self.warehouse._make_dir_file_name(filename_or_suffix, args, kwargs,
+                                                                 self.warehouse.value_encoder)
+        path = directory / filename
+
+        if path in self._handles:
+            self._handles.move_to_end(path)
+            handle = self._handles[path]
+        else:
+            # make room in the pool
+            if len(self._handles) >= self.max_open:
+                _, oldest_handle = self._handles.popitem(last=False)
+                oldest_handle.close()
+                self.warehouse.counters['handles_evicted'] += 1
+
+            mode = self.append_mode if path in self._opened else self.mode
+            handle = self.warehouse.open(filename_or_suffix, mode, **kwargs)
+            self._handles[path] = handle
+            self._opened.add(path)
+
+        handle.write(data)
+        self.warehouse.counters['writes'] += 1
+
+    def close(self):
+        while self._handles:
+            _, handle = self._handles.popitem(last=False)
+            handle.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+class _PackedPartitionBuffer(io.BytesIO):
+    # holds a partition being written, it is added to the packed data file when closed
+    # without an error, a with block that raises leaves the partition as it was
+    def __init__(self, commit):
+        super().__init__()
+        self._commit = commit
+
+    def discard(self):
+        self._commit = None
+
+    def close(self):
+        if not self.closed and self._commit is not None:
+            self._commit(self.getvalue())
+        super().close()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self.discard()
+        return super().__exit__(exc_type, exc_value, traceback)
+
+class _PackedPartitionText(io.TextIOWrapper):
+    # the text handle of a partition being written, passing errors on to its buffer
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self.buffer.discard()
+        return super().__exit__(exc_type, exc_value, traceback)
+
+class PackedWarehouse(DirectoryWarehouse):
+    """A warehouse with all the partitions packed into a single file.
+
+    Partitions are named as they are in a DirectoryWarehouse, but their contents are
+    appended to one data file in the root directory and their offsets to an index file
+    next to it. Rewriting a partition appends a new copy and the last copy is used,
+    appending to a partition only adds the new data as another chunk of it. Only one
+    process can write to a packed warehouse at a time, the writer holds a lock file
+    in the root directory until close().
+
+    Programs that need a real file can get one from filename(), which extracts the
+    partition into a temporary directory that is removed by close().
+    """
+    def __init__(self, root_directory, *partition_keys, value_encoder=str):
+        super().__init__(root_directory, *partition_keys, file_leaf=True, value_encoder=value_encoder)
+        self._entries = None
+        self._data_handle = None
+        self._index_handle = None
+        self._read_handle = None
+        self._extract_directory = None
+        self._extracted = {}
+
+    def filename(self, filename_or_suffix, *args, write=False, **kwargs):
+        if write:
+            raise ValueError('partitions of a packed warehouse can only be written with open()')
+        path = self._relative_path(filename_or_suffix, args, kwargs)
+        entries = self._entry_index()
+        if path not in entries:
+            raise FileNotFoundError('partition %s is not in packed warehouse %s, use open() to write it' %
+                                    (path, self.root_directory))
+
+        if self._extract_directory is None:
+            self._extract_directory = pathlib.Path(tempfile.mkdtemp(prefix='packed_warehouse_'))
+        extracted_filename = self._extract_directory / path
+
+        # extract the partition, again if it has been rewritten
+        if self._extracted.get(path) != entries[path]:
+            extracted_filename.parent.mkdir(parents=True, exist_ok=True)
+            with extracted_filename.open('wb') as extracted_handle:
+                extracted_handle.write(self._read(entries[path]))
+            self._extracted[path] = entries[path]
+
+        return extracted_filename
+
+    def open(self, filename_or_suffix, mode, *args, **kwargs):
+        path = self._relative_path(filename_or_suffix, args, kwargs)
+        entries = self._entry_index()
+
+        if mode.startswith('r') and '+' not in mode:
+            if path not in entries:
+                raise FileNotFoundError('partition %s is not in packed warehouse %s' % (path, self.root_directory))
+            handle = io.BytesIO(self._read(entries[path]))
+        elif mode[:1] in ('w', 'a') and '+' not in mode:
+            self.counters['partitions_opened'] += 1
+            append = mode.startswith('a')
+            handle = _PackedPartitionBuffer(lambda data: self._append(path, data, append))
+        else:
+            raise ValueError('mode %s is not supported by a packed warehouse' % mode)
+
+        if 'b' in mode:
+            return handle
+        elif 'r' in mode:
+            return io.TextIOWrapper(handle)
+        else:
+            return _PackedPartitionText(handle)
+
+    def exists(self, filename_or_suffix, *args, **kwargs):
+        return self._relative_path(filename_or_suffix, args, kwargs) in self._entry_index()
+
+    def refresh(self):
+        # reload the index from the index file
+        self._entries = None
+        self._partition_index = None
+
+    def close(self):
+        for handle in (self._data_handle, self._index_handle, self._read_handle):
+            if handle is not None:
+                handle.close()
+        if self._data_handle is not None:
+            (self.root_directory / PACKED_LOCK_FILENAME).unlink()
+        self._data_handle = None
+        self._index_handle = None
+        self._read_handle = None
+
+        if self._extract_directory is not None:
+            shutil.rmtree(self._extract_directory, ignore_errors=True)
+            self._extract_directory = None
+            self._extracted = {}
+
+    def _index(self):
+        self._entry_index()
+        return self._partition_index
+
+    def _entry_index(self):
+        # load the chunks of the partitions, the last copy of a partition wins, an offset
+        # starting with + is a chunk appended to the partition
+        if self._entries is None:
+            self._entries = {}
+            self._partition_index = set() if len(self.partition_keys) == 1 else {}
+            index_filename = self.root_directory / PACKED_INDEX_FILENAME
+            if index_filename.exists():
+                with index_filename.open('rt') as index_handle:
+                    for line in index_handle:
+                        if not line.endswith('\n'):    # skip a partially written last line
+                            break
+                        offset, length, path = line[:-1].split('\t')
+                        self._add_entry(path, int(offset), int(length), offset.startswith('+'))
+        return self._entries
+
+    def _add_entry(self, path, offset, length, append=False):
+        if append and path in self._entries:
+            self._entries[path] += ((offset, length),)
+        else:
+            self._entries[path] = ((offset, length),)
+
+        # add it to the partition tree
+        parts = path.split('/')
+        directory_values = [p.split('=', 1)[1] for p in parts[:-1]]
+        self._add_to_index(directory_values, parts[-1][len(self.partition_keys[-1]) + 1:])
+
+    def _relative_path(self, filename_or_suffix, positional_args, keyvalue_args):
+        directory, filename = self._make_dir_file_name(filename_or_suffix, positional_args, keyvalue_args,
+                                                       self.value_encoder)
+        path = (directory / filename).relative_to(self.root_directory).as_posix()
+        assert '\t' not in path and '\n' not in path, 'partition values cannot contain tabs or newlines'
+        return path
+
+    def _append(self, path, data, append=False):
+        self._entry_index()
+        append = append and path in self._entries
+        if append and not data:
+            return
+
+        if self._data_handle is None:
+            self.root_directory.mkdir(parents=True, exist_ok=True)
+            self._lock()
+            self._drop_partial_index_line()
+            self._data_handle  = (self.root_directory / PACKED_DATA_FILENAME).open('ab')
+            self._index_handle = (self.root_directory / PACKED_INDEX_FILENAME).open('at')
+
+        # write the data before the index so the index never points past the data
+        offset = self._data_handle.seek(0, os.SEEK_END)
+        self._data_handle.write(data)
+        self._data_handle.flush()
+        self._index_handle.write('%s%d\t%d\t%s\n' % ('+' if append else '', offset, len(data), path))
+        self._index_handle.flush()
+
+        self._add_entry(path, offset, len(data), append)
+
+    def _lock(self):
+        # fail rather than let two writers interleave their index lines
+        lock_filename = self.root_directory / PACKED_LOCK_FILENAME
+        try:
+            lock_fd = os.open(lock_filename, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            raise IOError('packed warehouse %s is being written by another process, remove %s if it is not' %
+                          (self.root_directory, lock_filename)) from None
+        with os.fdopen(lock_fd, 'wt') as lock_handle:
+            lock_handle.write('%d\n' % os.getpid())
+
+    def _drop_partial_index_line(self):
+        # a writer that died part way through an index line leaves it unfinished, it is skipped
+        # when reading and has to go before anything is added after it
+        index_filename = self.root_directory / PACKED_INDEX_FILENAME
+        if index_filename.exists():
+            with index_filename.open('r+b') as index_handle:
+                size = index_handle.seek(0, os.SEEK_END)
+                tail_start = max(size - (1 << 16), 0)
+                index_handle.seek(tail_start)
+                tail = index_handle.read()
+                if tail and not tail.endswith(b'\n'):
+                    index_handle.truncate(tail_start + tail.rfind(b'\n') + 1)
+
+    def _read(self, chunks):
+        if self._data_handle is not None:
+            self._data_handle.flush()
+        if self._read_handle is None:
+            self._read_handle = (self.root_directory / PACKED_DATA_FILENAME).open('rb')
+        pieces = []
+        for offset, length in chunks:
+            self._read_handle.seek(offset)
+            pieces.append(self._read_handle.read(length))
+        return b''.join(pieces)
@@ -0,0 +1,109 @@
+import gzip
+import os
+import random
+
+import pytest
+
+from roskinlib.batch_index import BatchIndex, batch_index_filename
+from roskinlib.bgzf import BgzfWriter, bgzf_blocks, BLOCK_SIZE
+
+def make_reads(count, read_number, seed=1):
+    rng = random.Random(seed)
+    reads = []
+    for n in range(count):
+        length = rng.randint(50, 250)
+        reads.append(('M01:1:%d %d:N:0:ACGT' % (n, read_number), ''.join(rng.choice('ACGT') for _ in range(length)), 'I' * length))
+    return reads
+
+def fastq_bytes(reads):
+    return ''.join('@%s\n%s\n+\n%s\n' % read for read in reads).encode('ascii')
+
+READ_COUNT = 3000
+R1_READS = make_reads(READ_COUNT, 1, seed=1)
+R2_READS = make_reads(READ_COUNT, 2, seed=2)
+
+def write_run(directory, compression):
+    filenames = []
+    for number, reads in [(1, R1_READS), (2, R2_READS)]:
+        data = fastq_bytes(reads)
+        if compression == 'bgzf':
+            filename = str(directory / ('r%d.fq.gz' % number))
+            with BgzfWriter(open(filename, 'wb'), threads=2) as writer:
+                writer.write(data)
+        elif compression == 'gzip':
+            filename = str(directory / ('r%d.fq.gz' % number))
+            with gzip.open(filename, 'wb') as handle:
+                handle.write(data)
+        else:
+            filename = str(directory / ('r%d.fq' % number))
+            with open(filename, 'wb') as handle:
+                handle.write(data)
+        filenames.append(filename)
+    return filenames
+
+@pytest.mark.parametrize('compression', ['none', 'bgzf'])
+@pytest.mark.parametrize('batch_size', [1000, 777, 5000])
+def test_batches(tmp_path, compression, batch_size):
+    r1_filename, r2_filename = write_run(tmp_path, compression)
+    index = BatchIndex.build(r1_filename, r2_filename, batch_size)
+    assert index.bgzf == [compression == 'bgzf'] * 2
+    assert len(index) == -(-READ_COUNT // batch_size)
+    assert [batch[0] for batch in index.batches] == [min(batch_size, READ_COUNT - start) for start in range(0, READ_COUNT, batch_size)]
+
+    index.save(batch_index_filename(r1_filename))
+    index = BatchIndex.load(batch_index_filename(r1_filename))
+    for batch_number in range(len(index)):
+        expected = slice(batch_number * batch_size, (batch_number + 1) * batch_size)
+        assert list(index.read_paired_fastq(batch_number, batch_size=100)) == list(zip(R1_READS[expected], R2_READS[expected]))
+        for read_number, reads in [(1, R1_READS), (2, R2_READS)]:
+            handle, length = index.open_batch(batch_number, read_number, threads=2)
+            with handle:
+                # the batch is exactly its reads, the next batch starts right after
+                assert handle.read(length) == fastq_bytes(reads[expected])
+            batches = list(index.read_fastq_batches(batch_number, read_number, batch_size=64))
+            assert [record for batch in batches for record in batch.records()] == reads[expected]
+
+def test_virtual_offsets(tmp_path):
+    r1_filename, r2_filename = write_run(tmp_path, 'bgzf')
+    index = BatchIndex.build(r1_filename, r2_filename, 333)
+    for read_number, filename in [(1, r1_filename), (2, r2_filename)]:
+        with open(filename, 'rb') as handle:
+            blocks = dict(bgzf_blocks(handle))
+        assert len(blocks) > 10
+        decompressed_starts = []
+        for batch in index.batches:
+            offset = batch[2 * read_number - 1]
+            # the block offset is a block of the file and the offset within the block is inside it
+            block_offset, within = offset >> 16, offset & 0xffff
+            assert block_offset in blocks
+            assert within < len(blocks[block_offset]) <= BLOCK_SIZE
+            decompressed_starts.append(sum(len(data) for o, data in blocks.items() if o < block_offset) + within)
+        # the batches start where the one before ends
+        lengths = [batch[2 * read_number] for batch in index.batches]
+        assert decompressed_starts == [sum(lengths[:n]) for n in range(len(lengths))]
+        assert sum(lengths) == sum(len(data) for data in blocks.values())
+    # with 333 reads per batch, some batches start in the middle of a block
+    assert any(batch[1] & 0xffff for batch in index.batches)
+
+def test_bad_runs(tmp_path):
+    r1_filename, r2_filename = write_run(tmp_path, 'gzip')
+    with pytest.raises(ValueError, match='bgzip'):
+        BatchIndex.build(r1_filename, r2_filename, 1000)
+
+    r1_filename, r2_filename = write_run(tmp_path, 'none')
+    with open(r2_filename, 'ab') as handle:
+        handle.write(fastq_bytes(make_reads(1, 2)))
+    with pytest.raises(ValueError, match='different numbers of reads'):
+        BatchIndex.build(r1_filename, r2_filename, 1000)
+
+    r1_filename, r2_filename = write_run(tmp_path, 'none')
+    index = BatchIndex.build(r1_filename, r2_filename, 1000)
+    assert index.read_number(r2_filename) == 2 and index.read_number(r1_filename) == 1
+    with pytest.raises(ValueError):
+        index.read_number(str(tmp_path / 'other.fq'))
+    with pytest.raises(ValueError, match='no batch 3'):
+        index.open_batch(3, 1)
+    with open(r1_filename, 'ab') as handle:
+        handle.write(b'\n')
+    with pytest.raises(ValueError, match='changed'):
+        index.open_batch(0, 1)
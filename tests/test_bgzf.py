@@ -0,0 +1,119 @@
+import gzip
+import io
+import random
+
+import pytest
+
+from roskinlib.bgzf import BgzfWriter, ThreadedGzipReader, bgzf_blocks, is_bgzf, BLOCK_SIZE, _BGZF_EOF
+from roskinlib.utils import open_compressed
+
+_bases = bytes(b'ACGT'[n % 4] for n in range(256))
+
+def make_data(size, seed=1):
+    # compressible, like reads, but not so much the blocks are tiny
+    rng = random.Random(seed)
+    records = []
+    length = 0
+    while length < size:
+        record = b'@read%d\n%s\n+\n%s\n' % (len(records), rng.randbytes(100).translate(_bases), b'I' * 100)
+        records.append(record)
+        length += len(record)
+    return b''.join(records)[:size]
+
+def write_bgzf(filename, data, threads=4, write_size=None):
+    with BgzfWriter(open(filename, 'wb'), threads) as writer:
+        if write_size is None:
+            writer.write(data)
+        else:
+            for start in range(0, len(data), write_size):
+                writer.write(data[start:start + write_size])
+
+def read_all(reader):
+    with reader:
+        return b''.join(iter(lambda: reader.read(100000), b''))
+
+@pytest.mark.parametrize('size,write_size', [(0, None), (1000, None), (3 * 16 * BLOCK_SIZE + 12345, None),
+                                             (2 * 16 * BLOCK_SIZE + 5, 4999)])
+def test_round_trip(tmp_path, size, write_size):
+    data = make_data(size)
+    filename = str(tmp_path / 'data.gz')
+    write_bgzf(filename, data, write_size=write_size)
+
+    with gzip.open(filename, 'rb') as handle:
+        assert handle.read() == data
+    assert read_all(ThreadedGzipReader(open(filename, 'rb'), threads=3)) == data
+
+def test_blocks_and_eof(tmp_path):
+    data = make_data(5 * BLOCK_SIZE + 100)
+    filename = str(tmp_path / 'data.gz')
+    write_bgzf(filename, data)
+
+    with open(filename, 'rb') as handle:
+        contents = handle.read()
+    assert contents.endswith(_BGZF_EOF)
+
+    with open(filename, 'rb') as handle:
+        assert is_bgzf(handle)
+        assert handle.tell() == 0
+        blocks = list(bgzf_blocks(handle))
+    # full blocks, the rest, and the empty end of file block, each found at its offset
+    assert [len(block) for _, block in blocks] == [BLOCK_SIZE] * 5 + [100, 0]
+    assert b''.join(block for _, block in blocks) == data
+    assert blocks[-1][0] == len(contents) - len(_BGZF_EOF)
+    for offset, block in blocks:
+        with gzip.GzipFile(fileobj=io.BytesIO(contents[offset:])) as member:
+            assert member.read(len(block)) == block
+
+def test_plain_gzip(tmp_path):
+    data = make_data(3 * 16 * BLOCK_SIZE)
+    filename = str(tmp_path / 'plain.gz')
+    with gzip.open(filename, 'wb') as handle:
+        handle.write(data)
+    with open(filename, 'rb') as handle:
+        assert not is_bgzf(handle)
+    assert read_all(ThreadedGzipReader(open(filename, 'rb'), threads=4)) == data
+
+def test_bad_files(tmp_path):
+    data = make_data(3 * BLOCK_SIZE)
+    filename = str(tmp_path / 'data.gz')
+    write_bgzf(filename, data)
+    with open(filename, 'rb') as handle:
+        contents = bytearray(handle.read())
+
+    # a plain gzip member after the BGZF ones
+    with open(filename, 'wb') as handle:
+        handle.write(contents[:-len(_BGZF_EOF)] + gzip.compress(b'more'))
+    with pytest.raises(IOError):
+        read_all(ThreadedGzipReader(open(filename, 'rb'), threads=2))
+
+    # a changed byte in the stored CRC of the first block
+    first_block_size = int.from_bytes(contents[16:18], 'little') + 1
+    contents[first_block_size - 8] ^= 0xff
+    with open(filename, 'wb') as handle:
+        handle.write(contents)
+    with pytest.raises(IOError):
+        read_all(ThreadedGzipReader(open(filename, 'rb'), threads=2))
+
+    # cut short in the middle of a block
+    with open(filename, 'wb') as handle:
+        handle.write(contents[:first_block_size + 100])
+    with pytest.raises(IOError):
+        read_all(ThreadedGzipReader(open(filename, 'rb'), threads=2))
+
+def test_threads_environment(tmp_path, monkeypatch):
+    text = make_data(2 * 16 * BLOCK_SIZE + 777).decode('ascii')
+    outputs = {}
+    for threads in ['1', '4']:
+        monkeypatch.setenv('ROSKINLAB_THREADS', threads)
+        filename = str(tmp_path / ('threads%s.fq.gz' % threads))
+        with open_compressed(filename, 'wt') as handle:
+            handle.write(text)
+        with open(filename, 'rb') as handle:
+            assert is_bgzf(handle) == (threads != '1')
+        # both files read the same with either number of threads
+        for read_threads in ['1', '4']:
+            monkeypatch.setenv('ROSKINLAB_THREADS', read_threads)
+            with open_compressed(filename, 'rt') as handle:
+                outputs[threads, read_threads] = list(handle)
+    assert len(set(map(tuple, outputs.values()))) == 1
+    assert ''.join(outputs['1', '1']) == text
@@ -0,0 +1,70 @@
+import os
+import shutil
+import threading
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from roskinlib.datatables import ParquetDataTable
+
+def _write_partition(root, subject, names, lengths):
+    directory = root / ('subject=%s' % subject)
+    directory.mkdir(parents=True, exist_ok=True)
+    table = pa.table({'name': names, 'cdr3_len': pa.array(lengths, type=pa.int32())})
+    pq.write_table(table, directory / 'part0.parquet', row_group_size=2)
+
+def _query(table, **parameters):
+    parameters = dict({'draw': '1', 'start': '0', 'length': '-1'}, **parameters)
+    return table.query(parameters)
+
+def _dataset(root):
+    _write_partition(root, 'A', ['a1', 'a2', 'a3'], [12, 10, 14])
+    _write_partition(root, 'B', ['b1', 'b2'], [11, None])
+
+def test_query_search_and_order(tmp_path):
+    _dataset(tmp_path)
+    table = ParquetDataTable(tmp_path, ['subject', 'name', 'cdr3_len'])
+    assert table.total_rows == 5
+
+    result = _query(table, **{'order[0][column]': '2', 'order[0][dir]': 'asc'})
+    assert [row[1] for row in result['data']] == ['b2', 'a2', 'b1', 'a1', 'a3']
+
+    result = _query(table, **{'columns[0][search][value]': 'b', 'order[0][column]': '2', 'order[0][dir]': 'desc'})
+    assert result['recordsFiltered'] == 2
+    assert [row[1] for row in result['data']] == ['b1', 'b2']
+    # the search on the partition column skips the row groups of subject A
+    assert table.counters['row_groups_pruned'] == 2
+
+def test_sort_index_rebuilt_for_rewritten_partition(tmp_path):
+    _dataset(tmp_path)
+    ParquetDataTable(tmp_path, ['subject', 'name', 'cdr3_len']).build_sort_indexes()
+
+    # the same number of rows with different values
+    path = tmp_path / 'subject=A' / 'part0.parquet'
+    stat = os.stat(path)
+    _write_partition(tmp_path, 'A', ['a1', 'a2', 'a3'], [20, 30, 9])
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000000000))
+
+    table = ParquetDataTable(tmp_path, ['subject', 'name', 'cdr3_len'])
+    result = _query(table, **{'order[0][column]': '2', 'order[0][dir]': 'asc'})
+    assert [row[1] for row in result['data']] == ['b2', 'a3', 'b1', 'a1', 'a2']
+
+def test_concurrent_queries(tmp_path):
+    _dataset(tmp_path)
+    table = ParquetDataTable(tmp_path, ['subject', 'name', 'cdr3_len'])
+    expected = {column: _query(table, **{'order[0][column]': str(column)})['data'] for column in range(3)}
+
+    # one table whose sort indexes and cache are built by the threads at once
+    shutil.rmtree(table.index_directory)
+    shared = ParquetDataTable(tmp_path, ['subject', 'name', 'cdr3_len'], cache_size=2)
+    results = []
+    def run(column):
+        for _ in range(20):
+            results.append((column, _query(shared, **{'order[0][column]': str(column)})['data']))
+    threads = [threading.Thread(target=run, args=(column % 3,)) for column in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(results) == 120
+    assert all(data == expected[column] for column, data in results)
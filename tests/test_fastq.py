@@ -0,0 +1,126 @@
+import io
+import random
+
+import pytest
+from Bio.SeqIO.QualityIO import FastqGeneralIterator
+
+from roskinlib.fastq import (read_fastq_batches, read_fastq, read_paired_fastq_batches, read_paired_fastq,
+                             split_paired_ranges, next_record_start)
+
+def make_records(count, read_number=1, seed=1):
+    rng = random.Random(seed)
+    records = []
+    for n in range(count):
+        length = rng.randint(1, 30)
+        sequence = ''.join(rng.choice('ACGTN') for _ in range(length))
+        # qualities that start with @ or + look like the other lines of a record
+        quality = rng.choice('@+I#') + ''.join(rng.choice('@+!I#') for _ in range(length - 1))
+        records.append(('M01:1:%d %d:N:0:ACGT' % (n, read_number) + ' x' * (n % 3 * read_number), sequence, quality))
+    return records
+
+def fastq_bytes(records, newline='\n'):
+    return ''.join('@%s%s%s%s+%s%s%s' % (title, newline, sequence, newline, newline, quality, newline)
+                   for title, sequence, quality in records).encode('ascii')
+
+RECORDS = make_records(200)
+
+@pytest.mark.parametrize('chunk_size', [1, 7, 64, 1000, 1 << 22])
+@pytest.mark.parametrize('batch_size', [1, 3, 64, 1000])
+def test_chunk_boundaries(chunk_size, batch_size):
+    data = fastq_bytes(RECORDS)
+    batches = list(read_fastq_batches(io.BytesIO(data), batch_size=batch_size, chunk_size=chunk_size))
+    assert [len(batch) for batch in batches[:-1]] == [batch_size] * (len(batches) - 1)
+    assert [record for batch in batches for record in batch.records()] == RECORDS
+    # whole batches are written back as they were read
+    assert b''.join(batch.to_bytes() for batch in batches) == data
+
+def test_matches_biopython():
+    data = fastq_bytes(RECORDS)
+    assert list(read_fastq(io.TextIOWrapper(io.BytesIO(data)), chunk_size=100)) == \
+           list(FastqGeneralIterator(io.StringIO(data.decode('ascii'))))
+
+@pytest.mark.parametrize('newline', ['\n', '\r\n'])
+def test_missing_trailing_newline(newline):
+    data = fastq_bytes(RECORDS[:10], newline)
+    data = data[:-len(newline)]
+    for chunk_size in [5, 1000]:
+        batches = list(read_fastq_batches(io.BytesIO(data), batch_size=4, chunk_size=chunk_size))
+        assert [record for batch in batches for record in batch.records()] == RECORDS[:10]
+        assert b''.join(batch.to_bytes() for batch in batches) == fastq_bytes(RECORDS[:10])
+
+def test_bad_records():
+    data = fastq_bytes(RECORDS[:10])
+    # the last record is missing its quality line
+    title, sequence, _ = RECORDS[10]
+    with pytest.raises(ValueError, match='truncated'):
+        list(read_fastq_batches(io.BytesIO(data + b'@%s\n%s\n+\n' % (title.encode('ascii'), sequence.encode('ascii')))))
+    with pytest.raises(ValueError):
+        list(read_fastq_batches(io.BytesIO(data.replace(b'@M01:1:3 ', b'M01:1:3 '))))
+    with pytest.raises(ValueError):
+        list(read_fastq_batches(io.BytesIO(fastq_bytes([('r1', 'ACGT', 'III')]))))
+
+def test_length():
+    data = fastq_bytes(RECORDS)
+    end = len(fastq_bytes(RECORDS[:50]))
+    handle = io.BytesIO(data)
+    handle.seek(len(fastq_bytes(RECORDS[:20])))
+    records = list(read_fastq(handle, length=end - handle.tell(), batch_size=7, chunk_size=33))
+    assert records == RECORDS[20:50]
+
+def test_paired():
+    r2_records = make_records(200, read_number=2)
+    r1_data, r2_data = fastq_bytes(RECORDS), fastq_bytes(r2_records)
+    pairs = list(read_paired_fastq(io.BytesIO(r1_data), io.BytesIO(r2_data), batch_size=16, chunk_size=50))
+    assert pairs == list(zip(RECORDS, r2_records))
+
+def test_mismatched_ids():
+    r2_records = make_records(200, read_number=2)
+    r2_records[37] = ('M01:1:999 2:N:0:ACGT',) + r2_records[37][1:]
+    with pytest.raises(ValueError, match='M01:1:37 != M01:1:999'):
+        list(read_paired_fastq_batches(io.BytesIO(fastq_bytes(RECORDS)), io.BytesIO(fastq_bytes(r2_records)), batch_size=16))
+
+    # one file has more reads, in the last batch or in a batch of its own
+    for r2_count in [199, 201, 208, 150]:
+        r2_records = make_records(r2_count, read_number=2)
+        with pytest.raises(ValueError, match='different numbers of reads'):
+            list(read_paired_fastq_batches(io.BytesIO(fastq_bytes(RECORDS[:200])), io.BytesIO(fastq_bytes(r2_records)), batch_size=8))
+
+def test_next_record_start():
+    data = fastq_bytes(RECORDS)
+    starts = set()
+    position = 0
+    for record in RECORDS:
+        starts.add(position)
+        position += len(fastq_bytes([record]))
+    handle = io.BytesIO(data)
+    for offset in range(0, len(data), 37):
+        start = next_record_start(handle, offset, window=64)
+        assert start >= offset
+        assert start == min([s for s in starts if s >= offset], default=len(data))
+
+@pytest.mark.parametrize('parts', [1, 2, 3, 7, 64, 300])
+def test_split_paired_ranges(tmp_path, parts):
+    # the R2 titles are longer, so the same reads are at different offsets in the two files
+    r2_records = make_records(200, read_number=2, seed=2)
+    r2_records = [(r1[0].split(' ')[0] + r2[0][r2[0].index(' '):],) + r2[1:] for r1, r2 in zip(RECORDS, r2_records)]
+    r1_filename, r2_filename = tmp_path / 'r1.fq', tmp_path / 'r2.fq'
+    r1_filename.write_bytes(fastq_bytes(RECORDS))
+    r2_filename.write_bytes(fastq_bytes(r2_records))
+
+    with open(r1_filename, 'rb') as r1_handle, open(r2_filename, 'rb') as r2_handle:
+        ranges = split_paired_ranges(r1_handle, r2_handle, parts)
+        assert len(ranges) == parts
+        # the ranges cover both files end to end without a gap or an overlap
+        assert ranges[0][0] == 0 and ranges[0][2] == 0
+        assert ranges[-1][1] == len(fastq_bytes(RECORDS)) and ranges[-1][3] == len(fastq_bytes(r2_records))
+        for (_, r1_stop, _, r2_stop), (r1_start, _, r2_start, _) in zip(ranges[:-1], ranges[1:]):
+            assert (r1_stop, r2_stop) == (r1_start, r2_start)
+
+        # every read pair is in exactly one part
+        pairs = []
+        for r1_start, r1_stop, r2_start, r2_stop in ranges:
+            r1_handle.seek(r1_start)
+            r2_handle.seek(r2_start)
+            pairs += list(read_paired_fastq(r1_handle, r2_handle, r1_length=r1_stop - r1_start, r2_length=r2_stop - r2_start,
+                                            batch_size=5, chunk_size=100))
+        assert pairs == list(zip(RECORDS, r2_records))
@@ -0,0 +1,67 @@
+import random
+
+import numpy as np
+
+from roskinlib.kmer_screen import KmerIndex, kmer_codes
+from roskinlib.record_batches import concatenate, segment_sums
+
+def random_sequence(rng, length):
+    return ''.join(rng.choice('ACGT') for _ in range(length))
+
+def reverse_complement(sequence):
+    return sequence[::-1].translate(str.maketrans('ACGT', 'TGCA'))
+
+def mutate(sequence, positions):
+    bases = list(sequence)
+    for position in positions:
+        bases[position] = {'A': 'C', 'C': 'G', 'G': 'T', 'T': 'A'}[bases[position]]
+    return ''.join(bases)
+
+# a stand-in for the PhiX genome, about as long
+rng = random.Random(5386)
+REFERENCE = random_sequence(rng, 5386)
+OTHER_READS = [random_sequence(rng, 150) for _ in range(50)]
+
+def test_concatenate_segment_sums():
+    data, ends = concatenate(['AC-', '', '--', 'T'])
+    assert data.tobytes() == b'AC---T' and ends.tolist() == [3, 3, 5, 6]
+    assert segment_sums(data != ord('-'), ends).tolist() == [2, 0, 0, 1]
+
+def test_kmer_codes():
+    codes, starts = kmer_codes(['ACGTA', 'CGNTAC', 'AC'], 3)
+    # the k-mers with an N or crossing into the next sequence are left out
+    assert starts.tolist() == [0, 1, 2, 8]
+    assert codes.tolist() == [0b000110, 0b011011, 0b101100, 0b110001]
+
+def test_reference_reads(tmp_path):
+    fasta_filename = tmp_path / 'reference.fasta'
+    fasta_filename.write_text('>reference\n' + '\n'.join(REFERENCE[i:i + 60] for i in range(0, len(REFERENCE), 60)) + '\n')
+    index = KmerIndex.from_fasta(str(fasta_filename))
+
+    exact = REFERENCE[1000:1150]
+    # three mismatches further apart than k, each costs the base and the mismatch penalty
+    mutated = mutate(REFERENCE[3000:3150], [30, 70, 110])
+    # a read that is half reference
+    partial = REFERENCE[4000:4075] + random_sequence(random.Random(1), 75)
+    scores = index.scores([exact, mutated, partial])
+    assert scores[:2].tolist() == [150, 150 - 3 - 3 * 4]
+    # the random half can match the reference by chance for a base or two where they join
+    assert 75 <= scores[2] < 80
+    assert scores.min() >= index.min_score
+
+    # reverse-complement hits are found with the same score
+    assert index.scores([reverse_complement(exact), reverse_complement(mutated)]).tolist() == [150, 150 - 3 - 3 * 4]
+
+def test_other_reads():
+    index = KmerIndex([REFERENCE])
+    assert index.scores(OTHER_READS).tolist() == [0] * len(OTHER_READS)
+    # a short hit scores below the minimum and is reported as 0
+    assert index.scores([OTHER_READS[0][:100] + REFERENCE[200:225]]).tolist() == [0]
+
+def test_mixed_batch():
+    index = KmerIndex([REFERENCE])
+    # the coverage of one read never spills into the next one
+    reads = [REFERENCE[:100], OTHER_READS[0], '', REFERENCE[10:15], 'N' * 40, reverse_complement(REFERENCE[-120:]), OTHER_READS[1]]
+    assert index.scores(reads).tolist() == [100, 0, 0, 0, 0, 120, 0]
+    assert index.scores([]).tolist() == []
+    assert index.scores(reads[:1]).dtype == np.int64
@@ -0,0 +1,142 @@
+import os
+
+import pytest
+
+from roskinlib.record_index import (RecordIndex, RECORD_INDEX_DIRNAME, NameIndexedFile, AvroBlockFile,
+                                    write_name_sorted_records)
+
+SCHEMA = {
+    'type': 'record', 'name': 'SequenceRecord',
+    'fields': [
+        {'name': 'name', 'type': 'string'},
+        {'name': 'subject', 'type': 'string'},
+        {'name': 'parses', 'type': {'type': 'map', 'values': ['null', {
+            'type': 'record', 'name': 'Parse',
+            'fields': [
+                {'name': 'alignments', 'type': {'type': 'array', 'items': {
+                    'type': 'record', 'name': 'Alignment',
+                    'fields': [{'name': 'type', 'type': 'string'},
+                               {'name': 'name', 'type': ['null', 'string']},
+                               {'name': 'score', 'type': ['null', 'int']},
+                               {'name': 'alignment', 'type': 'string'}]}}},
+                {'name': 'ranges', 'type': {'type': 'map', 'values': {
+                    'type': 'record', 'name': 'Range',
+                    'fields': [{'name': 'start', 'type': 'int'}, {'name': 'stop', 'type': 'int'}]}}}]}]}},
+        {'name': 'lineages', 'type': {'type': 'map', 'values': 'string'}}]}
+
+CDR3S = ['TGTGCGAGA', 'TGTGCGAAA', 'TGTACGAGA']
+
+def make_record(subject, number):
+    # V and J genes and the CDR3 cycle at different rates, so the criteria pick different blocks
+    cdr3 = CDR3S[number % 3]
+    query = 'ACGT' + cdr3 + 'ACGT'
+    parse = {'alignments': [{'type': 'Q', 'name': None, 'score': None, 'alignment': query},
+                            {'type': 'V', 'name': 'IGHV%d-1*01' % (number % 2 + 1), 'score': 100, 'alignment': query},
+                            {'type': 'J', 'name': 'IGHJ%d*02' % (number % 5 + 1), 'score': 40, 'alignment': query}],
+             'ranges': {'CDR3': {'start': 4, 'stop': 4 + len(cdr3)}}}
+    return {'name': '%s_read%04d' % (subject, number), 'subject': subject,
+            'parses': {'igblast': parse, 'other': None},
+            'lineages': {'clones': '%s_%d' % (subject, number // 10)}}
+
+def write_dataset(root, subjects=('S1', 'S2'), record_count=100, block_records=10):
+    records = {}
+    for subject in subjects:
+        directory = root / ('subject=%s' % subject)
+        directory.mkdir(parents=True)
+        subject_records = [make_record(subject, number) for number in range(record_count)]
+        write_name_sorted_records(str(directory / 'source=run1.avro'), SCHEMA, subject_records,
+                                  codec='deflate', block_records=block_records)
+        records[subject] = subject_records
+    return records
+
+def _expected(records, **criteria):
+    def keys(record):
+        parse = record['parses']['igblast']
+        return {'subject': record['subject'],
+                'v_gene':  parse['alignments'][1]['name'].split('*')[0],
+                'j_gene':  parse['alignments'][2]['name'].split('*')[0],
+                'cdr3_nt': parse['alignments'][0]['alignment'][4:-4],
+                'lineage_clones': record['lineages']['clones']}
+    return sorted(r['name'] for rs in records.values() for r in rs
+                  if all(keys(r)[key] == value for key, value in criteria.items()))
+
+@pytest.mark.parametrize('criteria', [{'subject': 'S2'},
+                                      {'v_gene': 'IGHV1-1', 'j_gene': 'IGHJ3'},
+                                      {'subject': 'S1', 'cdr3_nt': 'TGTACGAGA'},
+                                      {'lineage_clones': 'S2_7'},
+                                      {'cdr3_nt': 'TGTACGAGA', 'j_gene': 'IGHJ9'}])
+def test_lookup(tmp_path, criteria):
+    records = write_dataset(tmp_path)
+    RecordIndex.build(tmp_path, 'igblast').save()
+    index = RecordIndex.load(tmp_path)
+    assert sorted(r['name'] for r in index.lookup(**criteria)) == _expected(records, **criteria)
+
+def test_postings_are_per_key_files(tmp_path):
+    write_dataset(tmp_path)
+    built = RecordIndex.build(tmp_path, 'igblast')
+    built.save()
+    index_files = sorted(os.listdir(tmp_path / RECORD_INDEX_DIRNAME))
+    assert index_files == ['cdr3_aa.parquet', 'cdr3_nt.parquet', 'index.json', 'j_gene.parquet',
+                           'lineage_clones.parquet', 'subject.parquet', 'v_gene.parquet']
+
+    index = RecordIndex.load(tmp_path)
+    assert index.keys() == built.keys()
+    assert index.values('cdr3_aa') == built.values('cdr3_aa') == ['CAK', 'CAR', 'CTR']
+    assert index.values('subject') == ['S1', 'S2']
+    assert index.values('missing') == []
+    # the lineage only spans the S1 blocks holding reads 70 to 79, blocks of 10 reads
+    assert index.blocks(lineage_clones='S1_7') == {0: [7]}
+    assert index.blocks(v_gene='IGHV1-1', subject='S3') == {}
+    assert built.blocks(subject='S2', cdr3_nt='TGTGCGAAA') == index.blocks(subject='S2', cdr3_nt='TGTGCGAAA')
+
+def test_changed_file(tmp_path):
+    write_dataset(tmp_path, subjects=('S1',))
+    RecordIndex.build(tmp_path, 'igblast').save()
+    with open(tmp_path / 'subject=S1' / 'source=run1.avro', 'ab') as handle:
+        handle.write(b'x')
+    with pytest.raises(ValueError):
+        list(RecordIndex.load(tmp_path).lookup(subject='S1'))
+
+@pytest.mark.parametrize('codec', ['null', 'deflate', 'bzip2'])
+def test_name_indexed_file(tmp_path, codec):
+    filename = str(tmp_path / 'sorted.avro')
+    records = [make_record('S1', number) for number in range(95)]
+    write_name_sorted_records(filename, SCHEMA, records, codec=codec, block_records=10)
+
+    name_file = NameIndexedFile(filename)
+    try:
+        assert len(name_file.offsets) == 10
+        # the last, first and a middle block, out of order, then the same block twice
+        for number in [94, 0, 9, 47, 50, 49, 48, 90, 0]:
+            assert name_file.get('S1_read%04d' % number) == records[number]
+        assert name_file.get('S1_read0095') is None
+        assert name_file.get('S0_read0000') is None
+        assert name_file.get('S1_read0047x') is None
+
+        names = ['S1_read%04d' % number for number in [93, 5, 61, 60, 2]] + ['S2_read0000']
+        assert name_file.get_many(names) == {name: records[int(name[-4:])] for name in names[:-1]}
+    finally:
+        name_file.close()
+
+def test_read_block_after_blocks(tmp_path):
+    filename = str(tmp_path / 'sorted.avro')
+    records = [make_record('S1', number) for number in range(30)]
+    write_name_sorted_records(filename, SCHEMA, records, block_records=10)
+
+    block_file = AvroBlockFile(filename)
+    try:
+        offsets = [offset for offset, _ in block_file.blocks()]
+        assert block_file.read_block(offsets[2]) == records[20:]
+        assert block_file.read_block(offsets[0]) == records[:10]
+        assert block_file.read_block(offsets[1]) == records[10:20]
+    finally:
+        block_file.close()
+
+def test_empty_file(tmp_path):
+    filename = str(tmp_path / 'sorted.avro')
+    write_name_sorted_records(filename, SCHEMA, [], block_records=10)
+    name_file = NameIndexedFile(filename)
+    try:
+        assert name_file.get('S1_read0000') is None
+    finally:
+        name_file.close()
@@ -0,0 +1,58 @@
+import io
+import gzip
+import struct
+
+import pytest
+
+from roskinlib.sam import alignment_scores, sam_alignment_scores, best_read_scores
+
+# a header, a read with a primary and two secondary alignments where a secondary one scores
+# best, an unmapped read without an AS tag and a read with one alignment
+SAM = b'''@HD\tVN:1.6\tSO:unsorted
+@SQ\tSN:phix\tLN:5386
+@PG\tID:bwa\tPN:bwa
+read1\t0\tphix\t100\t60\t10M\t*\t0\t0\tACGTACGTAC\tIIIIIIIIII\tNM:i:0\tAS:i:10\tXS:i:8
+read1\t256\tphix\t900\t0\t10M\t*\t0\t0\t*\t*\tNM:i:0\tAS:i:25
+read1\t256\tphix\t1900\t0\t10M\t*\t0\t0\t*\t*\tAS:i:3
+read2\t4\t*\t0\t0\t*\t*\t0\t0\tACGTACGTAC\tIIIIIIIIII
+read3\t16\tphix\t2000\t60\t10M\t*\t0\t0\tACGTACGTAC\tIIIIIIIIII\tAS:i:7
+'''
+EXPECTED = [('read1', 25), ('read2', 0), ('read3', 7)]
+
+def _bam_record(name, flag, tags):
+    # an alignment without a sequence or CIGAR, only the name, flag and tags matter here
+    name = name.encode('ascii') + b'\x00'
+    fixed = struct.pack('<iiBBHHHiiii', 0, 0, len(name), 0, 0, 0, flag, 0, -1, -1, 0)
+    body = fixed + name + tags
+    return struct.pack('<i', len(body)) + body
+
+def _bam():
+    header = b'@HD\tVN:1.6\n'
+    data = b'BAM\x01' + struct.pack('<i', len(header)) + header + struct.pack('<i', 1) + \
+           struct.pack('<i', 5) + b'phix\x00' + struct.pack('<i', 5386)
+    data += _bam_record('read1', 0, b'NMC\x00' + b'ASC\x0a' + b'XSC\x08')
+    data += _bam_record('read1', 256, b'XAZphix,+900\x00' + b'ASs\x19\x00')
+    data += _bam_record('read1', 256, b'ASi\x03\x00\x00\x00')
+    data += _bam_record('read2', 4, b'')
+    data += _bam_record('read3', 16, b'ASc\x07')
+    return gzip.compress(data)
+
+def test_sam_best_scores():
+    assert list(best_read_scores(alignment_scores(io.BufferedReader(io.BytesIO(SAM))))) == EXPECTED
+
+def test_sam_small_chunks():
+    # lines split across chunks
+    assert list(best_read_scores(sam_alignment_scores(io.BytesIO(SAM), chunk_size=7))) == EXPECTED
+
+def test_bam_best_scores():
+    assert list(best_read_scores(alignment_scores(io.BufferedReader(io.BytesIO(_bam()))))) == EXPECTED
+
+def test_handle_without_peek():
+    zstandard = pytest.importorskip('zstandard')
+    compressed = zstandard.ZstdCompressor().compress(SAM)
+    handle = zstandard.ZstdDecompressor().stream_reader(io.BytesIO(compressed))
+    assert list(best_read_scores(alignment_scores(handle))) == EXPECTED
+
+def test_mapped_read_without_score():
+    with pytest.raises(ValueError):
+        list(alignment_scores(io.BufferedReader(io.BytesIO(b'read1\t0\tphix\t1\t60\t1M\t*\t0\t0\tA\tI\n'))))
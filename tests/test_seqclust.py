@@ -0,0 +1,65 @@
+import io
+
+import pytest
+
+from roskinlib.seqclust import ReadCDHITClusters, CDHITClustIterator, GreedyClustIterator
+
+# CDR3s of one length, clustered at 90% identity, s2 is at the cutoff from s1, s3 is just
+# below it and starts a cluster that s4 joins, s5 is a copy of s1 and s7 is too short
+SEQUENCES = [('s1', 'CARDYWGQGT'),
+             ('s2', 'CARDYWGQGA'),
+             ('s3', 'CARDYWGQAA'),
+             ('s4', 'CARDYWGTAA'),
+             ('s5', 'CARDYWGQGT'),
+             ('s6', 'GGGGGGGGGG'),
+             ('s7', 'CAR')]
+
+# the .clstr file from cd-hit -c 0.90 -n 5 -d 0 -l 4 -G 1 -g 1 -b 1 -t 0 for the sequences
+CDHIT_CLSTR = '''>Cluster 0
+0\t10aa, >s1... *
+1\t10aa, >s2... at 90.00%
+2\t10aa, >s5... at 100.00%
+>Cluster 1
+0\t10aa, >s3... *
+1\t10aa, >s4... at 90.00%
+>Cluster 2
+0\t10aa, >s6... *
+'''
+
+def _clusters(clusters):
+    return [(cluster.name, cluster.representative.name, [member.name for member in cluster]) for cluster in clusters]
+
+def test_greedy_matches_cdhit():
+    expected = _clusters(CDHITClustIterator(io.StringIO(CDHIT_CLSTR)))
+    assert _clusters(GreedyClustIterator(SEQUENCES, 0.90, throw_away_length=4)) == expected
+
+def test_greedy_identities():
+    identities = {member.name: member.identity for cluster in GreedyClustIterator(SEQUENCES, 0.90, throw_away_length=4)
+                  for member in cluster}
+    assert identities == {'s1': 100.0, 's2': 90.0, 's3': 100.0, 's4': 90.0, 's5': 100.0, 's6': 100.0}
+
+def test_read_cdhit_clusters():
+    clstr = '''header junk
+>Cluster 0
+0\t120nt, >read1... *
+1\t118nt, >read2... at 1:118:3:120/+/97.46%
+2\t119nt, >read3... at -/95.80%
+>Cluster 12
+0\t90nt, >read4 with spaces... *'''     # no newline at the end
+    # a small chunk size splits lines between chunks
+    table = ReadCDHITClusters(io.StringIO(clstr), chunk_size=7)
+    assert len(table) == 4
+    assert table.cluster_names == ['Cluster 0', 'Cluster 12']
+    assert list(table.cluster) == [0, 0, 0, 1]
+    assert table.name == ['read1', 'read2', 'read3', 'read4 with spaces']
+    assert list(table.length) == [120, 118, 119, 90]
+    assert list(table.identity) == [100.0, 97.46, 95.80, 100.0]
+    assert list(table.representative) == [1, 0, 0, 1]
+    assert (table.rep_start[1], table.rep_stop[1], table.member_start[1], table.member_stop[1]) == (1, 118, 3, 120)
+    assert table.rep_start[2] == -1
+    assert table.strand == [None, '+', '-', None]
+    assert table.cluster_number(1) == 12
+
+def test_read_cdhit_clusters_bad_line():
+    with pytest.raises(ValueError):
+        ReadCDHITClusters(io.StringIO('>Cluster 0\n0\t10aa, >s1... *\nnot a member line\n'))
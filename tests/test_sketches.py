@@ -0,0 +1,139 @@
+import json
+import math
+
+import pytest
+
+from roskinlib.sketches import HyperLogLog, CountMinSketch, ReservoirSample
+from roskinlib.stats import StatsEngine, DistinctCount, TopCounts, SketchGroups
+
+def round_trip(sketch):
+    # the partial results are saved as JSON
+    return type(sketch).from_state(json.loads(json.dumps(sketch.state())))
+
+@pytest.mark.parametrize('precision,count', [(10, 50), (10, 20000), (12, 100000)])
+def test_hyperloglog_estimate(precision, count):
+    sketch = HyperLogLog(precision)
+    for n in range(count):
+        sketch.add('value%d' % n)
+        sketch.add('value%d' % (n // 2))    # repeats don't count
+    # four times the standard error, so the test doesn't fail by chance
+    assert abs(sketch.estimate() - count) <= 4 * 1.04 / math.sqrt(2 ** precision) * count
+
+def test_hyperloglog_merge():
+    a, b, union = HyperLogLog(10), HyperLogLog(10), HyperLogLog(10)
+    for n in range(5000):
+        a.add(n)
+        union.add(n)
+    for n in range(3000, 9000):
+        b.add(n)
+        union.add(n)
+    a.merge(b)
+    assert a.registers == union.registers
+    assert a.estimate() == union.estimate()
+
+    restored = round_trip(a)
+    assert restored.registers == a.registers and restored.estimate() == a.estimate()
+
+    with pytest.raises(AssertionError):
+        a.merge(HyperLogLog(11))
+
+def _zipf_counts(values=500):
+    return {'clone%d' % n: 2000 // (n + 1) for n in range(values)}
+
+def test_count_min_estimate():
+    counts = _zipf_counts()
+    sketch = CountMinSketch(width=1024, depth=4, top_k=5)
+    for value, count in counts.items():
+        for _ in range(count):
+            sketch.add(value)
+    total = sum(counts.values())
+    for value, count in counts.items():
+        # never under, and over by at most e / width of the total with high probability
+        assert count <= sketch.estimate(value) <= count + math.e / 1024 * total
+    assert [value for value, _ in sketch.top()] == ['clone0', 'clone1', 'clone2', 'clone3', 'clone4']
+    assert sketch.top()[0][1] >= 2000
+
+def test_count_min_merge():
+    counts = _zipf_counts()
+    a, b, union = CountMinSketch(top_k=5), CountMinSketch(top_k=5), CountMinSketch(top_k=5)
+    for n, (value, count) in enumerate(counts.items()):
+        # split the counts of each value between the two sketches
+        a.add(value, count // 3 + n % 2)
+        b.add(value, count - count // 3 - n % 2)
+        union.add(value, count)
+    a.merge(b)
+    assert a.counters == union.counters
+    assert a.top() == union.top()
+
+    restored = round_trip(a)
+    assert restored.counters == a.counters and restored.top() == a.top()
+    assert restored.estimate('clone7') == a.estimate('clone7')
+
+    with pytest.raises(AssertionError):
+        a.merge(CountMinSketch(width=512))
+
+def test_reservoir_sample():
+    sample = ReservoirSample(10, seed=1)
+    for n in range(5):
+        sample.add(n)
+    # fewer items than the size are all kept, in the order they were added
+    assert sample.sample() == [0, 1, 2, 3, 4]
+
+    for n in range(5, 1000):
+        sample.add(n)
+    assert sample.count == 1000
+    kept = sample.sample()
+    assert len(kept) == 10 and len(set(kept)) == 10 and all(0 <= n < 1000 for n in kept)
+    assert kept == sorted(kept)
+
+def test_reservoir_sample_uniform():
+    # each item is kept with probability size / count
+    kept = [0] * 10
+    for seed in range(2000):
+        sample = ReservoirSample(2, seed=seed)
+        for n in range(10):
+            sample.add(n)
+        for n in sample.sample():
+            kept[n] += 1
+    assert all(abs(k - 400) < 80 for k in kept)
+
+def test_reservoir_sample_merge():
+    a, b = ReservoirSample(20, seed=1), ReservoirSample(20, seed=2)
+    for n in range(500):
+        a.add(('a', n))
+    for n in range(300):
+        b.add(('b', n))
+    # the merged sample is the items with the smallest priorities in either
+    priorities = sorted([(-p, item) for p, _, item in a.items + b.items])
+    a_before = round_trip(a)
+    a.merge(b)
+    assert a.count == 800
+    assert sorted(a.sample()) == sorted(item for _, item in priorities[:20])
+
+    a_before.merge(round_trip(b))
+    assert sorted(map(tuple, a_before.sample())) == sorted(a.sample())
+
+    with pytest.raises(AssertionError):
+        a.merge(ReservoirSample(5))
+
+def test_sketch_statistics():
+    assert issubclass(DistinctCount, SketchGroups) and issubclass(TopCounts, SketchGroups)
+    assert not issubclass(TopCounts, DistinctCount)
+
+    def record(subject, lineage):
+        return {'subject': subject, 'lineages': {'L': lineage}}
+    records = [record('A', 'c%d' % (n % 7)) for n in range(70)] + [record('B', 'c%d' % (n % 3)) for n in range(30)] + \
+              [record('B', 'c0') for _ in range(10)]
+
+    engines = []
+    for part in [records[:50], records[50:]]:
+        engine = StatsEngine(['distinct_lineages', 'top_clones'], lineage_label='L')
+        for r in part:
+            engine.add(r)
+        engines.append(StatsEngine.from_state(json.loads(json.dumps(engine.state()))))
+    engines[0].merge(engines[1])
+
+    assert list(engines[0].statistics['distinct_lineages'].rows()) == [('A', 7), ('B', 3)]
+    top_clones = list(engines[0].statistics['top_clones'].rows())
+    assert top_clones[:1] == [('A', 'c0', 10)] and ('B', 'c0', 20) in top_clones
+    assert len(top_clones) == 10
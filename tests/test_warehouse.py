@@ -0,0 +1,184 @@
+import json
+
+import pytest
+
+from roskinlib.warehouse import DirectoryWarehouse, PackedWarehouse, MANIFEST_FILENAME, \
+        PACKED_DATA_FILENAME, PACKED_INDEX_FILENAME, PACKED_LOCK_FILENAME
+
+KEYS = ('v_segment', 'j_segment', 'subject')
+
+def _write(warehouse, v_segment, j_segment, subject, text='>r\nCAR\n'):
+    with warehouse.open('.fasta', 'wt', v_segment=v_segment, j_segment=j_segment, subject=subject) as handle:
+        handle.write(text)
+
+def _fill(root):
+    warehouse = DirectoryWarehouse(root, *KEYS)
+    _write(warehouse, 'V1', 'J1', 'A')
+    _write(warehouse, 'V1', 'J1', 'B')
+    _write(warehouse, 'V1', 'J2', 'A')
+    _write(warehouse, 'V2', 'J1', 'C')
+    return warehouse
+
+def test_partition_queries(tmp_path):
+    _fill(tmp_path)
+    warehouse = DirectoryWarehouse(tmp_path, *KEYS)
+    assert sorted(warehouse.partitions('.fasta')) == [['V1', 'J1', 'A'], ['V1', 'J1', 'B'], ['V1', 'J2', 'A'], ['V2', 'J1', 'C']]
+    assert sorted(warehouse.partitions('.fasta', 'V1', 'J1')) == [['V1', 'J1', 'A'], ['V1', 'J1', 'B']]
+    assert sorted(warehouse.partitions('.fasta', subject='A')) == [['V1', 'J1', 'A'], ['V1', 'J2', 'A']]
+    assert sorted(warehouse.partitions('.fasta', subject=None)) == [['V1', 'J1'], ['V1', 'J2'], ['V2', 'J1']]
+    assert list(warehouse.partitions('.fasta', v_segment='V3')) == []
+    assert list(warehouse.partitions('.probe')) == []
+
+def test_index_follows_writes(tmp_path):
+    warehouse = _fill(tmp_path)
+    assert len(list(warehouse.partitions('.fasta'))) == 4
+    # once the index is built, partitions written with open() or filename() are added to it
+    _write(warehouse, 'V3', 'J1', 'A')
+    warehouse.filename('.fasta', 'V3', 'J2', 'B', write=True).write_text('>r\nCAR\n')
+    assert ['V3', 'J1', 'A'] in list(warehouse.partitions('.fasta'))
+    assert ['V3', 'J2', 'B'] in list(warehouse.partitions('.fasta'))
+
+def test_refresh(tmp_path):
+    warehouse = _fill(tmp_path)
+    assert len(list(warehouse.partitions('.fasta'))) == 4
+    # a file made behind the warehouse's back is only seen after a refresh
+    DirectoryWarehouse(tmp_path, *KEYS).filename('.fasta', 'V4', 'J1', 'D').write_text('>r\nCAR\n')
+    assert len(list(warehouse.partitions('.fasta'))) == 4
+    warehouse.refresh()
+    assert ['V4', 'J1', 'D'] in list(warehouse.partitions('.fasta'))
+
+def test_manifest(tmp_path):
+    _fill(tmp_path)
+    warehouse = DirectoryWarehouse(tmp_path, *KEYS, manifest=True)
+    expected = sorted(warehouse.partitions('.fasta'))
+    with (tmp_path / MANIFEST_FILENAME).open() as manifest_handle:
+        assert json.load(manifest_handle)['partition_keys'] == list(KEYS)
+
+    # the manifest is used instead of scanning the directories
+    reader = DirectoryWarehouse(tmp_path, *KEYS, manifest=True)
+    reader.filename('.fasta', 'V5', 'J1', 'E').write_text('>r\nCAR\n')
+    assert sorted(reader.partitions('.fasta')) == expected
+
+    # a writing warehouse keeps the manifest in step, with or without the index built
+    with DirectoryWarehouse(tmp_path, *KEYS, manifest=True) as writer:
+        _write(writer, 'V6', 'J1', 'F')
+    with DirectoryWarehouse(tmp_path, *KEYS, manifest=True) as writer:
+        list(writer.partitions('.fasta'))
+        _write(writer, 'V7', 'J1', 'G')
+    partitions = list(DirectoryWarehouse(tmp_path, *KEYS, manifest=True).partitions('.fasta'))
+    assert ['V6', 'J1', 'F'] in partitions and ['V7', 'J1', 'G'] in partitions
+
+    # refresh() drops the manifest and rescans
+    reader = DirectoryWarehouse(tmp_path, *KEYS, manifest=True)
+    reader.refresh()
+    assert ['V5', 'J1', 'E'] in list(reader.partitions('.fasta'))
+
+def test_manifest_other_keys(tmp_path):
+    _fill(tmp_path)
+    DirectoryWarehouse(tmp_path, *KEYS, manifest=True).save_manifest()
+    # a manifest for different partition keys is ignored
+    warehouse = DirectoryWarehouse(tmp_path, 'v_segment', 'j_segment', 'donor', manifest=True)
+    assert list(warehouse.partitions('.fasta')) == []
+
+def test_directories_made_once(tmp_path):
+    warehouse = _fill(tmp_path)
+    _write(warehouse, 'V1', 'J1', 'A')
+    assert warehouse.counters['directories_made'] == 3
+    assert warehouse.counters['partitions_opened'] == 5
+
+def test_writer_pool(tmp_path):
+    warehouse = DirectoryWarehouse(tmp_path, *KEYS)
+    with warehouse.writer('wt', max_open=2) as writer:
+        for i in range(10):
+            writer.write('.fasta', '>r%d\nCAR\n' % i, v_segment='V1', j_segment='J1', subject='S%d' % (i % 3))
+    assert warehouse.counters['writes'] == 10
+    assert warehouse.counters['handles_evicted'] > 0
+    # a partition reopened after being evicted is appended to, not rewritten
+    text = warehouse.filename('.fasta', 'V1', 'J1', 'S0').read_text()
+    assert text == ''.join('>r%d\nCAR\n' % i for i in range(0, 10, 3))
+
+def test_packed_round_trip(tmp_path):
+    warehouse = PackedWarehouse(tmp_path, *KEYS)
+    _write(warehouse, 'V1', 'J1', 'A', '>r1\nCAR\n')
+    _write(warehouse, 'V1', 'J2', 'B', '>r2\nCAK\n')
+    with warehouse.open('.fasta', 'at', v_segment='V1', j_segment='J1', subject='A') as handle:
+        handle.write('>r3\nCAT\n')
+    with warehouse.open('.bin', 'wb', v_segment='V2', j_segment='J1', subject='C') as handle:
+        handle.write(b'\x00\x01')
+    # appending to a missing partition makes it
+    with warehouse.open('.fasta', 'at', v_segment='V3', j_segment='J1', subject='D') as handle:
+        handle.write('>r4\nCAS\n')
+    warehouse.close()
+
+    # only the new data of an append is added, as a + entry in the index
+    assert (tmp_path / PACKED_DATA_FILENAME).stat().st_size == 4 * 8 + 2
+    index_lines = (tmp_path / PACKED_INDEX_FILENAME).read_text().splitlines()
+    assert index_lines[2] == '+16\t8\tv_segment=V1/j_segment=J1/subject=A.fasta'
+    assert not (tmp_path / PACKED_LOCK_FILENAME).exists()
+
+    reader = PackedWarehouse(tmp_path, *KEYS)
+    assert reader.open('.fasta', 'rt', v_segment='V1', j_segment='J1', subject='A').read() == '>r1\nCAR\n>r3\nCAT\n'
+    assert reader.open('.fasta', 'rt', v_segment='V3', j_segment='J1', subject='D').read() == '>r4\nCAS\n'
+    assert reader.open('.bin', 'rb', v_segment='V2', j_segment='J1', subject='C').read() == b'\x00\x01'
+    assert sorted(reader.partitions('.fasta')) == [['V1', 'J1', 'A'], ['V1', 'J2', 'B'], ['V3', 'J1', 'D']]
+    assert reader.exists('.fasta', 'V1', 'J2', 'B') and not reader.exists('.fasta', 'V1', 'J2', 'A')
+    with pytest.raises(FileNotFoundError):
+        reader.open('.fasta', 'rt', v_segment='V9', j_segment='J1', subject='A')
+
+def test_packed_rewrite_and_failed_write(tmp_path):
+    warehouse = PackedWarehouse(tmp_path, *KEYS)
+    _write(warehouse, 'V1', 'J1', 'A', '>old\nCAR\n')
+    _write(warehouse, 'V1', 'J1', 'A', '>new\nCAR\n')
+    # a with block that raises leaves the partition as it was
+    with pytest.raises(RuntimeError):
+        with warehouse.open('.fasta', 'wt', v_segment='V1', j_segment='J1', subject='A') as handle:
+            handle.write('>partial\n')
+            raise RuntimeError
+    with pytest.raises(RuntimeError):
+        with warehouse.open('.fasta', 'ab', v_segment='V1', j_segment='J1', subject='A') as handle:
+            handle.write(b'>partial\n')
+            raise RuntimeError
+    warehouse.close()
+    assert PackedWarehouse(tmp_path, *KEYS).open('.fasta', 'rt', v_segment='V1', j_segment='J1', subject='A').read() == '>new\nCAR\n'
+
+def test_packed_filename(tmp_path):
+    warehouse = PackedWarehouse(tmp_path, *KEYS)
+    _write(warehouse, 'V1', 'J1', 'A', '>r1\nCAR\n')
+    extracted = warehouse.filename('.fasta', 'V1', 'J1', 'A')
+    assert extracted.read_text() == '>r1\nCAR\n'
+    # a rewritten partition is extracted again
+    _write(warehouse, 'V1', 'J1', 'A', '>r2\nCAK\n')
+    assert warehouse.filename('.fasta', 'V1', 'J1', 'A').read_text() == '>r2\nCAK\n'
+    with pytest.raises(FileNotFoundError):
+        warehouse.filename('.fasta', 'V2', 'J1', 'A')
+    with pytest.raises(ValueError):
+        warehouse.filename('.fasta', 'V1', 'J1', 'A', write=True)
+    # close() removes the extracted files
+    warehouse.close()
+    assert not extracted.exists()
+    assert not extracted.parents[len(KEYS) - 1].exists()
+
+def test_packed_single_writer(tmp_path):
+    first = PackedWarehouse(tmp_path, *KEYS)
+    _write(first, 'V1', 'J1', 'A')
+    second = PackedWarehouse(tmp_path, *KEYS)
+    with pytest.raises(IOError):
+        _write(second, 'V1', 'J1', 'B')
+    first.close()
+    _write(second, 'V1', 'J1', 'B')
+    second.close()
+    assert sorted(PackedWarehouse(tmp_path, *KEYS).partitions('.fasta')) == [['V1', 'J1', 'A'], ['V1', 'J1', 'B']]
+
+def test_packed_partial_index_line(tmp_path):
+    warehouse = PackedWarehouse(tmp_path, *KEYS)
+    _write(warehouse, 'V1', 'J1', 'A')
+    warehouse.close()
+    # a writer that died part way through an index line
+    with (tmp_path / PACKED_INDEX_FILENAME).open('at') as index_handle:
+        index_handle.write('8\t8\tv_segment=V1/j_seg')
+    assert list(PackedWarehouse(tmp_path, *KEYS).partitions('.fasta')) == [['V1', 'J1', 'A']]
+    # and the next writer drops it
+    warehouse = PackedWarehouse(tmp_path, *KEYS)
+    _write(warehouse, 'V1', 'J1', 'B')
+    warehouse.close()
+    assert sorted(PackedWarehouse(tmp_path, *KEYS).partitions('.fasta')) == [['V1', 'J1', 'A'], ['V1', 'J1', 'B']]